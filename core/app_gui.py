@@ -6,14 +6,25 @@ import datetime
 import win32gui 
 import time 
 import sys  
+import re
 
-from windows_utils import get_active_windows, prevent_minimize_loop, get_window_rect, prevent_resize_loop
+from windows_utils import get_active_windows, get_window_client_rect, prevent_minimize_loop
 from ffmpeg_utils import get_dshow_audio_devices
 from config import DEFAULT_FRAMERATE, FFMPEG_PATH, NO_AUDIO_DEVICE_SELECTED, APP_ICON_PATH 
-from settings_manager import load_settings, save_settings
+from config import DEFAULT_MAX_OUTPUT_WIDTH, DEFAULT_MAX_OUTPUT_HEIGHT, DEFAULT_OUTPUT_SCALE, DEFAULT_SCALE_STAGE
+from config import DEFAULT_FRAME_QUEUE_POLICY, DEFAULT_FRAME_QUEUE_DEPTH, DEFAULT_RETARGET_BY_TITLE
+from config import DEFAULT_SIZE_BUDGET_MB, DEFAULT_EXPECTED_DURATION_MIN, DEFAULT_AUTO_TUNE_ENCODER, DEFAULT_VIDEO_CODEC_PROFILE
+from config import DEFAULT_PIPE_PIXEL_FORMAT, DEFAULT_CONVERT_THREADS, DEFAULT_FRAME_TRANSPORT, DEFAULT_PIPE_BUFFER_MB
+from config import DEFAULT_ENCODER_BACKEND
+from config import DEFAULT_SEGMENTED_RECORDING, DEFAULT_SEGMENT_DURATION_SEC, DEFAULT_RECOVER_UNFINISHED_RECORDINGS
+from config import DEFAULT_INCREMENTAL_MUX, DEFAULT_LIVE_AUDIO_MIX
+from frame_pipeline import compute_output_size
+from encoder_tuning import calibrate_encoder
+from settings_manager import load_settings, save_settings, get_window_crop, set_window_crop
 from log_viewer import LogViewerWindow, GLOBAL_LOG_BUFFER
 from gui_widgets import RecordingTimer, setup_entry_clipboard_shortcuts
-from ffmpeg_recorder import FFmpegRecorder 
+from ffmpeg_recorder import FFmpegRecorder, recover_recording_session
+from recording_session import find_unfinished_sessions
 
 class ScreenRecorderApp:
     def __init__(self, master):
@@ -49,14 +60,16 @@ class ScreenRecorderApp:
         
         self.is_recording = False
         self.prevent_minimize_thread = None; self.prevent_minimize_stop_event = None
-        self.prevent_resize_thread = None; self.prevent_resize_stop_event = None
-        self.initial_target_window_rect = None 
 
         self.recording_logic_thread = None; self.recorder_instance = None 
+        self.finalizing_threads = [] # Потоки stop_async остановленных записей (итоговый файл еще дописывается)
+        self.is_closing = False
         self.selected_hwnd = None; self.window_titles_map = {}
+        self.encoder_calibration_thread = None; self.encoder_calibration_stop_event = threading.Event()
         self.audio_devices = []; self.current_output_file = ""; self.recording_timer = None; self.settings = {} 
         
         self._setup_gui(); self._load_app_settings(); self.populate_window_list(); self.populate_audio_device_lists()
+        self._start_recording_recovery()
         master.protocol("WM_DELETE_WINDOW", self.on_closing)
 
     def _handle_critical_error_from_recorder(self, error_message):
@@ -81,25 +94,12 @@ class ScreenRecorderApp:
         self.prevent_minimize_stop_event = threading.Event()
         self.prevent_minimize_thread = threading.Thread(target=prevent_minimize_loop, args=(hwnd, self.prevent_minimize_stop_event, self.log_message), daemon=True)
         self.prevent_minimize_thread.start()
-        
-        rect_tuple = get_window_rect(hwnd) 
-        if rect_tuple == (0,0,0,0) and win32gui.IsWindow(hwnd): 
-            self.log_message(f"[AppGUI] ВНИМАНИЕ: GetWindowRect для HWND {hwnd} вернул (0,0,0,0). Защита от изменения размера может работать некорректно.")
-        self.initial_target_window_rect = rect_tuple 
-
-        self.prevent_resize_stop_event = threading.Event()
-        self.prevent_resize_thread = threading.Thread(target=prevent_resize_loop,args=(hwnd, self.initial_target_window_rect, self.prevent_resize_stop_event, self.log_message),daemon=True)
-        self.prevent_resize_thread.start()
+        # Изменение размера окна не блокируется: рекордер вписывает кадры в фиксированный холст (CanvasFitter)
 
     def _stop_window_protection_threads(self):
         if self.prevent_minimize_thread and self.prevent_minimize_thread.is_alive():
             if self.prevent_minimize_stop_event: self.prevent_minimize_stop_event.set()
         self.prevent_minimize_thread = None; self.prevent_minimize_stop_event = None
-        
-        if self.prevent_resize_thread and self.prevent_resize_thread.is_alive():
-            if self.prevent_resize_stop_event: self.prevent_resize_stop_event.set()
-        self.prevent_resize_thread = None; self.prevent_resize_stop_event = None
-        self.initial_target_window_rect = None
 
     def log_message(self, message):
         ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
@@ -117,6 +117,10 @@ class ScreenRecorderApp:
         tk.Label(self.master, text="Окно:").grid(row=r, column=0, padx=5, pady=5, sticky="w")
         self.window_combo = ttk.Combobox(self.master, width=75, state="readonly"); self.window_combo.grid(row=r, column=1, padx=5, pady=5, sticky="ew")
         self.refresh_windows_button = tk.Button(self.master, text="Обновить", command=self.populate_window_list); self.refresh_windows_button.grid(row=r, column=2, padx=5, pady=5); r+=1
+        self.window_combo.bind("<<ComboboxSelected>>", self._on_window_selected)
+        tk.Label(self.master, text="Обрезка:").grid(row=r, column=0, padx=5, pady=5, sticky="w")
+        self.crop_entry = tk.Entry(self.master, width=75); self.crop_entry.grid(row=r, column=1, padx=5, pady=5, sticky="ew"); setup_entry_clipboard_shortcuts(self.crop_entry)
+        tk.Label(self.master, text="x,y,ширина,высота").grid(row=r, column=2, padx=5, pady=5, sticky="w"); r+=1
         tk.Label(self.master, text="Папка:").grid(row=r, column=0, padx=5, pady=5, sticky="w")
         self.output_dir_entry = tk.Entry(self.master, width=75); self.output_dir_entry.grid(row=r, column=1, padx=5, pady=5, sticky="ew"); setup_entry_clipboard_shortcuts(self.output_dir_entry)
         self.browse_button = tk.Button(self.master, text="Обзор...", command=self.select_output_directory); self.browse_button.grid(row=r, column=2, padx=5, pady=5); r+=1
@@ -134,7 +138,8 @@ class ScreenRecorderApp:
         r+=1
         s_frame = ttk.Frame(self.master); s_frame.grid(row=r,column=0,columnspan=3,sticky="ew",padx=5,pady=5); s_frame.columnconfigure(0,weight=1)
         self.status_label = tk.Label(s_frame, text="Статус: Ожидание", relief=tk.SUNKEN, anchor="w"); self.status_label.grid(row=0,column=0,sticky="ew",padx=(0,5))
-        self.show_logs_button = tk.Button(s_frame, text="Логи", command=self.show_log_window); self.show_logs_button.grid(row=0,column=1,sticky="e",padx=(5,0)); self.master.grid_columnconfigure(1,weight=1)
+        self.calibrate_button = tk.Button(s_frame, text="Калибровка", command=self._start_encoder_calibration); self.calibrate_button.grid(row=0,column=1,sticky="e",padx=(5,0))
+        self.show_logs_button = tk.Button(s_frame, text="Логи", command=self.show_log_window); self.show_logs_button.grid(row=0,column=2,sticky="e",padx=(5,0)); self.master.grid_columnconfigure(1,weight=1)
 
     def _load_app_settings(self):
         self.log_message("[AppGUI] Загрузка настроек...")
@@ -154,25 +159,111 @@ class ScreenRecorderApp:
 
     def _save_app_settings(self):
         self.log_message("[AppGUI] Сохранение настроек...")
-        settings_to_save = { 
+        settings_to_save = dict(self.settings) if self.settings else {} # Ключи без виджетов (выходное разрешение и т.п.) сохраняются как есть
+        settings_to_save.update({ 
             "output_directory": self.output_dir_entry.get(), 
             "selected_window_title": self.window_combo.get(), 
             "mic_device": self.mic_device_combo.get(), 
             "system_audio_1": self.system_audio_device_combo1.get(), 
             "system_audio_2": self.system_audio_device_combo2.get(), 
-        }
+        })
         save_settings(settings_to_save, self.log_message) 
 
     def toggle_recording(self): 
         if self.is_recording: self.stop_recording()
         else: self.start_recording_async()
 
+    def _on_window_selected(self, event=None):
+        self._load_crop_for_selected_window()
+
+    def _get_calibration_size(self):
+        # Размер, который будет кодироваться для выбранного окна (с ограничением разрешения); None - окна нет
+        hwnd = self.window_titles_map.get(self.window_combo.get())
+        if not hwnd: return None
+        client_rect = get_window_client_rect(hwnd)
+        if client_rect["width"] <= 0 or client_rect["height"] <= 0: return None
+        return compute_output_size(client_rect["width"] // 2 * 2, client_rect["height"] // 2 * 2,
+                                   self.settings.get("max_output_width", DEFAULT_MAX_OUTPUT_WIDTH),
+                                   self.settings.get("max_output_height", DEFAULT_MAX_OUTPUT_HEIGHT),
+                                   self.settings.get("output_scale", DEFAULT_OUTPUT_SCALE))
+
+    def _start_encoder_calibration(self):
+        # Только по кнопке: калибровка на несколько секунд занимает все ядра. Результат - в кэш для этого разрешения и сборки ffmpeg
+        if self.is_recording: return
+        if self.encoder_calibration_thread and self.encoder_calibration_thread.is_alive(): return
+        size = self._get_calibration_size()
+        if size is None: self.status_label.config(text="Статус: Калибровка - не выбрано окно."); return
+        out_w, out_h = size
+        video_codec = self.settings.get("video_codec", DEFAULT_VIDEO_CODEC_PROFILE)
+        self.encoder_calibration_stop_event.clear()
+        self.calibrate_button.config(state="disabled")
+        self.status_label.config(text=f"Статус: Калибровка кодировщика {video_codec} {out_w}x{out_h}...")
+        self.encoder_calibration_thread = threading.Thread(target=self._run_encoder_calibration, args=(out_w, out_h, video_codec), daemon=True)
+        self.encoder_calibration_thread.start()
+
+    def _run_encoder_calibration(self, width, height, video_codec):
+        tuning = None
+        try: tuning = calibrate_encoder(width, height, DEFAULT_FRAMERATE, codec_profile=video_codec, logger_func=self.log_message,
+                                        stop_event=self.encoder_calibration_stop_event)
+        except Exception as e_calibration: self.log_message(f"[AppGUI] Калибровка кодировщика не удалась: {e_calibration}")
+        self._post_to_gui(self._on_encoder_calibration_finished, tuning)
+
+    def _on_encoder_calibration_finished(self, tuning):
+        if self.is_recording: return # Прервана началом записи: кнопкой и статусом управляет запись
+        self.calibrate_button.config(state="normal")
+        self.status_label.config(text=f"Статус: Калибровка: {tuning.describe()}." if tuning else "Статус: Калибровка не завершена (см. логи).")
+
+    def _start_recording_recovery(self):
+        # Сегменты записей, прерванных сбоем приложения, собираются в mp4 в фоне, не задерживая запуск
+        if not self.settings.get("recover_unfinished_recordings", DEFAULT_RECOVER_UNFINISHED_RECORDINGS): return
+        threading.Thread(target=self._recover_unfinished_recordings, daemon=True).start()
+
+    def _recover_unfinished_recordings(self):
+        for session in find_unfinished_sessions():
+            self.log_message(f"[AppGUI] Найдена прерванная запись: {session.manifest.get('final_output')} ({session.session_dir}).")
+            try: recover_recording_session(session, self.log_message)
+            except Exception as e_recovery: self.log_message(f"[AppGUI] Восстановление записи не удалось: {e_recovery}")
+
+    def _stop_encoder_calibration(self):
+        # Запись не делит CPU с калибровкой: прерванную можно повторить кнопкой после записи
+        if not (self.encoder_calibration_thread and self.encoder_calibration_thread.is_alive()): return
+        self.log_message("[AppGUI] Калибровка кодировщика прервана (начало записи).")
+        self.encoder_calibration_stop_event.set(); self.encoder_calibration_thread.join(timeout=5.0)
+
+    def _load_crop_for_selected_window(self, event=None):
+        crop = get_window_crop(self.settings, self.window_combo.get())
+        self.crop_entry.delete(0, tk.END)
+        if crop: self.crop_entry.insert(0, f"{crop['x']},{crop['y']},{crop['width']},{crop['height']}")
+
+    def _get_retarget_title_pattern(self, window_title):
+        # Шаблон поиска окна, пересозданного клиентом во время записи; None - потеря окна завершает запись
+        if not self.settings.get("retarget_by_title", DEFAULT_RETARGET_BY_TITLE): return None
+        return self.settings.get("retarget_title_pattern") or re.escape(window_title)
+
+    def _get_crop_for_recording(self, window_title, hwnd):
+        # Пустое поле - все окно. Новая область привязывается к текущему размеру клиентской области окна.
+        crop_text = self.crop_entry.get().strip()
+        if not crop_text: set_window_crop(self.settings, window_title, None); return None
+        parts = [part.strip() for part in crop_text.split(",")]
+        if len(parts) != 4 or not all(part.isdigit() for part in parts):
+            self.log_message(f"[AppGUI] Некорректная обрезка '{crop_text}' (нужно x,y,ширина,высота). Записывается все окно."); return None
+        x, y, width, height = map(int, parts)
+        saved_crop = get_window_crop(self.settings, window_title)
+        if saved_crop and (saved_crop["x"], saved_crop["y"], saved_crop["width"], saved_crop["height"]) == (x, y, width, height):
+            return saved_crop
+        client_left, client_top, client_right, client_bottom = win32gui.GetClientRect(hwnd)
+        crop = {"x": x, "y": y, "width": width, "height": height,
+                "reference_width": client_right - client_left, "reference_height": client_bottom - client_top}
+        set_window_crop(self.settings, window_title, crop)
+        return crop
+
     def populate_window_list(self):
         self.window_combo['values']=[]; self.window_titles_map=get_active_windows(); st=sorted(self.window_titles_map.keys()); self.window_combo['values']=st
         swt = self.settings.get("selected_window_title") if self.settings else None
         if swt and swt in st: self.window_combo.set(swt)
         elif st: self.window_combo.current(0)
         else: self.window_combo.set("") 
+        self._on_window_selected()
         if not self.is_recording: self.status_label.config(text="Статус: Окна обновлены."); self.log_message("[AppGUI] Окна обновлены.")
 
     def populate_audio_device_lists(self):
@@ -357,15 +448,38 @@ class ScreenRecorderApp:
         if self.master and self.master.winfo_exists(): # Если мастер есть, делаем нормальный коллбэк
             callback_lambda = lambda err_msg: self.master.after(0, self._handle_critical_error_from_recorder, err_msg)
         
+        self._stop_encoder_calibration()
         self.recorder_instance = FFmpegRecorder(
             hwnd=self.selected_hwnd, output_file=self.current_output_file, 
             audio_device_names_list=selected_audio_devices_list, framerate=DEFAULT_FRAMERATE, 
             logger_func=self.log_message,
-            on_critical_error_callback=callback_lambda
+            on_critical_error_callback=callback_lambda,
+            max_output_width=self.settings.get("max_output_width", DEFAULT_MAX_OUTPUT_WIDTH),
+            max_output_height=self.settings.get("max_output_height", DEFAULT_MAX_OUTPUT_HEIGHT),
+            output_scale=self.settings.get("output_scale", DEFAULT_OUTPUT_SCALE),
+            scale_stage=self.settings.get("scale_stage", DEFAULT_SCALE_STAGE),
+            frame_queue_policy=self.settings.get("frame_queue_policy", DEFAULT_FRAME_QUEUE_POLICY),
+            frame_queue_depth=self.settings.get("frame_queue_depth", DEFAULT_FRAME_QUEUE_DEPTH),
+            size_budget_mb=self.settings.get("size_budget_mb", DEFAULT_SIZE_BUDGET_MB),
+            expected_duration_min=self.settings.get("expected_duration_min", DEFAULT_EXPECTED_DURATION_MIN),
+            auto_tune_encoder=self.settings.get("auto_tune_encoder", DEFAULT_AUTO_TUNE_ENCODER),
+            video_codec=self.settings.get("video_codec", DEFAULT_VIDEO_CODEC_PROFILE),
+            pipe_pixel_format=self.settings.get("pipe_pixel_format", DEFAULT_PIPE_PIXEL_FORMAT),
+            convert_threads=self.settings.get("convert_threads", DEFAULT_CONVERT_THREADS),
+            frame_transport=self.settings.get("frame_transport", DEFAULT_FRAME_TRANSPORT),
+            pipe_buffer_mb=self.settings.get("pipe_buffer_mb", DEFAULT_PIPE_BUFFER_MB),
+            encoder_backend=self.settings.get("encoder_backend", DEFAULT_ENCODER_BACKEND),
+            segmented_recording=self.settings.get("segmented_recording", DEFAULT_SEGMENTED_RECORDING),
+            segment_duration_sec=self.settings.get("segment_duration_sec", DEFAULT_SEGMENT_DURATION_SEC),
+            mp4_layout=self.settings.get("mp4_layout"), # None - раскладка из профиля кодека
+            incremental_mux=self.settings.get("incremental_mux", DEFAULT_INCREMENTAL_MUX),
+            live_audio_mix=self.settings.get("live_audio_mix", DEFAULT_LIVE_AUDIO_MIX),
+            crop=self._get_crop_for_recording(selected_window_title_str, self.selected_hwnd),
+            target_title_pattern=self._get_retarget_title_pattern(selected_window_title_str)
         )
         if self.recording_timer: # Проверяем, что таймер существует
             self.recording_timer.set_source(
-                get_frames_callback=lambda: self.recorder_instance.get_frames_written() if self.recorder_instance else 0,
+                get_frames_callback=lambda: self.recorder_instance.get_frames_recorded() if self.recorder_instance else 0,
                 target_fps=self.recorder_instance.framerate 
             )
         
@@ -389,9 +503,11 @@ class ScreenRecorderApp:
         
         widgets_to_update_state = [
             (self.output_dir_entry, entry_state),
+            (self.crop_entry, entry_state),
             (self.browse_button, button_state),
             (self.refresh_windows_button, button_state),
-            (self.refresh_audio_button, button_state)
+            (self.refresh_audio_button, button_state),
+            (self.calibrate_button, button_state)
         ]
         combo_state = "disabled" if is_starting_or_is_recording else "readonly"
         combos_to_update_state = [
@@ -426,27 +542,56 @@ class ScreenRecorderApp:
             return
             
         self.log_message("[AppGUI] Пользователь остановил запись.")
-        if hasattr(self.status_label, 'winfo_exists') and self.status_label.winfo_exists():
-            self.status_label.config(text="Статус: Остановка записи..."); 
-            if self.master and self.master.winfo_exists(): self.master.update_idletasks()
-        
         self._stop_window_protection_threads() 
         
-        error_msg_stop = self.recorder_instance.stop() 
-        self.is_recording = False 
-        
+        # Остановка процессов и сборка итогового файла - в потоке финализации рекордера: окно сразу готово к новой записи
+        recorder, output_file = self.recorder_instance, self.current_output_file
+        self.is_recording = False; self.recorder_instance = None; self.current_output_file = ""
+        self._update_gui_for_recording_state(False)
+        if self.recording_timer and self.recording_timer.is_running: self.recording_timer.stop() 
+        if self.recording_timer: self.recording_timer.reset() 
+        self._show_finalize_progress("остановка записи", 0.0)
+        self.finalizing_threads.append(recorder.stop_async(
+            on_finished=lambda error_msg_stop: self._post_to_gui(self._on_recording_finalized, output_file, error_msg_stop),
+            on_progress=lambda stage_text, fraction: self._post_to_gui(self._show_finalize_progress, stage_text, fraction)))
+
+    def _post_to_gui(self, callback, *args):
+        # Вызов из потока финализации; при закрытии окна события уже не принимаются
+        if self.is_closing: return
+        try: self.master.after(0, callback, *args)
+        except (RuntimeError, tk.TclError): pass
+
+    def _show_finalize_progress(self, stage_text, fraction):
+        if self.is_recording: return # Уже идет новая запись, статус - ее
+        if hasattr(self.status_label, 'winfo_exists') and self.status_label.winfo_exists():
+            self.status_label.config(text=f"Статус: Сохранение записи: {stage_text} ({fraction:.0%})")
+
+    def _on_recording_finalized(self, output_file, error_msg_stop):
+        self.finalizing_threads = [thread for thread in self.finalizing_threads if thread.is_alive()]
         if error_msg_stop: 
             self.log_message(f"[AppGUI] Ошибка при остановке FFmpegRecorder: {error_msg_stop}")
-            self._handle_recording_result(False, f"Ошибка остановки: {error_msg_stop}")
+            if self.master and self.master.winfo_exists():
+                messagebox.showerror("Ошибка записи/остановки", f"Произошла ошибка:\nОшибка остановки: {error_msg_stop}\n\nСм. логи.", parent=self.master)
+            status_text = f"Статус: Ошибка (Ошибка остановки: {error_msg_stop[:100]}...)."
         else: 
-            self.log_message("[AppGUI] FFmpegRecorder успешно остановлен.")
-            self._handle_recording_result(True, "Запись успешно остановлена.") 
-            
-        self.recorder_instance = None 
-        self.current_output_file = "" 
+            self.log_message(f"[AppGUI] FFmpegRecorder успешно остановлен: {output_file}")
+            status_text = f"Статус: Запись успешно остановлена. {os.path.basename(output_file)}"
+        if not self.is_recording and hasattr(self.status_label, 'winfo_exists') and self.status_label.winfo_exists():
+            self.status_label.config(text=status_text)
+
+    def _wait_for_finalizing_recordings(self):
+        # Итоговые файлы дописываются в потоках stop_async; окно обрабатывает их события, пока они не закончат
+        pending_threads = [thread for thread in self.finalizing_threads if thread.is_alive()]
+        if pending_threads: self.log_message(f"[AppGUI] Ожидание сохранения записей ({len(pending_threads)})...")
+        for thread in pending_threads:
+            while thread.is_alive():
+                thread.join(timeout=0.05)
+                if self.master and self.master.winfo_exists(): self.master.update()
+        self.finalizing_threads = []
 
 
     def on_closing(self): 
+        if self.is_closing: return # Повторное закрытие, пока дописываются записи
         close_app = True
         if self.is_recording:
             can_show_messagebox = self.master and self.master.winfo_exists() and messagebox
@@ -463,6 +608,8 @@ class ScreenRecorderApp:
                 self.stop_recording() 
             
             self._stop_window_protection_threads() 
+            self.is_closing = True
+            self._wait_for_finalizing_recordings()
             
             if self.recording_logic_thread and self.recording_logic_thread.is_alive():
                 self.log_message("[AppGUI] Ожидание завершения потока логики записи...")
@@ -0,0 +1,875 @@
+import argparse
+import ctypes
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from frame_buffers import dib_frame_view, write_frame_buffer, BGRA_BYTES_PER_PIXEL, BGR_BYTES_PER_PIXEL
+from frame_pipeline import OutputScaler, compute_output_size, build_conversion_filter
+from synthetic_source import SyntheticFrameSource, SYNTHETIC_PROFILES, SYNTHETIC_PROFILE_MEETING, SYNTHETIC_PROFILE_SCROLL
+from synthetic_source import SYNTHETIC_PROFILE_STATIC, SYNTHETIC_PROFILE_PERIODIC
+from config import CAPTURE_METHOD_SYNTHETIC, CAPTURE_METHOD_MSS, DEFAULT_ENCODER_TUNING_HEADROOM, DEFAULT_VIDEO_CODEC_PROFILE
+from config import PIPE_PIXEL_FORMAT_BGR0, PIPE_PIXEL_FORMAT_BGRA, PIPE_PIXEL_FORMAT_BGR24
+from config import FRAME_TRANSPORT_PIPE, FRAME_TRANSPORT_NAMED_PIPE, DEFAULT_PIPE_BUFFER_MB
+from config import ENCODER_BACKEND_SUBPROCESS, ENCODER_BACKEND_PYAV
+from config import MP4_LAYOUT_FASTSTART, MP4_LAYOUT_FRAGMENTED, MP4_LAYOUT_MOOV_END, DEFAULT_SEGMENT_DURATION_SEC
+from config import DEFAULT_MAX_REPEAT_INTERVAL_SEC, DEFAULT_CHANGE_SAMPLE_STEP
+from encoder_tuning import calibrate_encoder, get_ffmpeg_build_id
+from codec_profiles import get_codec_profile, get_codec_profile_names, probe_codec_profile
+from frame_transport import create_frame_transport
+from pyav_encoder import PyAVVideoEncoder, probe_pyav_codec_profile, describe_pyav
+
+
+def _parse_size(size_str):
+    width_str, height_str = size_str.lower().split("x")
+    return int(width_str), int(height_str)
+
+
+def _print_results(title, results):
+    print(f"[Benchmarks] {title}")
+    for row in results:
+        print("  " + ", ".join(f"{key}={value}" for key, value in row.items()))
+
+
+def _write_json(path, payload):
+    if not path: return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    print(f"[Benchmarks] Результаты сохранены в: {path}")
+
+
+# --- frame-copy: стоимость пути кадра от DIBSection до stdin ffmpeg ---
+
+def _make_fake_dib(width, height):
+    # Имитация памяти DIBSection: непрерывный ctypes-буфер BGRA с адресом, как у pBitmapBits.value
+    buffer_size = width * height * BGRA_BYTES_PER_PIXEL
+    fake_dib = (ctypes.c_uint8 * buffer_size)()
+    np.frombuffer(fake_dib, dtype=np.uint8)[:] = np.random.default_rng(1).integers(0, 256, buffer_size, dtype=np.uint8)
+    return fake_dib, ctypes.addressof(fake_dib)
+
+
+def _legacy_frame_path(bits_address, width, height, sink):
+    import cv2
+    # Прежний путь: string_at (копия 1) -> cvtColor BGRA2BGR (копия 2) -> tobytes (копия 3) -> write
+    image_bytes = ctypes.string_at(bits_address, width * height * BGRA_BYTES_PER_PIXEL)
+    img_bgra = np.frombuffer(image_bytes, dtype=np.uint8).reshape((height, width, BGRA_BYTES_PER_PIXEL))
+    frame_bgr = cv2.cvtColor(img_bgra, cv2.COLOR_BGRA2BGR)
+    sink.write(frame_bgr.tobytes())
+
+
+def _zero_copy_frame_path(frame_view, sink):
+    write_frame_buffer(sink, frame_view)
+
+
+def run_frame_copy_benchmark(width, height, frames):
+    fake_dib, bits_address = _make_fake_dib(width, height)
+    frame_view = dib_frame_view(bits_address, width, height) # Создается один раз, как в граббере
+    pixels = width * height
+    results = []
+    with open(os.devnull, "wb", buffering=0) as sink: # Тот же тип потока, что и stdin ffmpeg при bufsize=0
+        paths = [
+            ("legacy_bgr24", lambda: _legacy_frame_path(bits_address, width, height, sink),
+             pixels * (BGRA_BYTES_PER_PIXEL + 2 * BGR_BYTES_PER_PIXEL), pixels * BGR_BYTES_PER_PIXEL),
+            ("zero_copy_bgra", lambda: _zero_copy_frame_path(frame_view, sink),
+             0, pixels * BGRA_BYTES_PER_PIXEL),
+        ]
+        for name, frame_func, copied_bytes, piped_bytes in paths:
+            frame_func() # Прогрев
+            start_time = time.perf_counter()
+            for _ in range(frames): frame_func()
+            elapsed = time.perf_counter() - start_time
+            results.append({
+                "path": name, "size": f"{width}x{height}", "frames": frames,
+                "python_bytes_copied_per_frame": copied_bytes,
+                "pipe_bytes_per_frame": piped_bytes,
+                "ms_per_frame": round(elapsed * 1000.0 / frames, 3),
+                "copy_mb_per_sec_at_25fps": round(copied_bytes * 25 / 1e6, 1),
+            })
+    del frame_view, fake_dib
+    return results
+
+
+# --- scale: CPU кодировщика и байты в минуту при исходном и ограниченном разрешении ---
+
+def _make_synthetic_frame_func(width, height, profile):
+    # Кадры синтетического источника в один заранее выделенный буфер
+    source = SyntheticFrameSource(width, height, profile=profile, logger_func=lambda message: None)
+    source.open()
+    frame = np.empty((height, width, BGRA_BYTES_PER_PIXEL), dtype=np.uint8)
+
+    def next_frame(index):
+        source.grab_into(frame)
+        return frame
+    return next_frame
+
+
+def _encode_benchmark_run(ffmpeg_path, frame_source, width, height, out_size, frames, framerate, preset, crf, stage,
+                          codec=DEFAULT_VIDEO_CODEC_PROFILE):
+    scaler = OutputScaler(*out_size) if out_size != (width, height) else None
+    pipe_w, pipe_h = out_size if scaler and stage == "python" else (width, height)
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4", prefix="_bench_scale_"); temp_file.close()
+    command = [ffmpeg_path, '-hide_banner', '-nostats', '-benchmark', '-f', 'rawvideo', '-pix_fmt', 'bgra',
+               '-s', f'{pipe_w}x{pipe_h}', '-framerate', str(framerate), '-i', 'pipe:0']
+    if scaler and stage == "ffmpeg": command.extend(['-vf', scaler.ffmpeg_filter()])
+    command.extend(get_codec_profile(codec).encoder_args(preset, crf=int(crf)) + ['-y', temp_file.name])
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    scale_seconds = 0.0
+    try:
+        for index in range(frames):
+            frame = frame_source(index)
+            if scaler and stage == "python":
+                scale_start = time.perf_counter()
+                frame = scaler.scale(frame)
+                scale_seconds += time.perf_counter() - scale_start
+            write_frame_buffer(process.stdin, frame)
+    finally:
+        process.stdin.close()
+        stderr_text = process.stderr.read().decode("utf-8", errors="ignore"); process.wait()
+    output_bytes = os.path.getsize(temp_file.name) if os.path.exists(temp_file.name) else 0
+    os.remove(temp_file.name)
+    bench_match = re.search(r"bench: utime=([\d.]+)s stime=([\d.]+)s", stderr_text)
+    encoder_cpu_seconds = float(bench_match.group(1)) + float(bench_match.group(2)) if bench_match else None
+    duration_minutes = frames / framerate / 60.0
+    return {
+        "size": f"{out_size[0]}x{out_size[1]}", "stage": stage if scaler else "native", "frames": frames,
+        "scale_ms_per_frame": round(scale_seconds * 1000.0 / frames, 2) if scaler and stage == "python" else 0,
+        "encoder_cpu_sec_per_min": round(encoder_cpu_seconds / duration_minutes, 1) if encoder_cpu_seconds is not None else None,
+        "mb_per_min": round(output_bytes / 1e6 / duration_minutes, 2),
+        "mb_per_3h": round(output_bytes / 1e6 / duration_minutes * 180, 0),
+        "ffmpeg_returncode": process.returncode,
+    }
+
+
+def run_scale_benchmark(width, height, max_heights, seconds, framerate, preset, crf, stage, ffmpeg_path="ffmpeg",
+                        profile=SYNTHETIC_PROFILE_MEETING):
+    frame_source = _make_synthetic_frame_func(width, height, profile)
+    frames = max(1, int(seconds * framerate))
+    out_sizes = [(width, height)]
+    for max_height in max_heights:
+        out_size = compute_output_size(width, height, max_height=max_height)
+        if out_size not in out_sizes: out_sizes.append(out_size)
+    return [_encode_benchmark_run(ffmpeg_path, frame_source, width, height, out_size, frames, framerate, preset, crf, stage)
+            for out_size in out_sizes]
+
+
+# --- codecs: профили кодеков на одном и том же синтетическом клипе ---
+
+def run_codec_benchmark(width, height, seconds, framerate, preset, crf, codec_names=None, ffmpeg_path="ffmpeg",
+                        profile=SYNTHETIC_PROFILE_MEETING):
+    # Недоступные на этой сборке ffmpeg профили тоже попадают в отчет - с причиной
+    frames = max(1, int(seconds * framerate))
+    results = []
+    for codec in codec_names or get_codec_profile_names():
+        available, reason = probe_codec_profile(codec, ffmpeg_path)
+        if not available:
+            results.append({"codec": codec, "encoder": get_codec_profile(codec).encoder, "available": False, "reason": reason}); continue
+        frame_source = _make_synthetic_frame_func(width, height, profile) # Для каждого профиля клип с первого кадра
+        result = _encode_benchmark_run(ffmpeg_path, frame_source, width, height, (width, height), frames, framerate, preset, crf,
+                                       "python", codec)
+        results.append(dict({"codec": codec, "encoder": get_codec_profile(codec).encoder, "available": True,
+                             "quality": get_codec_profile(codec).quality(int(crf))}, **result))
+    return results
+
+
+# --- pixfmt: формат pipe (преобразование цвета в Python или в ffmpeg), CPU на кадр ---
+
+def _pixfmt_benchmark_run(ffmpeg_path, frames_pool, width, height, frames, framerate, pixel_format, threads, codec, preset, crf,
+                          convert_only):
+    # Python: как поток записи FFmpegRecorder (bgr24 - cvtColor на каждый кадр, bgr0/bgra - кадр слота как есть)
+    import cv2
+    profile = get_codec_profile(codec)
+    command = [ffmpeg_path, '-hide_banner', '-nostats', '-benchmark', '-f', 'rawvideo', '-pix_fmt', pixel_format,
+               '-s', f'{width}x{height}', '-framerate', str(framerate), '-i', 'pipe:0',
+               '-vf', build_conversion_filter(profile.pix_fmt, threads=threads)]
+    command.extend((['-f', 'null', '-']) if convert_only else (profile.encoder_args(preset, crf=int(crf)) + ['-f', 'null', '-']))
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    convert_cpu_seconds = 0.0
+    python_cpu_start = time.process_time()
+    try:
+        for index in range(frames):
+            frame = frames_pool[index % len(frames_pool)]
+            if pixel_format == PIPE_PIXEL_FORMAT_BGR24:
+                convert_start = time.process_time()
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+                convert_cpu_seconds += time.process_time() - convert_start
+            write_frame_buffer(process.stdin, frame)
+    finally:
+        process.stdin.close()
+        stderr_text = process.stderr.read().decode("utf-8", errors="ignore"); process.wait()
+    python_cpu_seconds = time.process_time() - python_cpu_start
+    bench_match = re.search(r"bench: utime=([\d.]+)s stime=([\d.]+)s", stderr_text)
+    ffmpeg_cpu_seconds = float(bench_match.group(1)) + float(bench_match.group(2)) if bench_match else None
+    return {
+        "pipe_format": pixel_format, "swscale_threads": threads or "auto", "frames": frames,
+        "pipe_mb_per_frame": round(frames_pool[0].shape[0] * frames_pool[0].shape[1] * (3 if pixel_format == PIPE_PIXEL_FORMAT_BGR24 else 4) / 1e6, 2),
+        "python_convert_ms_per_frame": round(convert_cpu_seconds * 1000.0 / frames, 2),
+        "python_cpu_ms_per_frame": round(python_cpu_seconds * 1000.0 / frames, 2),
+        "ffmpeg_cpu_ms_per_frame": round(ffmpeg_cpu_seconds * 1000.0 / frames, 2) if ffmpeg_cpu_seconds is not None else None,
+        "total_cpu_ms_per_frame": round((python_cpu_seconds + ffmpeg_cpu_seconds) * 1000.0 / frames, 2) if ffmpeg_cpu_seconds is not None else None,
+        "ffmpeg_returncode": process.returncode,
+    }
+
+
+def run_pixfmt_benchmark(width, height, seconds, framerate, pixel_formats=None, thread_counts=(1, 0), codec=DEFAULT_VIDEO_CODEC_PROFILE,
+                         preset="medium", crf="28", convert_only=False, ffmpeg_path="ffmpeg", profile=SYNTHETIC_PROFILE_MEETING):
+    # Кадры рендерятся заранее (пул из 8): генерация синтетики не входит в CPU Python
+    frame_source = _make_synthetic_frame_func(width, height, profile)
+    frames_pool = [frame_source(index).copy() for index in range(8)]
+    frames = max(1, int(seconds * framerate))
+    return [_pixfmt_benchmark_run(ffmpeg_path, frames_pool, width, height, frames, framerate, pixel_format, threads, codec, preset, crf,
+                                  convert_only)
+            for pixel_format in (pixel_formats or (PIPE_PIXEL_FORMAT_BGR24, PIPE_PIXEL_FORMAT_BGRA, PIPE_PIXEL_FORMAT_BGR0))
+            for threads in thread_counts]
+
+
+# --- transport: пропускная способность канала кадров в ffmpeg ---
+
+def _transport_benchmark_run(ffmpeg_path, frame, frames, transport_name, buffer_size, copy_to_bytes):
+    # ffmpeg только читает кадры (-c copy в null): измеряется канал, а не кодировщик
+    height, width = frame.shape[:2]
+    transport = create_frame_transport(transport_name, buffer_size, logger_func=lambda message: None)
+    transport.prepare()
+    command = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin', '-f', 'rawvideo', '-pix_fmt', 'bgra',
+               '-s', f'{width}x{height}', '-framerate', '25', '-i', transport.input_url, '-c:v', 'copy', '-f', 'null', '-']
+    process = subprocess.Popen(command, stdin=transport.popen_stdin, stderr=subprocess.PIPE)
+    if not transport.connect(process):
+        transport.close(); process.kill(); process.wait()
+        return {"transport": transport_name, "error": "ffmpeg не подключился к каналу"}
+    cpu_start = time.process_time(); wall_start = time.perf_counter()
+    try:
+        for _ in range(frames):
+            # Прежний путь: bytes-копия кадра на каждую запись
+            write_frame_buffer(transport.stream, frame.tobytes() if copy_to_bytes else frame)
+    finally:
+        transport.close()
+        stderr_text = process.stderr.read().decode("utf-8", errors="ignore"); process.wait()
+    wall_seconds = time.perf_counter() - wall_start; cpu_seconds = time.process_time() - cpu_start
+    total_mb = frame.nbytes * frames / 1e6
+    return {
+        "size": f"{width}x{height}", "transport": transport.describe(), "write": "tobytes" if copy_to_bytes else "memoryview",
+        "frames": frames, "mb_per_sec": round(total_mb / wall_seconds, 0), "frames_per_sec": round(frames / wall_seconds, 1),
+        "python_cpu_ms_per_frame": round(cpu_seconds * 1000.0 / frames, 2), "ffmpeg_returncode": process.returncode,
+        "ffmpeg_error": stderr_text.strip()[-200:] or None,
+    }
+
+
+def run_transport_benchmark(sizes, frames, buffer_mb=DEFAULT_PIPE_BUFFER_MB, ffmpeg_path="ffmpeg"):
+    buffer_size = int(buffer_mb * 1024 * 1024)
+    variants = [(FRAME_TRANSPORT_PIPE, 0, True), (FRAME_TRANSPORT_PIPE, 0, False), (FRAME_TRANSPORT_PIPE, buffer_size, False),
+                (FRAME_TRANSPORT_NAMED_PIPE, buffer_size, False)]
+    results = []
+    for width, height in sizes:
+        frame = np.ascontiguousarray(_make_synthetic_frame_func(width, height, SYNTHETIC_PROFILE_MEETING)(0))
+        for transport_name, variant_buffer_size, copy_to_bytes in variants:
+            results.append(_transport_benchmark_run(ffmpeg_path, frame, frames, transport_name, variant_buffer_size, copy_to_bytes))
+    return results
+
+
+# --- backends: видео-ffmpeg через канал кадров против libav внутри процесса (PyAV) ---
+
+def _backend_benchmark_run(backend, ffmpeg_path, frames_pool, frames, framerate, pixel_format, codec, preset, crf):
+    # Одни и те же кадры и настройки кодировщика; CPU Python у pyav включает кодирование (оно в этом процессе)
+    height, width = frames_pool[0].shape[:2]
+    profile = get_codec_profile(codec)
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4", prefix="_bench_backend_"); temp_file.close()
+    ffmpeg_cpu_seconds = 0.0; returncode = 0
+    cpu_start = time.process_time(); wall_start = time.perf_counter()
+    if backend == ENCODER_BACKEND_PYAV:
+        encoder = PyAVVideoEncoder(temp_file.name, width, height, profile, framerate, preset, crf=int(crf), input_pixel_format=pixel_format)
+        try:
+            for index in range(frames): encoder.write_frame(frames_pool[index % len(frames_pool)], index / framerate)
+        finally: encoder.close()
+    else:
+        transport = create_frame_transport(FRAME_TRANSPORT_PIPE, int(DEFAULT_PIPE_BUFFER_MB * 1024 * 1024), logger_func=lambda message: None)
+        transport.prepare()
+        command = [ffmpeg_path, '-hide_banner', '-nostats', '-benchmark', '-nostdin', '-f', 'rawvideo', '-pix_fmt', pixel_format,
+                   '-s', f'{width}x{height}', '-framerate', str(framerate), '-i', transport.input_url,
+                   '-vf', build_conversion_filter(profile.pix_fmt)] + profile.encoder_args(preset, crf=int(crf)) + ['-y', temp_file.name]
+        process = subprocess.Popen(command, stdin=transport.popen_stdin, stderr=subprocess.PIPE)
+        if not transport.connect(process):
+            transport.close(); process.kill(); process.wait()
+            return {"backend": backend, "error": "ffmpeg не подключился к каналу"}
+        try:
+            for index in range(frames): write_frame_buffer(transport.stream, frames_pool[index % len(frames_pool)])
+        finally:
+            transport.close()
+            stderr_text = process.stderr.read().decode("utf-8", errors="ignore"); returncode = process.wait()
+        bench_match = re.search(r"bench: utime=([\d.]+)s stime=([\d.]+)s", stderr_text)
+        ffmpeg_cpu_seconds = float(bench_match.group(1)) + float(bench_match.group(2)) if bench_match else 0.0
+    wall_seconds = time.perf_counter() - wall_start; python_cpu_seconds = time.process_time() - cpu_start
+    output_bytes = os.path.getsize(temp_file.name) if os.path.exists(temp_file.name) else 0
+    os.remove(temp_file.name)
+    return {
+        "backend": backend, "size": f"{width}x{height}", "frames": frames, "frames_per_sec": round(frames / wall_seconds, 1),
+        "python_cpu_ms_per_frame": round(python_cpu_seconds * 1000.0 / frames, 2),
+        "ffmpeg_cpu_ms_per_frame": round(ffmpeg_cpu_seconds * 1000.0 / frames, 2),
+        "total_cpu_ms_per_frame": round((python_cpu_seconds + ffmpeg_cpu_seconds) * 1000.0 / frames, 2),
+        "output_mb": round(output_bytes / 1e6, 2), "ffmpeg_returncode": returncode,
+    }
+
+
+def run_backend_benchmark(width, height, seconds, framerate, pixel_format=PIPE_PIXEL_FORMAT_BGRA, codec=DEFAULT_VIDEO_CODEC_PROFILE,
+                          preset="medium", crf="28", ffmpeg_path="ffmpeg", profile=SYNTHETIC_PROFILE_MEETING):
+    # Кадры рендерятся заранее (пул из 8): генерация синтетики не входит в CPU
+    import cv2
+    frame_source = _make_synthetic_frame_func(width, height, profile)
+    frames_pool = [frame_source(index).copy() for index in range(8)]
+    if pixel_format == PIPE_PIXEL_FORMAT_BGR24: frames_pool = [cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR) for frame in frames_pool]
+    frames = max(1, int(seconds * framerate))
+    results = [_backend_benchmark_run(ENCODER_BACKEND_SUBPROCESS, ffmpeg_path, frames_pool, frames, framerate, pixel_format, codec, preset, crf)]
+    available, reason = probe_pyav_codec_profile(codec)
+    if not available: results.append({"backend": ENCODER_BACKEND_PYAV, "available": False, "reason": reason})
+    else: results.append(_backend_benchmark_run(ENCODER_BACKEND_PYAV, ffmpeg_path, frames_pool, frames, framerate, pixel_format, codec, preset, crf))
+    return results
+
+
+# --- recording-check: запись синтетики обоими бэкендами кодирования, проверка итогового mp4 ---
+
+def _read_video_packets(ffmpeg_path, path):
+    # framecrc без перекодирования: "поток, dts, pts, длительность, размер, crc" на пакет; -> [(pts, длительность)] в секундах
+    result = subprocess.run([ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-i', path, '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-'],
+                            capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    time_base = 1.0; packets = []
+    for line in result.stdout.splitlines():
+        time_base_match = re.match(r"#tb 0: (\d+)/(\d+)", line)
+        if time_base_match: time_base = int(time_base_match.group(1)) / int(time_base_match.group(2)); continue
+        if line.startswith("#"): continue
+        fields = [field.strip() for field in line.split(",")]
+        if len(fields) >= 4: packets.append((int(fields[2]) * time_base, int(fields[3]) * time_base))
+    return sorted(packets)
+
+
+def _recording_check_run(backend, segmented, seconds, width, height, framerate, profile, ffmpeg_path):
+    from ffmpeg_recorder import FFmpegRecorder
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4", prefix="_bench_check_"); temp_file.close()
+    log_lines = []
+    recorder = FFmpegRecorder(None, temp_file.name, [], framerate, log_lines.append, capture_method=CAPTURE_METHOD_SYNTHETIC,
+                              capture_options={"width": width, "height": height, "profile": profile}, auto_tune_encoder=False,
+                              encoder_backend=backend, segmented_recording=segmented, segment_duration_sec=2)
+    row = {"backend": backend, "segmented": segmented}
+    started, error_message = recorder.start()
+    if not started:
+        os.remove(temp_file.name); return dict(row, problems=[f"запись не запущена: {error_message}"])
+    record_start = time.perf_counter(); time.sleep(seconds)
+    recorded_seconds = time.perf_counter() - record_start; error_message = recorder.stop()
+    if recorder.active_encoder_backend != backend:
+        os.remove(temp_file.name); return dict(row, problems=[f"бэкенд {backend} недоступен, записано {recorder.active_encoder_backend} ({describe_pyav()})"])
+    output_bytes = os.path.getsize(temp_file.name) if os.path.exists(temp_file.name) else 0
+    packets = _read_video_packets(ffmpeg_path, temp_file.name) if output_bytes else []
+    os.remove(temp_file.name)
+    frames_written = recorder.get_frames_written()
+    problems = [f"ошибки записи: {error_message}"] if error_message else []
+    if not output_bytes or not packets:
+        return dict(row, output_mb=round(output_bytes / 1e6, 3), problems=problems + ["нет видео в итоговом файле"])
+    first_pts = packets[0][0]
+    duration = packets[-1][0] + packets[-1][1] - first_pts
+    span = packets[-1][0] - first_pts # Длительность последнего кадра mp4 угадывает по предыдущему интервалу - сверяем метки
+    pts_list = [pts for pts, _ in packets]
+    max_gap = max((later - earlier for earlier, later in zip(pts_list, pts_list[1:])), default=0.0)
+    frame_interval = 1.0 / framerate
+    # Кадров в файле - столько, сколько передано кодировщику; последний кадр (финальный при остановке) - в момент остановки
+    if len(packets) != frames_written: problems.append(f"кадров в файле {len(packets)}, передано {frames_written}")
+    if abs(span - recorded_seconds) > 0.5: problems.append(f"метки кадров на {span:.2f} с при записи {recorded_seconds:.2f} с")
+    if first_pts > 2 * frame_interval: problems.append(f"первый кадр на {first_pts:.3f} с")
+    if len(set(pts_list)) != len(pts_list): problems.append("повторяющиеся метки кадров")
+    if max_gap > DEFAULT_MAX_REPEAT_INTERVAL_SEC + 2 * frame_interval: problems.append(f"разрыв меток {max_gap:.2f} с")
+    return dict(row, frames=len(packets), frames_written=frames_written, output_mb=round(output_bytes / 1e6, 3),
+                duration_sec=round(duration, 3), pts_span_sec=round(span, 3), recorded_sec=round(recorded_seconds, 2), first_pts_sec=round(first_pts, 3),
+                max_pts_gap_sec=round(max_gap, 3), problems=problems)
+
+
+def run_recording_check(seconds, width, height, framerate, profile=SYNTHETIC_PROFILE_SCROLL, ffmpeg_path="ffmpeg"):
+    """
+    Запись синтетического источника FFmpegRecorder-ом с encoder_backend subprocess и pyav, обычный mp4 и сегментная запись.
+    Проверяются кадры (в файле столько, сколько передано), размер, длительность и метки; размер файла сравнивается между
+    бэкендами (те же кадры и настройки). problems пуст - проверка пройдена (pyav без PyAV - не пройдена).
+    """
+    results = [_recording_check_run(backend, segmented, seconds, width, height, framerate, profile, ffmpeg_path)
+               for backend in (ENCODER_BACKEND_SUBPROCESS, ENCODER_BACKEND_PYAV) for segmented in (False, True)]
+    for segmented in (False, True):
+        rows = [row for row in results if row["segmented"] == segmented and row.get("frames")]
+        if len(rows) < 2: continue
+        bytes_per_frame = [row["output_mb"] / row["frames"] for row in rows]
+        if max(bytes_per_frame) > 3 * min(bytes_per_frame): rows[-1]["problems"].append("размер на кадр отличается от subprocess больше чем втрое")
+    return results
+
+
+# --- suppression: подавление неизменившихся кадров на синтетике static/periodic ---
+
+def _subgrid_change_delay(width, height, framerate, seconds, sample_step, max_repeat_interval_sec):
+    # Детектор на виртуальных часах: static, между двумя принудительными кадрами меняется пиксель вне сетки (1, 1).
+    # -> (кадр с изменением отправлен сразу, задержка до первого отправленного кадра с изменением в секундах или None)
+    from frame_pipeline import FrameChangeDetector
+    source = SyntheticFrameSource(width, height, profile=SYNTHETIC_PROFILE_STATIC, logger_func=lambda message: None)
+    source.open()
+    frame = np.empty((source.height, source.width, BGRA_BYTES_PER_PIXEL), dtype=np.uint8)
+    detector = FrameChangeDetector(sample_step, max_repeat_interval_sec)
+    frames = int(seconds * framerate); change_index = int(2.5 * max_repeat_interval_sec * framerate)
+    sent_at_change, delay = False, None
+    for index in range(frames):
+        source.grab_into(frame)
+        if index >= change_index: frame[1, 1, :3] = 255 - frame[1, 1, :3]
+        sent = detector.should_send(frame, now=index / framerate)
+        if index == change_index: sent_at_change = sent
+        if sent and index >= change_index: delay = (index - change_index) / framerate; break
+    source.close()
+    return sent_at_change, delay
+
+
+def run_suppression_benchmark(seconds, width, height, framerate, period_sec=2.5, ffmpeg_path="ffmpeg"):
+    """
+    Запись синтетики static и periodic (смена слайда раз в period_sec) с подавлением повторов: отправленные и подавленные
+    кадры (get_suppressed_frames), сэкономленные байты pipe и интервалы меток в файле - кадр не реже раза в
+    DEFAULT_MAX_REPEAT_INTERVAL_SEC. Отдельно - изменение между точками сетки сравнения: детектор его не видит,
+    в видео оно попадает с принудительным кадром. problems пуст - проверка пройдена.
+    """
+    from ffmpeg_recorder import FFmpegRecorder
+    frame_interval = 1.0 / framerate
+    results = []
+    for profile in (SYNTHETIC_PROFILE_STATIC, SYNTHETIC_PROFILE_PERIODIC):
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4", prefix="_bench_suppress_"); temp_file.close()
+        recorder = FFmpegRecorder(None, temp_file.name, [], framerate, lambda message: None, capture_method=CAPTURE_METHOD_SYNTHETIC,
+                                  capture_options={"width": width, "height": height, "profile": profile, "period_sec": period_sec, "framerate": framerate},
+                                  suppress_duplicates=True, auto_tune_encoder=False)
+        started, error_message = recorder.start()
+        if not started:
+            os.remove(temp_file.name); results.append({"profile": profile, "problems": [f"запись не запущена: {error_message}"]}); continue
+        time.sleep(seconds)
+        pipe_w, pipe_h, pixel_format, _ = recorder._video_command_args
+        error_message = recorder.stop()
+        packets = _read_video_packets(ffmpeg_path, temp_file.name) if os.path.exists(temp_file.name) else []
+        if os.path.exists(temp_file.name): os.remove(temp_file.name)
+        sent, suppressed = recorder.get_frames_written(), recorder.get_suppressed_frames()
+        frame_bytes = pipe_w * pipe_h * (BGR_BYTES_PER_PIXEL if pixel_format == PIPE_PIXEL_FORMAT_BGR24 else BGRA_BYTES_PER_PIXEL)
+        pts_list = [pts for pts, _ in packets]
+        max_gap = max((later - earlier for earlier, later in zip(pts_list, pts_list[1:])), default=0.0)
+        # Кадр при старте, раз в секунду и на каждую смену слайда (и финальный при остановке)
+        slide_sec = max(1, int(period_sec * framerate)) / framerate # Синтетика меняет слайд через целое число кадров
+        changes = int(seconds / slide_sec) if profile == SYNTHETIC_PROFILE_PERIODIC else 0
+        expected_max = int(seconds / DEFAULT_MAX_REPEAT_INTERVAL_SEC) + changes + 3
+        problems = [f"ошибки записи: {error_message}"] if error_message else []
+        if not packets: problems.append("нет видео в итоговом файле")
+        if suppressed == 0: problems.append("ни один кадр не подавлен")
+        if sent > expected_max: problems.append(f"отправлено {sent} кадров, ожидалось не больше {expected_max}")
+        if len(packets) != sent: problems.append(f"кадров в файле {len(packets)}, отправлено {sent}")
+        if max_gap > DEFAULT_MAX_REPEAT_INTERVAL_SEC + 2 * frame_interval: problems.append(f"разрыв меток {max_gap:.2f} с больше интервала повтора")
+        # Смена слайда отправляется сразу, а не с ближайшим принудительным кадром
+        late_changes = [round(index * slide_sec, 2) for index in range(1, changes + 1)
+                        if not any(-frame_interval <= pts - index * slide_sec <= 3 * frame_interval for pts in pts_list)]
+        if late_changes: problems.append(f"нет кадра сразу после смены слайда на {late_changes} с")
+        results.append({"profile": profile, "frames_sent": sent, "frames_suppressed": suppressed,
+                        "suppressed_pct": round(100.0 * suppressed / max(1, sent + suppressed), 1),
+                        "pipe_mb_saved": round(suppressed * frame_bytes / 1e6, 1), "pipe_mb_sent": round(sent * frame_bytes / 1e6, 1),
+                        "max_pts_gap_sec": round(max_gap, 3), "problems": problems})
+    sent_at_change, delay = _subgrid_change_delay(width, height, framerate, max(seconds, 4 * DEFAULT_MAX_REPEAT_INTERVAL_SEC),
+                                                  DEFAULT_CHANGE_SAMPLE_STEP, DEFAULT_MAX_REPEAT_INTERVAL_SEC)
+    problems = []
+    if sent_at_change: problems.append("изменение оказалось на сетке сравнения (проверка принудительного кадра не состоялась)")
+    if delay is None or delay > DEFAULT_MAX_REPEAT_INTERVAL_SEC + frame_interval: problems.append(f"изменение между точками сетки не отправлено за {DEFAULT_MAX_REPEAT_INTERVAL_SEC} с")
+    results.append({"profile": "static + изменение вне сетки", "sent_immediately": sent_at_change,
+                    "delay_sec": round(delay, 3) if delay is not None else None, "problems": problems})
+    return results
+
+
+# --- stop-latency: время от остановки до готового mp4 по длине записи и раскладке mp4 ---
+
+STOP_LATENCY_AUDIO_SINGLE = "single" # Одно устройство звука
+STOP_LATENCY_AUDIO_LIVE_MIX = "live"  # Несколько устройств, amix на лету в процессе захвата (live_audio_mix)
+STOP_LATENCY_AUDIO_STOP_MIX = "stop"  # Несколько устройств, дорожка на устройство и amix с перекодированием при остановке
+
+
+def _make_stop_latency_session(ffmpeg_path, seconds, width, height, framerate, video_bitrate, segment_duration_sec,
+                               audio_device_count=1, audio_mix=STOP_LATENCY_AUDIO_SINGLE):
+    # Сегменты, как их пишет сегментная запись (видео и звук отдельно), из lavfi: ultrafast с заданным битрейтом -
+    # размер файла как у настоящей записи той же длины при генерации быстрее реального времени.
+    # Устройства звука - синусы sine разной частоты (в Linux вместо dshow)
+    from ffmpeg_recorder import build_amix_filter
+    from recording_session import RecordingSession
+    audio_track_count = audio_device_count if audio_mix == STOP_LATENCY_AUDIO_STOP_MIX else 1
+    session = RecordingSession.create("_bench_stop.mp4", audio_track_count=audio_track_count, segment_duration_sec=segment_duration_sec)
+    video_pattern = session.add_video_part()
+    command = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={framerate}']
+    for index in range(audio_device_count): command.extend(['-f', 'lavfi', '-i', f'sine=frequency={440 + 110 * index}:sample_rate=44100'])
+    command.extend(['-map', '0:v', '-t', str(seconds), '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', video_bitrate,
+                    '-force_key_frames', f'expr:gte(t,n_forced*{segment_duration_sec})'] + session.segment_muxer_args(video_pattern))
+    if audio_track_count == audio_device_count: audio_maps = [f'{index + 1}:a' for index in range(audio_device_count)]
+    else:
+        command.extend(['-filter_complex', build_amix_filter([f'{index + 1}:a' for index in range(audio_device_count)])])
+        audio_maps = ['[a_out]']
+    for index, audio_map in enumerate(audio_maps):
+        command.extend(['-map', audio_map, '-t', str(seconds), '-c:a', 'aac', '-b:a', '128k'] +
+                       session.segment_muxer_args(session.audio_track_pattern(index)))
+    subprocess.run(command + ['-y'], check=True)
+    return session
+
+
+STOP_LATENCY_INCREMENTAL = "incremental" # Не раскладка: сборка по ходу записи (incremental_mux), при остановке - последний сегмент
+
+
+def _measure_incremental_stop(session, output_path, ffmpeg_path):
+    # Все сегменты, кроме последнего, дописываются до замера (как в фоне во время записи); замер - finish() с последним
+    from incremental_mux import IncrementalMuxer
+    track_names = ["video"] + session.manifest["audio_tracks"]
+    held_segments = [session.collect_segments(name, None)[-1][0] for name in track_names]
+    for path in held_segments: os.replace(path, path + ".hold")
+    muxer = IncrementalMuxer(session, output_path, track_names, ffmpeg_path=ffmpeg_path, logger_func=lambda message: None)
+    muxer.poll()
+    for path in held_segments: os.replace(path + ".hold", path)
+    wall_start = time.perf_counter()
+    complete = muxer.finish()
+    return time.perf_counter() - wall_start, 0 if complete else 1
+
+
+def run_stop_latency_benchmark(lengths_sec, layouts=None, width=1280, height=720, framerate=30, video_bitrate="4M",
+                               segment_duration_sec=DEFAULT_SEGMENT_DURATION_SEC, ffmpeg_path="ffmpeg", audio_device_count=1):
+    # Замер - то, что делает stop после завершения процессов записи: списки ffconcat и одна команда mux (stream copy;
+    # при amix во время остановки - с перекодированием всего звука). Несколько устройств - оба варианта смешивания.
+    from ffmpeg_recorder import build_ffmpeg_mux_command, build_session_mux_inputs
+    layouts = layouts or [MP4_LAYOUT_FASTSTART, MP4_LAYOUT_FRAGMENTED, MP4_LAYOUT_MOOV_END, STOP_LATENCY_INCREMENTAL]
+    audio_mixes = [STOP_LATENCY_AUDIO_LIVE_MIX, STOP_LATENCY_AUDIO_STOP_MIX] if audio_device_count > 1 else [STOP_LATENCY_AUDIO_SINGLE]
+    results = []
+    for seconds, audio_mix in [(seconds, audio_mix) for seconds in lengths_sec for audio_mix in audio_mixes]:
+        session = _make_stop_latency_session(ffmpeg_path, seconds, width, height, framerate, video_bitrate, segment_duration_sec,
+                                             audio_device_count, audio_mix)
+        try:
+            for layout in layouts:
+                # Сборка по ходу записи - только с одной дорожкой звука (как в FFmpegRecorder)
+                if layout == STOP_LATENCY_INCREMENTAL and len(session.manifest["audio_tracks"]) > 1: continue
+                output_path = os.path.join(session.session_dir, f"out_{layout}.mp4")
+                if layout == STOP_LATENCY_INCREMENTAL:
+                    stop_seconds, returncode = _measure_incremental_stop(session, output_path, ffmpeg_path)
+                else:
+                    wall_start = time.perf_counter()
+                    video_list, audio_lists = build_session_mux_inputs(session)
+                    command = build_ffmpeg_mux_command(video_list, audio_lists, output_path, mp4_layout=layout); command[0] = ffmpeg_path
+                    returncode = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore').returncode
+                    stop_seconds = time.perf_counter() - wall_start
+                output_bytes = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+                results.append({"length_sec": seconds, "audio_mix": audio_mix, "layout": layout, "output_mb": round(output_bytes / 1e6, 1),
+                                "stop_to_ready_sec": round(stop_seconds, 2), "ffmpeg_returncode": returncode})
+                if os.path.exists(output_path): os.remove(output_path) # Следующая раскладка не читает из кэша ОС этот файл
+        finally: session.remove()
+    return results
+
+
+# --- budget: запись синтетики в режиме бюджета размера, итог против цели ---
+
+def run_budget_benchmark(seconds, target_mb, width, height, framerate, profile, interval_sec, min_segment_sec, tolerance):
+    from ffmpeg_recorder import FFmpegRecorder
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4", prefix="_bench_budget_"); temp_file.close()
+    log_lines = []
+    def logger(message):
+        if message.startswith("[RateControl]") or "Бюджет размера" in message or "ERROR" in message: print(message)
+        log_lines.append(message)
+    recorder = FFmpegRecorder(None, temp_file.name, [], framerate, logger, capture_method=CAPTURE_METHOD_SYNTHETIC,
+                              capture_options={"width": width, "height": height, "profile": profile},
+                              size_budget_mb=target_mb, expected_duration_min=seconds / 60.0,
+                              rate_control_options={"interval_sec": interval_sec, "min_segment_sec": min_segment_sec, "tolerance": tolerance})
+    started, error_message = recorder.start()
+    if not started: raise RuntimeError(f"Запись не запущена: {error_message}")
+    time.sleep(seconds)
+    rate_stats = recorder.get_rate_control_stats()
+    error_message = recorder.stop()
+    final_bytes = os.path.getsize(temp_file.name) if os.path.exists(temp_file.name) else 0
+    os.remove(temp_file.name)
+    deviation = final_bytes / (target_mb * 1e6) - 1.0
+    return {
+        "profile": profile, "size": f"{width}x{height}", "seconds": seconds, "target_mb": target_mb,
+        "final_mb": round(final_bytes / 1e6, 3), "deviation_pct": round(deviation * 100.0, 1),
+        "within_budget": final_bytes <= target_mb * 1e6 * (1.0 + tolerance), "segments": rate_stats.get("segments", 0),
+        "decisions": rate_stats.get("decisions", []), "errors": error_message,
+    }
+
+
+# --- capture: задержка и стоимость захвата для каждого доступного бэкенда ---
+
+def _find_window_by_title(title_part):
+    # Только Windows: первое видимое окно, в заголовке которого есть title_part
+    from windows_utils import get_active_windows
+    for title, hwnd in get_active_windows().items():
+        if title_part.lower() in title.lower(): return hwnd, title
+    return None, None
+
+
+def _backend_options(backend_name, hwnd, width, height, profile):
+    if backend_name == CAPTURE_METHOD_SYNTHETIC: return {"width": width, "height": height, "profile": profile}
+    if backend_name == CAPTURE_METHOD_MSS: return {"hwnd": hwnd, "width": width, "height": height}
+    return {"hwnd": hwnd}
+
+
+def _measure_capture_backend(source, seconds):
+    latencies = []
+    cpu_start = time.process_time() # Включает время ядра: GDI/X-вызовы захвата учитываются
+    loop_start = time.perf_counter()
+    failed_grabs = 0
+    while time.perf_counter() - loop_start < seconds:
+        grab_start = time.perf_counter()
+        slot = source.acquire_frame()
+        grab_end = time.perf_counter()
+        if slot is None: failed_grabs += 1; continue
+        source.release_frame(slot)
+        latencies.append(grab_end - grab_start)
+    elapsed = time.perf_counter() - loop_start
+    cpu_seconds = time.process_time() - cpu_start
+    if not latencies: return {"status": "no_frames", "failed_grabs": failed_grabs}
+    latencies_ms = np.array(latencies) * 1000.0
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "status": "ok", "size": f"{source.width}x{source.height}", "frames": len(latencies), "failed_grabs": failed_grabs,
+        "fps": round(len(latencies) / elapsed, 1),
+        "latency_ms_p50": round(float(p50), 3), "latency_ms_p95": round(float(p95), 3),
+        "latency_ms_p99": round(float(p99), 3), "latency_ms_max": round(float(latencies_ms.max()), 3),
+        "bytes_copied_per_frame": source.bytes_copied_per_frame(),
+        "cpu_ms_per_frame": round(cpu_seconds * 1000.0 / len(latencies), 3),
+    }
+
+
+def run_capture_benchmark(seconds, backend_names=None, hwnd=None, width=1920, height=1080, profile=SYNTHETIC_PROFILE_SCROLL):
+    """
+    Гоняет каждый бэкенд захвата seconds секунд в цикле acquire/release без пауз.
+    Оконным бэкендам нужен hwnd (фиксированная цель); без него они пропускаются.
+    Недоступные на платформе бэкенды попадают в результаты со status="unavailable".
+    """
+    from capture_initializer import create_frame_source, get_backend_names, get_backend_capabilities, CAPABILITY_WINDOW
+    quiet_logger = lambda message: None
+    available_names = get_backend_names(available_only=True)
+    results = []
+    for backend_name in backend_names or get_backend_names():
+        row = {"backend": backend_name}
+        if backend_name not in available_names:
+            row["status"] = "unavailable"; results.append(row); continue
+        if CAPABILITY_WINDOW in get_backend_capabilities(backend_name) and not hwnd:
+            row["status"] = "skipped_no_target_window"; results.append(row); continue
+        source, _, error_message = create_frame_source(backend_name, (), quiet_logger, fallback=False,
+                                                       **_backend_options(backend_name, hwnd, width, height, profile))
+        if source is None:
+            row.update({"status": "init_failed", "error": error_message}); results.append(row); continue
+        try:
+            row.update(_measure_capture_backend(source, seconds))
+        finally:
+            source.close()
+        results.append(row)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки пути кадра и захвата VideoConfRecorder.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    frame_copy_parser = subparsers.add_parser("frame-copy", help="Копирование кадра DIBSection -> stdin: legacy vs zero-copy (фейковый DIB).")
+    frame_copy_parser.add_argument("--size", default="2560x1440")
+    frame_copy_parser.add_argument("--frames", type=int, default=100)
+    frame_copy_parser.add_argument("--json", dest="json_path", default=None)
+
+    scale_parser = subparsers.add_parser("scale", help="CPU libx264 и МБ/мин при исходном и ограниченных разрешениях (синтетический источник).")
+    scale_parser.add_argument("--size", default="2560x1440")
+    scale_parser.add_argument("--max-heights", default="1080,720", help="Ограничения высоты через запятую.")
+    scale_parser.add_argument("--seconds", type=float, default=10.0)
+    scale_parser.add_argument("--framerate", type=int, default=25)
+    scale_parser.add_argument("--preset", default="medium")
+    scale_parser.add_argument("--crf", default="28")
+    scale_parser.add_argument("--stage", choices=["python", "ffmpeg"], default="python")
+    scale_parser.add_argument("--profile", choices=SYNTHETIC_PROFILES, default=SYNTHETIC_PROFILE_MEETING)
+    scale_parser.add_argument("--ffmpeg", dest="ffmpeg_path", default="ffmpeg")
+    scale_parser.add_argument("--json", dest="json_path", default=None)
+
+    capture_parser = subparsers.add_parser("capture", help="Задержка p50/p95/p99, fps, копии и CPU на кадр для бэкендов захвата.")
+    capture_parser.add_argument("--seconds", type=float, default=5.0)
+    capture_parser.add_argument("--backends", default=None, help="Имена бэкендов через запятую (по умолчанию все).")
+    capture_parser.add_argument("--window-title", default=None, help="Часть заголовка окна-цели (Windows).")
+    capture_parser.add_argument("--hwnd", type=int, default=None)
+    capture_parser.add_argument("--size", default="1920x1080", help="Размер для синтетики и области mss без окна.")
+    capture_parser.add_argument("--profile", choices=SYNTHETIC_PROFILES, default=SYNTHETIC_PROFILE_SCROLL)
+    capture_parser.add_argument("--json", dest="json_path", default=None)
+
+    budget_parser = subparsers.add_parser("budget", help="Запись синтетики с бюджетом размера: итоговый размер против цели и решения контроллера.")
+    budget_parser.add_argument("--seconds", type=float, default=120.0, help="Длительность записи (она же ожидаемая длительность).")
+    budget_parser.add_argument("--target-mb", type=float, default=5.0)
+    budget_parser.add_argument("--size", default="1280x720")
+    budget_parser.add_argument("--framerate", type=int, default=10)
+    budget_parser.add_argument("--profile", choices=SYNTHETIC_PROFILES, default=SYNTHETIC_PROFILE_SCROLL)
+    budget_parser.add_argument("--interval", type=float, default=5.0, help="Интервал сверки с бюджетом, с.")
+    budget_parser.add_argument("--min-segment", type=float, default=15.0, help="Минимальная длина сегмента, с.")
+    budget_parser.add_argument("--tolerance", type=float, default=0.05)
+    budget_parser.add_argument("--json", dest="json_path", default=None)
+
+    codecs_parser = subparsers.add_parser("codecs", help="CPU и МБ/час профилей кодеков на синтетике (недоступные - с причиной).")
+    codecs_parser.add_argument("--size", default="1920x1080")
+    codecs_parser.add_argument("--seconds", type=float, default=10.0)
+    codecs_parser.add_argument("--framerate", type=int, default=25)
+    codecs_parser.add_argument("--preset", default="medium", help="Preset x264; профили переводят его в свою скорость.")
+    codecs_parser.add_argument("--crf", default="28", help="CRF в единицах x264; профили переводят его в свою шкалу.")
+    codecs_parser.add_argument("--codecs", default=None, help="Имена профилей через запятую (по умолчанию все).")
+    codecs_parser.add_argument("--profile", choices=SYNTHETIC_PROFILES, default=SYNTHETIC_PROFILE_MEETING)
+    codecs_parser.add_argument("--ffmpeg", dest="ffmpeg_path", default="ffmpeg")
+    codecs_parser.add_argument("--json", dest="json_path", default=None)
+
+    pixfmt_parser = subparsers.add_parser("pixfmt", help="CPU на кадр (Python и ffmpeg) для форматов pipe bgr24/bgra/bgr0 и потоков swscale.")
+    pixfmt_parser.add_argument("--size", default="1920x1080")
+    pixfmt_parser.add_argument("--seconds", type=float, default=10.0)
+    pixfmt_parser.add_argument("--framerate", type=int, default=25)
+    pixfmt_parser.add_argument("--formats", default=None, help="Форматы pipe через запятую (по умолчанию bgr24,bgra,bgr0).")
+    pixfmt_parser.add_argument("--threads", default="1,0", help="Потоки swscale через запятую, 0 - авто.")
+    pixfmt_parser.add_argument("--codec", default=DEFAULT_VIDEO_CODEC_PROFILE)
+    pixfmt_parser.add_argument("--preset", default="medium")
+    pixfmt_parser.add_argument("--crf", default="28")
+    pixfmt_parser.add_argument("--convert-only", action="store_true", help="Без кодирования: только преобразование в pix_fmt кодировщика.")
+    pixfmt_parser.add_argument("--profile", choices=SYNTHETIC_PROFILES, default=SYNTHETIC_PROFILE_MEETING)
+    pixfmt_parser.add_argument("--ffmpeg", dest="ffmpeg_path", default="ffmpeg")
+    pixfmt_parser.add_argument("--json", dest="json_path", default=None)
+
+    transport_parser = subparsers.add_parser("transport", help="МБ/с и кадров/с канала кадров в ffmpeg: pipe (системный/увеличенный), именованный канал.")
+    transport_parser.add_argument("--sizes", default="1920x1080,2560x1440", help="Размеры кадра через запятую.")
+    transport_parser.add_argument("--frames", type=int, default=300)
+    transport_parser.add_argument("--buffer-mb", type=float, default=DEFAULT_PIPE_BUFFER_MB, help="Емкость канала для увеличенных вариантов.")
+    transport_parser.add_argument("--ffmpeg", dest="ffmpeg_path", default="ffmpeg")
+    transport_parser.add_argument("--json", dest="json_path", default=None)
+
+    backends_parser = subparsers.add_parser("backends", help="Кадров/с и CPU на кадр: видео-ffmpeg через канал против libav внутри процесса (PyAV).")
+    backends_parser.add_argument("--size", default="1920x1080")
+    backends_parser.add_argument("--seconds", type=float, default=10.0)
+    backends_parser.add_argument("--framerate", type=int, default=25)
+    backends_parser.add_argument("--format", dest="pixel_format", default=PIPE_PIXEL_FORMAT_BGRA, help="Формат кадра: bgra, bgr0 или bgr24.")
+    backends_parser.add_argument("--codec", default=DEFAULT_VIDEO_CODEC_PROFILE)
+    backends_parser.add_argument("--preset", default="medium")
+    backends_parser.add_argument("--crf", default="28")
+    backends_parser.add_argument("--profile", choices=SYNTHETIC_PROFILES, default=SYNTHETIC_PROFILE_MEETING)
+    backends_parser.add_argument("--ffmpeg", dest="ffmpeg_path", default="ffmpeg")
+    backends_parser.add_argument("--json", dest="json_path", default=None)
+
+    check_parser = subparsers.add_parser("recording-check", help="Запись синтетики бэкендами subprocess и pyav (mp4 и сегменты): кадры, размер, длительность, метки.")
+    check_parser.add_argument("--size", default="640x360")
+    check_parser.add_argument("--seconds", type=float, default=5.0)
+    check_parser.add_argument("--framerate", type=int, default=15)
+    check_parser.add_argument("--profile", choices=SYNTHETIC_PROFILES, default=SYNTHETIC_PROFILE_SCROLL)
+    check_parser.add_argument("--ffmpeg", dest="ffmpeg_path", default="ffmpeg")
+    check_parser.add_argument("--json", dest="json_path", default=None)
+
+    suppression_parser = subparsers.add_parser("suppression", help="Подавление неизменившихся кадров на синтетике static/periodic: кадры, байты pipe, повтор раз в секунду.")
+    suppression_parser.add_argument("--size", default="1280x720")
+    suppression_parser.add_argument("--seconds", type=float, default=6.0)
+    suppression_parser.add_argument("--framerate", type=int, default=15)
+    suppression_parser.add_argument("--period", type=float, default=2.5, help="Смена слайда periodic, с (не кратно секунде повтора).")
+    suppression_parser.add_argument("--ffmpeg", dest="ffmpeg_path", default="ffmpeg")
+    suppression_parser.add_argument("--json", dest="json_path", default=None)
+
+    stop_parser = subparsers.add_parser("stop-latency", help="Время от остановки до готового mp4 по длине записи: faststart, fragmented, moov_end, incremental.")
+    stop_parser.add_argument("--lengths", default="60,300,900", help="Длины записи в секундах через запятую.")
+    stop_parser.add_argument("--layouts", default=None, help="Раскладки mp4 через запятую (по умолчанию все).")
+    stop_parser.add_argument("--size", default="1280x720")
+    stop_parser.add_argument("--framerate", type=int, default=30)
+    stop_parser.add_argument("--video-bitrate", default="4M", help="Битрейт видео сегментов (размер файла на минуту записи).")
+    stop_parser.add_argument("--segment-duration", type=float, default=DEFAULT_SEGMENT_DURATION_SEC)
+    stop_parser.add_argument("--audio-devices", type=int, default=1,
+                             help="Устройств звука (синусы lavfi); больше одного - amix на лету против amix при остановке.")
+    stop_parser.add_argument("--ffmpeg", dest="ffmpeg_path", default="ffmpeg")
+    stop_parser.add_argument("--json", dest="json_path", default=None)
+
+    tune_parser = subparsers.add_parser("encoder-tune", help="Калибровка preset/потоков кодировщика для этой машины (результат кэшируется).")
+    tune_parser.add_argument("--size", default="1920x1080", help="Размер кадра, который кодирует кодировщик.")
+    tune_parser.add_argument("--codec", default=DEFAULT_VIDEO_CODEC_PROFILE, help="Профиль кодека.")
+    tune_parser.add_argument("--framerate", type=int, default=25)
+    tune_parser.add_argument("--headroom", type=float, default=DEFAULT_ENCODER_TUNING_HEADROOM)
+    tune_parser.add_argument("--ffmpeg", dest="ffmpeg_path", default=None)
+    tune_parser.add_argument("--json", dest="json_path", default=None)
+
+    args = parser.parse_args(argv)
+    if args.benchmark == "frame-copy":
+        width, height = _parse_size(args.size)
+        results = run_frame_copy_benchmark(width, height, args.frames)
+        _print_results(f"frame-copy {args.size}", results)
+        _write_json(args.json_path, {"benchmark": "frame-copy", "platform": sys.platform, "results": results})
+    elif args.benchmark == "capture":
+        width, height = _parse_size(args.size)
+        hwnd, window_title = args.hwnd, None
+        if args.window_title and not hwnd:
+            hwnd, window_title = _find_window_by_title(args.window_title)
+            if not hwnd: print(f"[Benchmarks] Окно с '{args.window_title}' в заголовке не найдено, оконные бэкенды будут пропущены.")
+        backend_names = [name.strip() for name in args.backends.split(",")] if args.backends else None
+        results = run_capture_benchmark(args.seconds, backend_names, hwnd, width, height, args.profile)
+        _print_results(f"capture {args.seconds}s", results)
+        _write_json(args.json_path, {"benchmark": "capture", "platform": sys.platform, "machine": platform.machine(),
+                                     "processor": platform.processor(), "cpu_count": os.cpu_count(), "python": platform.python_version(),
+                                     "target_window": window_title or hwnd, "seconds": args.seconds, "results": results})
+    elif args.benchmark == "scale":
+        width, height = _parse_size(args.size)
+        max_heights = [int(value) for value in args.max_heights.split(",") if value.strip()]
+        results = run_scale_benchmark(width, height, max_heights, args.seconds, args.framerate, args.preset, args.crf,
+                                      args.stage, args.ffmpeg_path, args.profile)
+        _print_results(f"scale {args.size} ({args.stage}, preset={args.preset}, crf={args.crf})", results)
+        _write_json(args.json_path, {"benchmark": "scale", "platform": sys.platform, "results": results})
+    elif args.benchmark == "encoder-tune":
+        width, height = _parse_size(args.size)
+        tuning = calibrate_encoder(width, height, args.framerate, args.ffmpeg_path, headroom=args.headroom, codec_profile=args.codec)
+        result = dict(tuning.to_dict(), codec=args.codec, build=get_ffmpeg_build_id(args.ffmpeg_path))
+        _print_results(f"encoder-tune {args.size}@{args.framerate}", [result])
+        _write_json(args.json_path, {"benchmark": "encoder-tune", "platform": sys.platform, "result": result})
+    elif args.benchmark == "codecs":
+        width, height = _parse_size(args.size)
+        codec_names = [name.strip() for name in args.codecs.split(",")] if args.codecs else None
+        results = run_codec_benchmark(width, height, args.seconds, args.framerate, args.preset, args.crf, codec_names,
+                                      args.ffmpeg_path, args.profile)
+        for result in results:
+            if result.get("mb_per_min") is not None: result["mb_per_hour"] = round(result["mb_per_min"] * 60, 0)
+        _print_results(f"codecs {args.size} ({args.profile}, preset={args.preset}, crf={args.crf})", results)
+        _write_json(args.json_path, {"benchmark": "codecs", "platform": sys.platform, "build": get_ffmpeg_build_id(args.ffmpeg_path),
+                                     "results": results})
+    elif args.benchmark == "pixfmt":
+        width, height = _parse_size(args.size)
+        pixel_formats = [name.strip() for name in args.formats.split(",")] if args.formats else None
+        thread_counts = [int(value) for value in args.threads.split(",") if value.strip()]
+        results = run_pixfmt_benchmark(width, height, args.seconds, args.framerate, pixel_formats, thread_counts, args.codec,
+                                       args.preset, args.crf, args.convert_only, args.ffmpeg_path, args.profile)
+        _print_results(f"pixfmt {args.size} ({'только преобразование' if args.convert_only else args.codec}, cpu={os.cpu_count()})", results)
+        _write_json(args.json_path, {"benchmark": "pixfmt", "platform": sys.platform, "cpu_count": os.cpu_count(), "results": results})
+    elif args.benchmark == "transport":
+        sizes = [_parse_size(size_str.strip()) for size_str in args.sizes.split(",") if size_str.strip()]
+        results = run_transport_benchmark(sizes, args.frames, args.buffer_mb, args.ffmpeg_path)
+        _print_results(f"transport ({args.frames} кадров BGRA)", results)
+        _write_json(args.json_path, {"benchmark": "transport", "platform": sys.platform, "cpu_count": os.cpu_count(), "results": results})
+    elif args.benchmark == "backends":
+        width, height = _parse_size(args.size)
+        results = run_backend_benchmark(width, height, args.seconds, args.framerate, args.pixel_format, args.codec, args.preset, args.crf,
+                                        args.ffmpeg_path, args.profile)
+        _print_results(f"backends {args.size} ({args.codec}, {args.pixel_format}, {describe_pyav()}, cpu={os.cpu_count()})", results)
+        _write_json(args.json_path, {"benchmark": "backends", "platform": sys.platform, "cpu_count": os.cpu_count(),
+                                     "build": get_ffmpeg_build_id(args.ffmpeg_path), "pyav": describe_pyav(), "results": results})
+    elif args.benchmark == "recording-check":
+        width, height = _parse_size(args.size)
+        results = run_recording_check(args.seconds, width, height, args.framerate, args.profile, args.ffmpeg_path)
+        _print_results(f"recording-check {args.size}@{args.framerate} ({args.profile}, {describe_pyav()})", results)
+        _write_json(args.json_path, {"benchmark": "recording-check", "platform": sys.platform, "pyav": describe_pyav(), "results": results})
+        if any(row.get("problems") for row in results): return 1
+    elif args.benchmark == "suppression":
+        width, height = _parse_size(args.size)
+        results = run_suppression_benchmark(args.seconds, width, height, args.framerate, args.period, args.ffmpeg_path)
+        _print_results(f"suppression {args.size}@{args.framerate}, {args.seconds}s", results)
+        _write_json(args.json_path, {"benchmark": "suppression", "platform": sys.platform, "results": results})
+        if any(row.get("problems") for row in results): return 1
+    elif args.benchmark == "stop-latency":
+        width, height = _parse_size(args.size)
+        lengths_sec = [float(value) for value in args.lengths.split(",") if value.strip()]
+        layouts = [name.strip() for name in args.layouts.split(",")] if args.layouts else None
+        results = run_stop_latency_benchmark(lengths_sec, layouts, width, height, args.framerate, args.video_bitrate,
+                                             args.segment_duration, args.ffmpeg_path, args.audio_devices)
+        _print_results(f"stop-latency {args.size}@{args.framerate}, {args.video_bitrate}, звук: {args.audio_devices} устр.", results)
+        _write_json(args.json_path, {"benchmark": "stop-latency", "platform": sys.platform, "build": get_ffmpeg_build_id(args.ffmpeg_path),
+                                     "results": results})
+    elif args.benchmark == "budget":
+        width, height = _parse_size(args.size)
+        result = run_budget_benchmark(args.seconds, args.target_mb, width, height, args.framerate, args.profile,
+                                      args.interval, args.min_segment, args.tolerance)
+        _print_results(f"budget {args.target_mb} МБ / {args.seconds}s ({args.profile})", [dict(result, decisions=len(result["decisions"]))])
+        _write_json(args.json_path, {"benchmark": "budget", "platform": sys.platform, "result": result})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
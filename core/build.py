@@ -63,7 +63,7 @@ def build():
     pyinstaller_args.extend(['--add-binary', add_binary_ffmpeg_arg])
     pyinstaller_args.extend(['--add-data', add_data_icon_arg])
     
-    hidden_imports = ['win32timezone', 'win32com.gen_py', 'psutil'] 
+    hidden_imports = ['win32timezone', 'win32com.gen_py', 'psutil', 'av'] # av - бэкенд кодирования pyav (импорт в try, без него - subprocess)
     for imp in hidden_imports:
         pyinstaller_args.extend(['--hidden-import', imp])
 
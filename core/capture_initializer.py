@@ -1,82 +1,154 @@
-from window_capture import WindowCapture
-# Импортируем WGCCapture и флаг доступности из него
-from wgc_capture import WGCCapture, is_wgc_fully_available as wgc_module_available
-from config import CAPTURE_METHOD_GDI, CAPTURE_METHOD_WGC
 import sys
 
+from config import CAPTURE_METHOD_GDI, CAPTURE_METHOD_GDI_BITBLT, CAPTURE_METHOD_WGC, CAPTURE_METHOD_SYNTHETIC, CAPTURE_METHOD_MSS
+from frame_source import CAPABILITY_WINDOW, CAPABILITY_ZERO_COPY, CAPABILITY_RESIZE, CAPABILITY_SYNTHETIC, CAPABILITY_SCREEN
+from frame_source import GrabFrameSourceAdapter
+from mss_source import MssFrameSource # Без импорта mss: сам mss нужен только open()
+
+
+class CaptureBackend:
+    """Запись реестра: factory(logger_func, zero_copy, **kwargs) -> FrameSource (еще не открытый)."""
+    __slots__ = ("name", "factory", "capabilities", "is_available", "priority")
+
+    def __init__(self, name, factory, capabilities, is_available, priority):
+        self.name = name
+        self.factory = factory
+        self.capabilities = frozenset(capabilities)
+        self.is_available = is_available
+        self.priority = priority
+
+
+_BACKENDS = {}
+# Что именно захватывается: откат с запрошенного бэкенда - только на бэкенды того же рода (остальное - свойства реализации)
+SOURCE_KIND_CAPABILITIES = frozenset((CAPABILITY_WINDOW, CAPABILITY_SCREEN, CAPABILITY_SYNTHETIC))
+EXPLICIT_ONLY_CAPABILITIES = frozenset((CAPABILITY_SCREEN, CAPABILITY_SYNTHETIC)) # На них откат только по запросу
+
+
+def register_backend(name, factory, capabilities=(), is_available=None, priority=0):
+    """
+    Регистрирует бэкенд захвата. Модули бэкенда импортируются внутри factory/is_available,
+    чтобы реестр загружался и там, где зависимостей бэкенда нет (pywin32, winsdk).
+    """
+    _BACKENDS[name] = CaptureBackend(name, factory, capabilities, is_available or (lambda: True), priority)
+
+
+def get_backend_names(available_only=False):
+    backends = sorted(_BACKENDS.values(), key=lambda backend: -backend.priority)
+    return [backend.name for backend in backends if not available_only or _is_backend_available(backend)]
+
+
+def get_backend_capabilities(name):
+    return _BACKENDS[name].capabilities if name in _BACKENDS else frozenset()
+
+
+def _is_backend_available(backend):
+    try: return bool(backend.is_available())
+    except Exception: return False
+
+
+def _candidate_backends(name, required_capabilities, logger_func):
+    required = frozenset(required_capabilities)
+    candidates = []
+    if name:
+        if name not in _BACKENDS: logger_func(f"[CaptureInit] Неизвестный метод захвата '{name}'.")
+        else: candidates.append(_BACKENDS[name]); required |= _BACKENDS[name].capabilities & SOURCE_KIND_CAPABILITIES
+    # Откат: остальные доступные бэкенды с нужными возможностями, по приоритету. Экран и синтетика - только если запрошены:
+    # иначе отказ окна молча записал бы весь экран или тестовую картинку
+    for backend in sorted(_BACKENDS.values(), key=lambda backend: -backend.priority):
+        if backend in candidates or not required <= backend.capabilities: continue
+        if not backend.capabilities & EXPLICIT_ONLY_CAPABILITIES <= required: continue
+        candidates.append(backend)
+    return candidates
+
+
+def create_frame_source(name=None, required_capabilities=(), logger_func=print, fallback=True, **source_kwargs):
+    """
+    Создает и открывает источник кадров по имени бэкенда и/или по возможностям (CAPABILITY_*).
+    Если запрошенный бэкенд недоступен или не открылся, при fallback=True пробуются остальные.
+    Возвращает кортеж (source, backend_name, error_message); при ошибке source None.
+    """
+    error_message = None
+    for backend in _candidate_backends(name, required_capabilities, logger_func):
+        if not fallback and name and backend.name != name: break
+        if not _is_backend_available(backend):
+            error_message = f"Метод захвата '{backend.name}' недоступен на этой системе ({sys.platform})."
+            logger_func(f"[CaptureInit] {error_message}"); continue
+        logger_func(f"[CaptureInit] Попытка инициализации источника '{backend.name}'...")
+        source = None
+        try:
+            source = backend.factory(logger_func=logger_func, **source_kwargs)
+            if source.open():
+                logger_func(f"[CaptureInit] Источник '{backend.name}' готов: {source.width}x{source.height} ({source.pixel_format}).")
+                return source, backend.name, None
+            error_message = f"Источник '{backend.name}' не удалось инициализировать."
+        except Exception as e_source:
+            error_message = f"Ошибка инициализации источника '{backend.name}': {e_source}"
+        logger_func(f"[CaptureInit] {error_message}")
+        if source is not None:
+            try: source.close()
+            except Exception: pass
+    if error_message is None: error_message = "Нет подходящего метода захвата."
+    logger_func(f"[CaptureInit] Инициализация захвата НЕ удалась: {error_message}")
+    return None, name, error_message
+
+
 def initialize_capturer(hwnd, requested_capture_method, logger_func):
     """
-    Инициализирует подходящий захватчик экрана (WGCCapture или WindowCapture).
+    Инициализирует захват окна запрошенным методом с откатом на другие оконные бэкенды.
     Возвращает кортеж (capturer_instance, actual_method_used, error_message).
-    Если error_message не None, инициализация не удалась.
-    `wgc_available_os_com` теперь не передается, определяется из wgc_capture.py
     """
-    capturer_instance = None
-    actual_method_used = requested_capture_method
-    error_message = "Неизвестная ошибка инициализации захвата."
-    init_success = False
+    return create_frame_source(requested_capture_method, (CAPABILITY_WINDOW,), logger_func, hwnd=hwnd)
 
-    # Проверяем доступность WGC на уровне модуля (импорты winsdk)
-    wgc_is_generally_available = wgc_module_available()
-    logger_func(f"[CaptureInit] Проверка доступности WGC модуля: {wgc_is_generally_available}")
 
+# --- Встроенные бэкенды ---
 
-    if actual_method_used == CAPTURE_METHOD_WGC and wgc_is_generally_available and sys.platform == "win32":
-        logger_func(f"[CaptureInit] Попытка инициализации WGCCapture для HWND: {hwnd}")
-        try:
-            capturer_instance = WGCCapture(hwnd, logger_func=logger_func)
-            if capturer_instance.is_initialized:
-                init_success = True
-                logger_func(f"[CaptureInit] WGCCapture (is_init: True): {capturer_instance.item_width}x{capturer_instance.item_height}")
-                error_message = None 
-            else:
-                # WGCCapture сам должен был залогировать причину, если is_initialized=False
-                error_message = "WGCCapture не удалось инициализировать (см. лог WGCCapture). Попытка GDI."
-                logger_func(f"[CaptureInit] {error_message}")
-                actual_method_used = CAPTURE_METHOD_GDI 
-                capturer_instance = None # Сбрасываем, чтобы не использовать частично инициализированный
-        except Exception as e_wgc: # Ловим ошибки конструктора WGCCapture, если они не были обработаны внутри
-            error_message = f"Критическая ошибка конструктора WGCCapture: {e_wgc}. Попытка GDI."
-            logger_func(f"[CaptureInit] {error_message}")
-            actual_method_used = CAPTURE_METHOD_GDI
-            capturer_instance = None
-    elif actual_method_used == CAPTURE_METHOD_WGC and (not wgc_is_generally_available or not sys.platform == "win32"):
-        logger_func(f"[CaptureInit] WGC запрошен, но недоступен (модуль: {wgc_is_generally_available}, платформа: {sys.platform}). Переключение на GDI.")
-        actual_method_used = CAPTURE_METHOD_GDI
-    
-    # Если выбран GDI (изначально или как фоллбэк)
-    if actual_method_used == CAPTURE_METHOD_GDI and not init_success: # Проверяем init_success, чтобы не перезаписывать успешный WGC
-        logger_func(f"[CaptureInit] Попытка инициализации WindowCapture (GDI) для HWND: {hwnd}")
-        try:
-            capturer_instance = WindowCapture(hwnd, logger_func=logger_func)
-            if capturer_instance.is_initialized_properly:
-                init_success = True
-                logger_func(f"[CaptureInit] WindowCapture (GDI) (is_init: True): {capturer_instance.width}x{capturer_instance.height}")
-                error_message = None 
-            else:
-                # WindowCapture должен был залогировать причину
-                error_message = "WindowCapture (GDI) не удалось инициализировать (см. лог WindowCapture)."
-                logger_func(f"[CaptureInit] {error_message}")
-                capturer_instance = None # Явно сбрасываем
-        except ValueError as e_gdi_val: # Ошибка, которую WindowCapture может бросить при невалидном HWND
-            error_message = f"Ошибка WindowCapture (GDI - ValueError): {e_gdi_val}"
-            logger_func(f"[CaptureInit] {error_message}")
-            capturer_instance = None
-        except Exception as e_gdi_generic: # Другие ошибки конструктора GDI
-            error_message = f"Критическая ошибка конструктора WindowCapture (GDI): {e_gdi_generic}"
-            logger_func(f"[CaptureInit] {error_message}")
-            capturer_instance = None
-            
-    if not init_success:
-        # error_message уже должен быть установлен выше, если была попытка инициализации
-        if not error_message or error_message == "Неизвестная ошибка инициализации захвата.":
-            # Если ни одна ветка не была выполнена или error_message не обновился
-            if actual_method_used == CAPTURE_METHOD_WGC:
-                error_message = "WGC не доступен или не удалось инициализировать."
-            else: # GDI
-                error_message = "GDI не удалось инициализировать."
-        logger_func(f"[CaptureInit] Инициализация захвата НЕ удалась. Метод: {actual_method_used}. Ошибка: {error_message}")
-        return None, actual_method_used, error_message
-
-    logger_func(f"[CaptureInit] Захватчик успешно инициализирован методом: {actual_method_used}")
-    return capturer_instance, actual_method_used, None
\ No newline at end of file
+def _is_windows():
+    return sys.platform == "win32"
+
+
+def _create_gdi_source(logger_func, hwnd, zero_copy=True, **kwargs):
+    from window_utils import WindowFrameGrabberGDI
+    return WindowFrameGrabberGDI(hwnd, logger_func, zero_copy=zero_copy, **kwargs)
+
+
+def _create_gdi_bitblt_source(logger_func, hwnd, zero_copy=True, **kwargs):
+    from window_capture import WindowCapture
+    # WindowCapture: GetBitmapBits (4 байта/пиксель) + cvtColor в BGR (3)
+    return GrabFrameSourceAdapter(CAPTURE_METHOD_GDI_BITBLT, lambda: WindowCapture(hwnd, logger_func=logger_func),
+                                  (CAPABILITY_WINDOW, CAPABILITY_RESIZE), hwnd, logger_func, zero_copy,
+                                  grabber_copy_bytes_per_pixel=7, **kwargs)
+
+
+def _is_wgc_available():
+    if not _is_windows(): return False
+    from wgc_capture import is_wgc_fully_available
+    return is_wgc_fully_available()
+
+
+def _create_wgc_source(logger_func, hwnd, zero_copy=True, **kwargs):
+    from wgc_capture import WGCCapture
+    return GrabFrameSourceAdapter(CAPTURE_METHOD_WGC, lambda: WGCCapture(hwnd, logger_func=logger_func),
+                                  (CAPABILITY_WINDOW,), hwnd, logger_func, zero_copy, **kwargs)
+
+
+def _is_mss_available():
+    from mss_source import is_mss_available
+    return is_mss_available()
+
+
+def _create_mss_source(logger_func, hwnd=None, **kwargs):
+    return MssFrameSource(hwnd, logger_func=logger_func, **kwargs)
+
+
+def _create_synthetic_source(logger_func, hwnd=None, **kwargs):
+    from synthetic_source import SyntheticFrameSource
+    return SyntheticFrameSource(logger_func=logger_func, **kwargs) # hwnd не нужен
+
+
+register_backend(CAPTURE_METHOD_GDI, _create_gdi_source, (CAPABILITY_WINDOW, CAPABILITY_ZERO_COPY, CAPABILITY_RESIZE),
+                 _is_windows, priority=30)
+register_backend(CAPTURE_METHOD_GDI_BITBLT, _create_gdi_bitblt_source, (CAPABILITY_WINDOW, CAPABILITY_RESIZE),
+                 _is_windows, priority=20)
+register_backend(CAPTURE_METHOD_WGC, _create_wgc_source, (CAPABILITY_WINDOW,), _is_wgc_available, priority=10)
+register_backend(CAPTURE_METHOD_MSS, _create_mss_source, MssFrameSource.capabilities, _is_mss_available, priority=5)
+register_backend(CAPTURE_METHOD_SYNTHETIC, _create_synthetic_source, (CAPABILITY_SYNTHETIC,), priority=0)
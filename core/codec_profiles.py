@@ -0,0 +1,156 @@
+import subprocess
+import threading
+
+from config import DEFAULT_VIDEO_PRESET, DEFAULT_VIDEO_CRF
+from config import CODEC_PROFILE_X264, CODEC_PROFILE_X264_SCREEN, CODEC_PROFILE_X265, CODEC_PROFILE_SVTAV1, CODEC_PROFILE_VP9
+
+# Пресеты x264 (их выбирает калибровка encoder_tuning) -> скорость других кодировщиков примерно той же стоимости
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow")
+_SVTAV1_PRESETS = {"ultrafast": 13, "superfast": 12, "veryfast": 11, "faster": 10, "fast": 9, "medium": 8, "slow": 7, "slower": 6, "veryslow": 5}
+_VP9_CPU_USED = {"ultrafast": 8, "superfast": 8, "veryfast": 7, "faster": 7, "fast": 6, "medium": 6, "slow": 5, "slower": 5, "veryslow": 4}
+
+
+class CodecProfile:
+    """
+    Набор параметров кодировщика для экранного контента. Качество задается в единицах CRF x264
+    (DEFAULT_VIDEO_CRF, rate_control) и переводится в шкалу кодировщика: default_crf + (crf - DEFAULT_VIDEO_CRF) * crf_scale.
+    speed_args(preset) переводит preset x264 в настройку скорости кодировщика.
+    """
+    __slots__ = ("name", "encoder", "description", "default_crf", "crf_scale", "max_crf", "speed_args", "extra_args", "pix_fmt", "mp4_tag", "mp4_layout")
+
+    def __init__(self, name, encoder, description, default_crf, speed_args, crf_scale=1.0, max_crf=51, extra_args=(),
+                 pix_fmt="yuv420p", mp4_tag=None, mp4_layout=None):
+        self.name = name
+        self.encoder = encoder
+        self.description = description
+        self.default_crf = default_crf
+        self.crf_scale = crf_scale
+        self.max_crf = max_crf
+        self.speed_args = speed_args
+        self.extra_args = list(extra_args)
+        self.pix_fmt = pix_fmt
+        self.mp4_tag = mp4_tag # Тег дорожки для плееров (hvc1 для HEVC в mp4)
+        self.mp4_layout = mp4_layout # Раскладка итогового mp4 (MP4_LAYOUT_*), None - DEFAULT_MP4_LAYOUT
+
+    def quality(self, crf=None):
+        crf = int(DEFAULT_VIDEO_CRF) if crf is None else crf
+        return max(0, min(self.max_crf, int(round(self.default_crf + (crf - int(DEFAULT_VIDEO_CRF)) * self.crf_scale))))
+
+    def encoder_args(self, preset=DEFAULT_VIDEO_PRESET, threads=None, crf=None, maxrate_bps=None, bufsize_bits=None):
+        """Выходные опции ffmpeg: -c:v, скорость, качество, потолок VBV (если задан), pix_fmt."""
+        args = ['-c:v', self.encoder] + self.speed_args(preset)
+        if threads: args.extend(['-threads', str(threads)])
+        args.extend(['-crf', str(self.quality(crf))])
+        if self.encoder == "libvpx-vp9":
+            # libvpx: -crf с -b:v 0 - постоянное качество, с -b:v N - качество с потолком N (constrained quality)
+            args.extend(['-b:v', f'{maxrate_bps // 1000}k' if maxrate_bps else '0'])
+        elif maxrate_bps:
+            args.extend(['-maxrate', f'{maxrate_bps // 1000}k', '-bufsize', f'{(bufsize_bits or maxrate_bps * 2) // 1000}k'])
+        args.extend(self.extra_args)
+        args.extend(['-pix_fmt', self.pix_fmt])
+        if self.mp4_tag: args.extend(['-tag:v', self.mp4_tag])
+        return args
+
+    def encoder_options(self, preset=DEFAULT_VIDEO_PRESET, threads=None, crf=None, maxrate_bps=None, bufsize_bits=None):
+        """Те же настройки для libav внутри процесса (PyAV): словарь опций кодека без -c:v, pix_fmt и тега дорожки."""
+        args = self.encoder_args(preset, threads, crf, maxrate_bps, bufsize_bits)[2:]
+        options = {}
+        for key, value in zip(args[0::2], args[1::2]):
+            key = key.lstrip('-')
+            if key in ("pix_fmt", "tag:v"): continue
+            options["b" if key == "b:v" else key] = value # -b:v в ffmpeg - опция "b" контекста кодека
+        return options
+
+
+def _x26x_speed_args(preset):
+    return ['-preset', preset if preset in X264_PRESETS else DEFAULT_VIDEO_PRESET]
+
+
+def _svtav1_speed_args(preset):
+    return ['-preset', str(_SVTAV1_PRESETS.get(preset, _SVTAV1_PRESETS[DEFAULT_VIDEO_PRESET]))]
+
+
+def _vp9_speed_args(preset):
+    return ['-deadline', 'realtime', '-cpu-used', str(_VP9_CPU_USED.get(preset, _VP9_CPU_USED[DEFAULT_VIDEO_PRESET]))]
+
+
+_PROFILES = {}
+
+
+def register_codec_profile(profile):
+    _PROFILES[profile.name] = profile
+
+
+def get_codec_profile_names():
+    return list(_PROFILES)
+
+
+def get_codec_profile(name):
+    """Профиль по имени; неизвестное имя - KeyError."""
+    if name not in _PROFILES:
+        raise KeyError(f"Неизвестный профиль кодека: {name} (доступны: {', '.join(_PROFILES)})")
+    return _PROFILES[name]
+
+
+# --- Проверка профилей на локальной сборке ffmpeg ---
+
+_encoders_cache = {}
+_probe_cache = {}
+_probe_lock = threading.Lock()
+
+
+def _get_ffmpeg_encoders(ffmpeg_path):
+    if ffmpeg_path not in _encoders_cache:
+        try:
+            result = subprocess.run([ffmpeg_path, '-hide_banner', '-encoders'], capture_output=True, text=True, timeout=10,
+                                    encoding='utf-8', errors='ignore')
+            # Строки вида " V....D libx264   описание": имя - второе поле
+            _encoders_cache[ffmpeg_path] = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1}
+        except Exception: _encoders_cache[ffmpeg_path] = set()
+    return _encoders_cache[ffmpeg_path]
+
+
+def probe_codec_profile(name, ffmpeg_path="ffmpeg"):
+    """
+    Проверяет профиль на этой сборке ffmpeg: кодировщик есть в -encoders и принимает весь набор параметров
+    (3 кадра testsrc2 с потолком VBV в null). Возвращает (True, None) или (False, причина); результат кэшируется.
+    """
+    cache_key = (name, ffmpeg_path)
+    with _probe_lock:
+        if cache_key in _probe_cache: return _probe_cache[cache_key]
+    profile = get_codec_profile(name)
+    if profile.encoder not in _get_ffmpeg_encoders(ffmpeg_path):
+        result = (False, f"кодировщика {profile.encoder} нет в этой сборке ffmpeg")
+    else:
+        command = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin', '-f', 'lavfi', '-i', 'testsrc2=size=160x90:rate=10',
+                   '-frames:v', '3'] + profile.encoder_args(maxrate_bps=500000) + ['-f', 'null', '-']
+        try:
+            completed = subprocess.run(command, capture_output=True, text=True, timeout=30, encoding='utf-8', errors='ignore')
+            result = (True, None) if completed.returncode == 0 else (False, completed.stderr.strip()[-300:] or f"код {completed.returncode}")
+        except Exception as e_probe: result = (False, str(e_probe))
+    with _probe_lock: _probe_cache[cache_key] = result
+    return result
+
+
+def get_available_codec_profiles(ffmpeg_path="ffmpeg"):
+    return [name for name in _PROFILES if probe_codec_profile(name, ffmpeg_path)[0]]
+
+
+# --- Встроенные профили ---
+# default_crf подобраны по размеру и SSIM на синтетике (profile meeting/scroll 1280x720, benchmarks.py codecs)
+
+register_codec_profile(CodecProfile(CODEC_PROFILE_X264, "libx264", "H.264, совместим со всеми плеерами",
+                                    int(DEFAULT_VIDEO_CRF), _x26x_speed_args))
+# Текст: слабее деблокинг (штрихи не размываются), aq-mode=3 (темный текст на светлом фоне), без psy-trellis
+register_codec_profile(CodecProfile(CODEC_PROFILE_X264_SCREEN, "libx264", "H.264 для экранного контента (текст, слайды)",
+                                    int(DEFAULT_VIDEO_CRF), _x26x_speed_args,
+                                    extra_args=['-x264-params', 'aq-mode=3:deblock=-1,-1:psy-rd=0.6,0.0']))
+register_codec_profile(CodecProfile(CODEC_PROFILE_X265, "libx265", "HEVC: меньше байт при большем CPU",
+                                    int(DEFAULT_VIDEO_CRF) + 2, _x26x_speed_args,
+                                    extra_args=['-x265-params', 'log-level=error'], mp4_tag="hvc1"))
+# scm=2: инструменты экранного контента включаются по анализу кадра
+register_codec_profile(CodecProfile(CODEC_PROFILE_SVTAV1, "libsvtav1", "AV1 (SVT): минимум байт, нужен быстрый CPU",
+                                    40, _svtav1_speed_args, crf_scale=1.5, max_crf=63, extra_args=['-svtav1-params', 'scm=2']))
+register_codec_profile(CodecProfile(CODEC_PROFILE_VP9, "libvpx-vp9", "VP9 (libvpx, realtime) с режимом экранного контента",
+                                    45, _vp9_speed_args, crf_scale=1.5, max_crf=63,
+                                    extra_args=['-row-mt', '1', '-tune-content', 'screen']))
@@ -57,6 +57,137 @@ DEFAULT_VIDEO_CRF = "28"
 DEFAULT_AUDIO_CODEC = "aac"
 DEFAULT_AUDIO_BITRATE = "128k"
 
+# GDI граббер отдает кадр как BGRA-представление памяти DIBSection, ffmpeg принимает его как есть (DEFAULT_PIPE_PIXEL_FORMAT)
+DEFAULT_ZERO_COPY_CAPTURE = True
+# Глубина кольца буферов захвата (DIBSection): захват следующего кадра идет, пока предыдущий пишется в ffmpeg
+DEFAULT_CAPTURE_RING_DEPTH = 3
+
+# Формат кадров в pipe ffmpeg (согласуется при старте, frame_pipeline.negotiate_pipe_pixel_format).
+# "bgr0": кадр захвата (BGRA) идет как есть, альфа не учитывается; в YUV кодировщика кадр переводит
+# один проход swscale в ffmpeg (вместе с уменьшением, если оно в ffmpeg) в DEFAULT_CONVERT_THREADS потоков.
+# "bgra" - то же с альфой; "bgr24" - прежний путь: cv2.cvtColor в Python (на четверть меньше байт в pipe, лишний проход по кадру).
+# "auto" - bgr0, на одноядерной машине - bgr24 (без параллельности суммарный CPU у него меньше).
+# Сравнение CPU на кадр: python benchmarks.py pixfmt
+PIPE_PIXEL_FORMAT_AUTO = "auto"
+PIPE_PIXEL_FORMAT_BGR0 = "bgr0"
+PIPE_PIXEL_FORMAT_BGRA = "bgra"
+PIPE_PIXEL_FORMAT_BGR24 = "bgr24"
+DEFAULT_PIPE_PIXEL_FORMAT = PIPE_PIXEL_FORMAT_AUTO
+DEFAULT_CONVERT_THREADS = 0 # Потоки swscale для преобразования цвета в ffmpeg, 0 - авто (по числу ядер)
+
+# Транспорт кадров в видео-ffmpeg (frame_transport). Кадр пишется прямо из памяти слота (memoryview), без bytes.
+# "pipe" - stdin ffmpeg через канал увеличенной емкости (Windows: размер в CreatePipe, Linux: F_SETPIPE_SZ);
+# "named_pipe" - именованный канал (Windows \\.\pipe\..., POSIX - FIFO), ffmpeg читает его как файл.
+# Сравнение МБ/с и кадров/с: python benchmarks.py transport
+FRAME_TRANSPORT_PIPE = "pipe"
+FRAME_TRANSPORT_NAMED_PIPE = "named_pipe"
+DEFAULT_FRAME_TRANSPORT = FRAME_TRANSPORT_PIPE
+DEFAULT_PIPE_BUFFER_MB = 4 # Емкость канала (0 - системная, 4-64 КБ); Linux без прав ограничивает ее pipe-max-size (1 МБ)
+
+# Методы захвата (имена бэкендов в реестре capture_initializer)
+CAPTURE_METHOD_GDI = "gdi" # PrintWindow в кольцо DIBSection, без копий
+CAPTURE_METHOD_GDI_BITBLT = "gdi_bitblt" # window_capture.WindowCapture (BitBlt/PrintWindow + GetBitmapBits)
+CAPTURE_METHOD_WGC = "wgc" # Windows.Graphics.Capture (winsdk)
+CAPTURE_METHOD_SYNTHETIC = "synthetic" # Тестовые кадры без захвата ОС (synthetic_source)
+CAPTURE_METHOD_MSS = "mss" # Область экрана через mss (mss_source)
+DEFAULT_CAPTURE_METHOD = CAPTURE_METHOD_GDI
+
+# Очередь кадров между потоком захвата и потоком записи в ffmpeg.
+# Политика при переполнении (кодировщик отстает): "drop_oldest" - захват не ждет, выбрасывается самый старый кадр;
+# "drop_newest" - выбрасывается новый; "block" - захват ждет (тики пропускаются). С VFR выброс - лишь более длинный интервал.
+DEFAULT_FRAME_QUEUE_POLICY = "drop_oldest"
+DEFAULT_FRAME_QUEUE_DEPTH = 2 # Кадров в очереди; кольцо захвата создается на 2 слота больше (пишущийся + захватываемый)
+
+DEFAULT_HEALTH_CHECK_INTERVAL_SEC = 0.5 # Проверки окна и процесса ffmpeg во время записи - не на каждом кадре
+# Окно пересоздано клиентом (новый HWND): запись продолжается в новое окно с тем же заголовком, ffmpeg не перезапускается
+DEFAULT_RETARGET_BY_TITLE = True
+DEFAULT_RETARGET_POLL_SEC = 0.5 # Интервал поиска нового окна
+
+# Подавление неизменившихся кадров: такие кадры не идут в pipe, ffmpeg повторяет предыдущий кадр сам
+DEFAULT_SUPPRESS_DUPLICATE_FRAMES = True
+DEFAULT_CHANGE_SAMPLE_STEP = 4 # Шаг сетки сравнения (пиксели по строкам и столбцам)
+DEFAULT_MAX_REPEAT_INTERVAL_SEC = 1.0 # Не реже этого интервала кадр отправляется даже без изменений
+
+# VFR: кадры идут в ffmpeg в Matroska с реальной меткой времени захвата вместо rawvideo с фиксированным -r.
+# Паузы захвата не сдвигают видео относительно звука, повторы не кодируются.
+DEFAULT_VARIABLE_FRAME_RATE = True
+
+# Ограничение выходного разрешения (0 - без ограничения) и дополнительный множитель масштаба.
+# По умолчанию выключено: включается в настройках (max_output_width / max_output_height, например 1080).
+# Уменьшение усредняет пиксели области (INTER_AREA / flags=area), текст остается читаемым.
+DEFAULT_MAX_OUTPUT_WIDTH = 0
+DEFAULT_MAX_OUTPUT_HEIGHT = 0
+DEFAULT_OUTPUT_SCALE = 1.0
+# Где уменьшать: "python" (до pipe, меньше байт в pipe), "ffmpeg" (фильтр scale в процессе кодирования)
+# или "auto" - по измеренной стоимости cv2.resize на первом кадре
+DEFAULT_SCALE_STAGE = "auto"
+DEFAULT_SCALE_CPU_BUDGET = 0.25 # Доля интервала кадра, которую "auto" допускает для уменьшения в Python
+# Размер выходного холста фиксируется при старте; кадры после изменения размера окна вписываются в него:
+# "letterbox" - с сохранением пропорций и черными полями, "stretch" - растягиваются на весь холст
+DEFAULT_CANVAS_FIT = "letterbox"
+
+# Бюджет размера файла (rate_control): цель в МБ на ожидаемую длительность, 0 - выкл. (только CRF)
+# Например, 1500 МБ на 180 минут. Потолок VBV (maxrate/bufsize) пересчитывается по реально записанным байтам,
+# новые настройки кодировщика применяются на границе сегмента (только VFR, сегменты склеиваются при остановке)
+DEFAULT_SIZE_BUDGET_MB = 0
+DEFAULT_EXPECTED_DURATION_MIN = 180
+DEFAULT_SIZE_BUDGET_TOLERANCE = 0.05 # Допуск итогового размера относительно цели
+DEFAULT_RATE_CONTROL_INTERVAL_SEC = 15.0 # Как часто сверяться с бюджетом
+DEFAULT_RATE_CONTROL_MIN_SEGMENT_SEC = 120.0 # Не чаще этого новые настройки (новый сегмент и ключевой кадр)
+
+# Запись сегментами Matroska (recording_session): видео и звук пишутся кусками по DEFAULT_SEGMENT_DURATION_SEC
+# в папку сессии во временной папке (manifest.json + .mkv); при остановке - склейка без перекодирования и
+# ремультиплексирование в mp4. Закрытый сегмент уже воспроизводим: если процесс упал (отключили свет),
+# записанное восстанавливается при следующем запуске (теряется только хвост текущего сегмента)
+DEFAULT_SEGMENTED_RECORDING = True
+DEFAULT_SEGMENT_DURATION_SEC = 60 # Длина сегмента; ключевой кадр ставится на каждой границе
+DEFAULT_RECOVER_UNFINISHED_RECORDINGS = True # Восстанавливать прерванные записи при запуске приложения
+# Сборка итогового mp4 по ходу записи (incremental_mux, только fragmented и не больше одного устройства звука):
+# закрытые сегменты дописываются фрагментами в итоговый файл, остановка обрабатывает только последний кусок
+DEFAULT_INCREMENTAL_MUX = True
+DEFAULT_INCREMENTAL_MUX_INTERVAL_SEC = 10 # Как часто проверять закрытые сегменты
+# Общий срок остановки всех ffmpeg записи (process_supervisor): видео и звук останавливаются одновременно,
+# не вышедшие сами получают сигнал, terminate и kill по долям срока
+DEFAULT_PROCESS_STOP_TIMEOUT_SEC = 10
+# Несколько устройств звука: один ffmpeg захватывает все и смешивает их amix на лету (звук кодируется один раз,
+# остановка - копирование одной дорожки); False - процесс на устройство и amix с перекодированием всего звука при остановке
+DEFAULT_LIVE_AUDIO_MIX = True
+
+# Калибровка кодировщика (encoder_tuning): самый медленный preset, который держит реальное время с запасом,
+# кэшируется по разрешению и сборке ffmpeg в папке настроек; запись стартует с ним автоматически.
+# Калибровка запускается только явно: кнопка "Калибровка" в окне или python benchmarks.py encoder-tune
+DEFAULT_AUTO_TUNE_ENCODER = True
+DEFAULT_ENCODER_TUNING_PRESETS = ("slow", "medium", "fast", "faster", "veryfast", "superfast", "ultrafast") # От медленного к быстрому
+DEFAULT_ENCODER_TUNING_HEADROOM = 0.5 # Кодирование должно быть быстрее реального времени в 1.5 раза (захват и звук тоже едят CPU)
+DEFAULT_ENCODER_TUNING_CLIP_SEC = 3.0 # Длина синтетического клипа одного замера
+
+# Профили кодеков (реестр codec_profiles): проверяются на локальной сборке ffmpeg, недоступный заменяется на x264.
+# Сравнение CPU и МБ/час на этой машине: python benchmarks.py codecs
+CODEC_PROFILE_X264 = "x264" # libx264, как раньше
+CODEC_PROFILE_X264_SCREEN = "x264_screen" # libx264 с параметрами для текста и слайдов
+CODEC_PROFILE_X265 = "x265" # libx265 (HEVC)
+CODEC_PROFILE_SVTAV1 = "svtav1" # libsvtav1 (AV1)
+CODEC_PROFILE_VP9 = "vp9" # libvpx-vp9, realtime + tune-content screen
+DEFAULT_VIDEO_CODEC_PROFILE = CODEC_PROFILE_X264
+
+# Бэкенд кодирования видео: "subprocess" - отдельный процесс ffmpeg, кадры через канал (frame_transport);
+# "pyav" - libav внутри процесса через PyAV (pyav_encoder): кадр слота отдается swscale без копии и без канала,
+# PTS - метка захвата в мс. Без установленного PyAV (pip install av) или без кодировщика в его сборке - "subprocess".
+# Сравнение кадров/с и CPU: python benchmarks.py backends; проверка записи обоими бэкендами: python benchmarks.py recording-check
+ENCODER_BACKEND_SUBPROCESS = "subprocess"
+ENCODER_BACKEND_PYAV = "pyav"
+DEFAULT_ENCODER_BACKEND = ENCODER_BACKEND_SUBPROCESS
+
+# Раскладка итогового mp4 (команда mux при остановке). "faststart" - moov в начале: ffmpeg переписывает весь файл второй раз,
+# остановка растет с длиной записи; "fragmented" - пустой moov в начале и фрагменты по ключевым кадрам, файл готов сразу
+# после записи последнего фрагмента; "moov_end" - moov в конце без перезаписи (локальные плееры, не для отдачи по HTTP).
+# Профиль кодека может задать свою раскладку; явная настройка mp4_layout важнее.
+# Время от остановки до готового файла по длине записи: python benchmarks.py stop-latency
+MP4_LAYOUT_FASTSTART = "faststart"
+MP4_LAYOUT_FRAGMENTED = "fragmented"
+MP4_LAYOUT_MOOV_END = "moov_end"
+DEFAULT_MP4_LAYOUT = MP4_LAYOUT_FRAGMENTED
+
 # Возвращаем CONTROL_MASK
 CONTROL_MASK = 0x0004 # Control key mask for checking Ctrl key press
 
@@ -0,0 +1,212 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from config import FFMPEG_PATH, APP_SETTINGS_DIR, DEFAULT_VIDEO_PRESET
+from config import DEFAULT_ENCODER_TUNING_PRESETS, DEFAULT_ENCODER_TUNING_HEADROOM, DEFAULT_ENCODER_TUNING_CLIP_SEC
+from config import DEFAULT_VIDEO_CODEC_PROFILE
+from codec_profiles import get_codec_profile
+from frame_buffers import write_frame_buffer, BGRA_BYTES_PER_PIXEL
+
+ENCODER_TUNING_FILE_NAME = "encoder_tuning.json"
+ENCODER_TUNING_VERSION = 2 # Меняется вместе с методикой замера: старые результаты кэша не используются
+MIN_CLIP_FRAMES = 60 # Короче - старт x264 (lookahead) заметно занижает скорость
+
+_build_id_cache = {}
+_cache_lock = threading.Lock()
+
+
+class EncoderTuning:
+    """Параметры кодировщика для машины: preset x264 (профиль кодека переводит его в свою скорость) и число потоков (None - авто)."""
+    __slots__ = ("preset", "threads", "encode_fps", "required_fps", "source")
+
+    def __init__(self, preset=DEFAULT_VIDEO_PRESET, threads=None, encode_fps=None, required_fps=None, source="default"):
+        self.preset = preset
+        self.threads = threads
+        self.encode_fps = encode_fps
+        self.required_fps = required_fps
+        self.source = source # "default", "cache" или "calibration"
+
+    def describe(self):
+        threads_str = str(self.threads) if self.threads else "авто"
+        speed_str = f", {self.encode_fps:.0f} к/с при нужных {self.required_fps:.0f}" if self.encode_fps else ""
+        return f"preset {self.preset}, потоков {threads_str}{speed_str} ({self.source})"
+
+    def to_dict(self):
+        return {"preset": self.preset, "threads": self.threads, "encode_fps": self.encode_fps, "required_fps": self.required_fps}
+
+
+def resolve_ffmpeg_path(ffmpeg_path=None):
+    ffmpeg_path = ffmpeg_path or FFMPEG_PATH
+    return ffmpeg_path if ffmpeg_path.lower() != "ffmpeg" and os.path.exists(ffmpeg_path) else "ffmpeg"
+
+
+def get_ffmpeg_build_id(ffmpeg_path=None):
+    """Первая строка ffmpeg -version + процессор: результат калибровки действителен только для этой пары."""
+    ffmpeg_path = resolve_ffmpeg_path(ffmpeg_path)
+    if ffmpeg_path not in _build_id_cache:
+        try:
+            result = subprocess.run([ffmpeg_path, '-hide_banner', '-version'], capture_output=True, text=True, timeout=10,
+                                    encoding='utf-8', errors='ignore', creationflags=_get_creation_flags())
+            version_line = result.stdout.splitlines()[0].split(" Copyright")[0].strip() if result.stdout else "unknown"
+        except Exception: version_line = "unknown"
+        _build_id_cache[ffmpeg_path] = f"{version_line} | {platform.machine()} x{os.cpu_count()} | {platform.processor() or sys.platform}"
+    return _build_id_cache[ffmpeg_path]
+
+
+def _get_creation_flags():
+    # Как в FFmpegRecorder: без консольного окна в собранном exe
+    return 0x08000000 if os.name == 'nt' and getattr(sys, 'frozen', False) else 0
+
+
+def _get_cache_path():
+    return os.path.join(APP_SETTINGS_DIR, ENCODER_TUNING_FILE_NAME)
+
+
+def _load_cache():
+    try:
+        with open(_get_cache_path(), 'r', encoding='utf-8') as f: cache = json.load(f)
+    except (OSError, ValueError): return {}
+    return cache if cache.get("version") == ENCODER_TUNING_VERSION else {}
+
+
+def _save_cache(cache, logger_func):
+    cache["version"] = ENCODER_TUNING_VERSION
+    try:
+        os.makedirs(APP_SETTINGS_DIR, exist_ok=True)
+        with open(_get_cache_path(), 'w', encoding='utf-8') as f: json.dump(cache, f, ensure_ascii=False, indent=4)
+    except OSError as e_save: logger_func(f"[EncoderTuning] Не удалось сохранить кэш калибровки: {e_save}")
+
+
+def _resolution_key(width, height, framerate):
+    return f"{width}x{height}@{framerate}"
+
+
+def _get_profile_entries(cache, ffmpeg_path, codec_profile):
+    return cache.get("builds", {}).get(get_ffmpeg_build_id(ffmpeg_path), {}).get(codec_profile, {})
+
+
+def load_cached_tuning(width, height, framerate, ffmpeg_path=None, codec_profile=DEFAULT_VIDEO_CODEC_PROFILE):
+    """
+    Результат калибровки профиля кодека для этой сборки ffmpeg: точное разрешение или ближайшее большее при той же частоте кадров
+    (preset, держащий реальное время на большем кадре, удержит его и на меньшем). None - калибровки нет.
+    """
+    with _cache_lock: entries = _get_profile_entries(_load_cache(), ffmpeg_path, codec_profile)
+    entry = entries.get(_resolution_key(width, height, framerate))
+    if entry is None:
+        candidates = []
+        for key, value in entries.items():
+            size_str, _, framerate_str = key.partition("@")
+            entry_w, entry_h = (int(part) for part in size_str.split("x"))
+            if framerate_str == str(framerate) and entry_w * entry_h >= width * height: candidates.append((entry_w * entry_h, value))
+        if not candidates: return None
+        entry = min(candidates, key=lambda candidate: candidate[0])[1]
+    return EncoderTuning(entry["preset"], entry.get("threads"), entry.get("encode_fps"), entry.get("required_fps"), source="cache")
+
+
+def get_encoder_tuning(width, height, framerate, ffmpeg_path=None, codec_profile=DEFAULT_VIDEO_CODEC_PROFILE, logger_func=print):
+    """Параметры для старта записи: из кэша калибровки, иначе DEFAULT_VIDEO_PRESET с потоками кодировщика по умолчанию."""
+    tuning = load_cached_tuning(width, height, framerate, ffmpeg_path, codec_profile)
+    if tuning is None:
+        logger_func(f"[EncoderTuning] Калибровки {codec_profile} для {width}x{height}@{framerate} нет, используется preset {DEFAULT_VIDEO_PRESET} "
+                    f"(калибровка - кнопка \"Калибровка\" или benchmarks.py encoder-tune).")
+        return EncoderTuning()
+    return tuning
+
+
+def _thread_candidates():
+    cpu_count = os.cpu_count() or 1
+    return sorted({count for count in (1, 2, 4, cpu_count // 2, cpu_count) if 1 <= count <= cpu_count})
+
+
+def _measure_encode_fps(ffmpeg_path, frames, width, height, framerate, profile, preset, threads, stop_event=None):
+    # Кодирование клипа в null как можно быстрее; подача через pipe, как при записи (стоимость записи в stdin учитывается)
+    command = [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin', '-f', 'rawvideo', '-pix_fmt', 'bgra',
+               '-s', f'{width}x{height}', '-framerate', str(framerate), '-i', 'pipe:0',
+               ] + profile.encoder_args(preset, threads) + ['-f', 'null', '-']
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=_get_creation_flags(), bufsize=0)
+    start_time = time.perf_counter()
+    try:
+        for frame in frames:
+            if stop_event is not None and stop_event.is_set(): break
+            write_frame_buffer(process.stdin, frame)
+    except (IOError, BrokenPipeError): pass
+    finally:
+        try: process.stdin.close()
+        except Exception: pass
+    stderr_text = process.stderr.read().decode('utf-8', errors='ignore').strip(); process.wait()
+    elapsed = time.perf_counter() - start_time
+    if stop_event is not None and stop_event.is_set(): return None
+    if process.returncode != 0: raise RuntimeError(f"ffmpeg завершился с кодом {process.returncode}: {stderr_text}")
+    return len(frames) / elapsed if elapsed > 0 else 0.0
+
+
+def _render_clip(width, height, framerate, clip_sec):
+    # Кадры "встречи" (слайд + движущаяся плитка камеры) заранее: генерация не входит в замер
+    from synthetic_source import SyntheticFrameSource, SYNTHETIC_PROFILE_MEETING
+    source = SyntheticFrameSource(width, height, profile=SYNTHETIC_PROFILE_MEETING, logger_func=lambda message: None)
+    source.open()
+    frame_count = max(MIN_CLIP_FRAMES, int(clip_sec * framerate))
+    # Уникальных кадров немного: плитка движется по кругу, повтор каждые 8 кадров x264 все равно кодирует заново
+    pool = [np.empty((height, width, BGRA_BYTES_PER_PIXEL), dtype=np.uint8) for _ in range(min(8, frame_count))]
+    for frame in pool: source.grab_into(frame)
+    source.close()
+    return [pool[index % len(pool)] for index in range(frame_count)]
+
+
+def calibrate_encoder(width, height, framerate, ffmpeg_path=None, headroom=DEFAULT_ENCODER_TUNING_HEADROOM,
+                      presets=DEFAULT_ENCODER_TUNING_PRESETS, clip_sec=DEFAULT_ENCODER_TUNING_CLIP_SEC,
+                      codec_profile=DEFAULT_VIDEO_CODEC_PROFILE, logger_func=print, stop_event=None):
+    """
+    Кодирует короткий синтетический клип размера width x height и выбирает самый медленный preset из presets
+    (упорядочены от медленного к быстрому), который держит framerate * (1 + headroom) кадров в секунду,
+    и для него - наименьшее число потоков (остальные ядра остаются захвату и звуку).
+    Замер - с параметрами профиля кодека codec_profile (preset переводится в его скорость).
+    Результат сохраняется в кэш по профилю, разрешению и сборке ffmpeg. None - калибровка прервана stop_event.
+    """
+    ffmpeg_path = resolve_ffmpeg_path(ffmpeg_path)
+    profile = get_codec_profile(codec_profile)
+    width, height = width // 2 * 2, height // 2 * 2
+    required_fps = framerate * (1.0 + headroom)
+    frames = _render_clip(width, height, framerate, clip_sec)
+    thread_counts = _thread_candidates()
+    logger_func(f"[EncoderTuning] Калибровка {profile.name} {width}x{height}@{framerate}: нужно {required_fps:.1f} к/с, "
+                f"preset {', '.join(presets)}, потоки {thread_counts}.")
+    trials = []
+    chosen = None
+    for preset in presets:
+        # Сначала все потоки: если preset не успевает и так, меньшее число потоков не поможет
+        fps = _measure_encode_fps(ffmpeg_path, frames, width, height, framerate, profile, preset, thread_counts[-1], stop_event)
+        if fps is None: return None
+        trials.append({"preset": preset, "threads": thread_counts[-1], "fps": round(fps, 1)})
+        logger_func(f"[EncoderTuning] {preset}, потоков {thread_counts[-1]}: {fps:.1f} к/с.")
+        if fps < required_fps: continue
+        chosen = EncoderTuning(preset, thread_counts[-1], round(fps, 1), required_fps, source="calibration")
+        for threads in thread_counts[:-1]:
+            fps = _measure_encode_fps(ffmpeg_path, frames, width, height, framerate, profile, preset, threads, stop_event)
+            if fps is None: return None
+            trials.append({"preset": preset, "threads": threads, "fps": round(fps, 1)})
+            logger_func(f"[EncoderTuning] {preset}, потоков {threads}: {fps:.1f} к/с.")
+            if fps >= required_fps:
+                chosen = EncoderTuning(preset, threads, round(fps, 1), required_fps, source="calibration"); break
+        break
+    if chosen is None:
+        # Даже самый быстрый preset не держит реальное время с запасом: самый быстрый замер (захват будет выбрасывать кадры)
+        best = max(trials, key=lambda trial: trial["fps"])
+        chosen = EncoderTuning(best["preset"], best["threads"], best["fps"], required_fps, source="calibration")
+        logger_func(f"[EncoderTuning] Ни один preset не держит {required_fps:.1f} к/с, выбран самый быстрый.")
+    logger_func(f"[EncoderTuning] Выбрано для {profile.name} {width}x{height}@{framerate}: {chosen.describe()}.")
+
+    with _cache_lock:
+        cache = _load_cache()
+        entries = cache.setdefault("builds", {}).setdefault(get_ffmpeg_build_id(ffmpeg_path), {}).setdefault(profile.name, {})
+        entries[_resolution_key(width, height, framerate)] = dict(chosen.to_dict(), headroom=headroom, trials=trials,
+                                                                  calibrated_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+        _save_cache(cache, logger_func)
+    return chosen
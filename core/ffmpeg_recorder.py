@@ -3,36 +3,256 @@ import cv2
 import threading
 import time
 import os
-import win32gui
-import win32con
 import subprocess 
-import signal
 import tempfile 
+import re
 import sys # Для sys.frozen
+try:
+    import win32gui
+    import win32con
+except ImportError: # Не Windows: доступны только источники кадров без окна (см. capture_initializer)
+    win32gui = None; win32con = None
 
 from config import DEFAULT_FRAMERATE, FFMPEG_PATH, NO_AUDIO_DEVICE_SELECTED
-from config import DEFAULT_VIDEO_PRESET, DEFAULT_VIDEO_CRF, DEFAULT_AUDIO_CODEC, DEFAULT_AUDIO_BITRATE
-from window_utils import WindowFrameGrabberGDI 
+from config import DEFAULT_AUDIO_CODEC, DEFAULT_AUDIO_BITRATE
+from config import DEFAULT_ZERO_COPY_CAPTURE, DEFAULT_SUPPRESS_DUPLICATE_FRAMES, DEFAULT_VARIABLE_FRAME_RATE
+from config import DEFAULT_MAX_OUTPUT_WIDTH, DEFAULT_MAX_OUTPUT_HEIGHT, DEFAULT_OUTPUT_SCALE, DEFAULT_SCALE_STAGE, DEFAULT_CANVAS_FIT
+from config import DEFAULT_CAPTURE_METHOD, DEFAULT_FRAME_QUEUE_POLICY, DEFAULT_FRAME_QUEUE_DEPTH, DEFAULT_HEALTH_CHECK_INTERVAL_SEC
+from config import DEFAULT_RETARGET_POLL_SEC, DEFAULT_MAX_REPEAT_INTERVAL_SEC, DEFAULT_SIZE_BUDGET_MB, DEFAULT_EXPECTED_DURATION_MIN
+from config import DEFAULT_AUTO_TUNE_ENCODER, DEFAULT_VIDEO_CODEC_PROFILE, CODEC_PROFILE_X264
+from config import DEFAULT_PIPE_PIXEL_FORMAT, DEFAULT_CONVERT_THREADS, PIPE_PIXEL_FORMAT_BGR24
+from config import DEFAULT_FRAME_TRANSPORT, DEFAULT_PIPE_BUFFER_MB
+from config import DEFAULT_ENCODER_BACKEND, ENCODER_BACKEND_SUBPROCESS, ENCODER_BACKEND_PYAV
+from config import DEFAULT_SEGMENTED_RECORDING, DEFAULT_SEGMENT_DURATION_SEC, DEFAULT_INCREMENTAL_MUX, DEFAULT_PROCESS_STOP_TIMEOUT_SEC
+from config import DEFAULT_LIVE_AUDIO_MIX
+from config import DEFAULT_MP4_LAYOUT, MP4_LAYOUT_FASTSTART, MP4_LAYOUT_FRAGMENTED, MP4_LAYOUT_MOOV_END
+from capture_initializer import create_frame_source
+from frame_source import CAPABILITY_WINDOW
+from frame_buffers import write_frame_buffer
+from frame_pipeline import FrameChangeDetector, OutputScaler, CanvasFitter, FrameCrop, FramePipelineStats, compute_output_size, choose_scale_stage
+from frame_pipeline import SCALE_STAGE_PYTHON, SCALE_STAGE_FFMPEG, SCALE_STAGE_AUTO
+from frame_pipeline import negotiate_pipe_pixel_format, build_conversion_filter
+from matroska_pipe import MatroskaPipeWriter
+from frame_transport import create_frame_transport
+from frame_queue import FrameQueue, FRAME_QUEUE_POLICY_BLOCK
+from frame_scheduler import FrameScheduler, HealthMonitor
+from rate_control import SizeBudgetController, parse_bitrate
+from encoder_tuning import EncoderTuning, get_encoder_tuning, resolve_ffmpeg_path
+from codec_profiles import get_codec_profile, probe_codec_profile
+from pyav_encoder import PyAVVideoEncoder, is_pyav_available, probe_pyav_codec_profile, describe_pyav
+from recording_session import RecordingSession, SEGMENT_MAX_B_FRAMES, SESSION_STATE_DONE, SESSION_STATE_RECOVERED, SESSION_STATE_FAILED
+from incremental_mux import IncrementalMuxer
+from process_supervisor import ProcessSupervisor, send_quit_command
 
 # Флаг для отладки - не удалять временные файлы
 DEBUG_KEEP_TEMP_FILES = True # Установите в True для отладки звука
 
+# Раскладка итогового mp4 -> опции muxer mp4 (см. DEFAULT_MP4_LAYOUT в config)
+MP4_LAYOUT_ARGS = {
+    MP4_LAYOUT_FASTSTART: ['-movflags', '+faststart'],
+    MP4_LAYOUT_FRAGMENTED: ['-movflags', '+frag_keyframe+empty_moov+default_base_moof'],
+    MP4_LAYOUT_MOOV_END: [],
+}
+
+
+def build_amix_filter(input_labels, output_label="a_out"):
+    """Смешивание дорожек звука с равными весами: при остановке (mux) или на лету в одном процессе захвата."""
+    weights_str = " ".join(["1"] * len(input_labels))
+    return ("".join(f"[{label}]" for label in input_labels) +
+            f"amix=inputs={len(input_labels)}:duration=longest:dropout_transition=2:weights='{weights_str}'[{output_label}]")
+
+
+def _mux_input_args(path):
+    # Сегментная запись: вход - список ffconcat сегментов Matroska (склейка без перекодирования в той же команде)
+    if path.endswith(".ffconcat"): return ['-f', 'concat', '-safe', '0', '-i', path]
+    return ['-i', path]
+
+
+def build_ffmpeg_mux_command(temp_video_path, temp_audio_files_list, final_output_path, video_tag=None, mp4_layout=DEFAULT_MP4_LAYOUT):
+    command = [FFMPEG_PATH if FFMPEG_PATH.lower() != "ffmpeg" and os.path.exists(FFMPEG_PATH) else "ffmpeg"]
+    command.extend(['-hide_banner', '-loglevel', 'error']) 
+    command.extend(_mux_input_args(temp_video_path)) 
+    
+    valid_temp_audio_files = [f for f in temp_audio_files_list if f and os.path.exists(f) and os.path.getsize(f) > 0]
+    for audio_file_path in valid_temp_audio_files: 
+        command.extend(_mux_input_args(audio_file_path)) 
+    
+    map_video_args = ["-map", "0:v"]
+    audio_codec_args = ['-c:a', DEFAULT_AUDIO_CODEC] 
+    
+    if not valid_temp_audio_files:
+        command.extend(['-c:v', 'copy', '-an'])
+        command.extend(map_video_args) 
+    else:
+        command.extend(['-c:v', 'copy']) 
+        command.extend(map_video_args)
+
+        if len(valid_temp_audio_files) == 1:
+            command.extend(['-c:a', 'copy'])
+            command.extend(["-map", "1:a"]) 
+            # Временный .aac - поток ADTS: в mp4 заголовки ADTS переносятся в AudioSpecificConfig
+            if valid_temp_audio_files[0].endswith(".aac"): command.extend(['-bsf:a', 'aac_adtstoasc'])
+        else: 
+            filter_complex_str = build_amix_filter([f"{i+1}:a" for i in range(len(valid_temp_audio_files))])
+            command.extend(['-filter_complex', filter_complex_str])
+            command.extend(["-map", "[a_out]"]) 
+            command.extend(audio_codec_args) 
+            
+    if video_tag: command.extend(['-tag:v', video_tag]) # Сегменты Matroska не хранят тег mp4 (hvc1)
+    if temp_video_path.endswith(".ffconcat"): command.extend(['-video_track_timescale', '1000']) # Метки сегментов - в мс
+    command.extend(['-shortest'])
+    command.extend(MP4_LAYOUT_ARGS.get(mp4_layout, MP4_LAYOUT_ARGS[DEFAULT_MP4_LAYOUT]))
+    command.extend([final_output_path, '-y'])
+    return command
+
+
+def build_session_mux_inputs(session):
+    """Списки ffconcat сессии для build_ffmpeg_mux_command: (видео или None, [звук по дорожкам])."""
+    ffmpeg_path = resolve_ffmpeg_path()
+    video_list = session.build_concat_list("video", ffmpeg_path)
+    audio_lists = [session.build_concat_list(name, ffmpeg_path) for name in session.manifest["audio_tracks"]]
+    return video_list, [path for path in audio_lists if path]
+
+
+def _recovered_output_path(manifest):
+    # Итоговый файл мог появиться (другая запись с тем же именем): восстановленный пишется рядом.
+    # При сборке по ходу записи (incremental_output) там лежит незаконченный mp4 этой же записи - он заменяется.
+    final_output_file = manifest["final_output"]
+    if manifest.get("incremental_output") or not os.path.exists(final_output_file): return final_output_file
+    stem, ext = os.path.splitext(final_output_file)
+    index = 1; candidate = f"{stem}_recovered{ext}"
+    while os.path.exists(candidate): index += 1; candidate = f"{stem}_recovered{index}{ext}"
+    return candidate
+
+
+def recover_recording_session(session, logger_func):
+    """
+    Собирает mp4 из сегментов прерванной записи (RecordingSession в состоянии recording) той же командой mux, что и stop.
+    Возвращает путь итогового файла или None; состояние сессии - recovered или failed (повторно не восстанавливается).
+    """
+    video_list, audio_lists = build_session_mux_inputs(session)
+    if not video_list:
+        logger_func(f"[FFmpegRecorder] Восстановление {session.session_dir}: сегментов видео нет.")
+        session.set_state(SESSION_STATE_FAILED); return None
+    output_file = _recovered_output_path(session.manifest)
+    command = build_ffmpeg_mux_command(video_list, audio_lists, output_file, session.manifest.get("video_tag"),
+                                       session.manifest.get("mp4_layout", DEFAULT_MP4_LAYOUT))
+    logger_func(f"[FFmpegRecorder] Восстановление прерванной записи: {' '.join(command)}")
+    creation_flags = 0x08000000 if os.name == 'nt' and getattr(sys, 'frozen', False) else 0
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore', creationflags=creation_flags)
+    except Exception as e_run:
+        result = None; logger_func(f"[FFmpegRecorder] Исключение при восстановлении записи: {e_run}")
+    if result is None or result.returncode != 0:
+        if result is not None: logger_func(f"[FFmpegRecorder] Ошибка восстановления (FFmpeg код {result.returncode}): {result.stderr.strip()}")
+        session.set_state(SESSION_STATE_FAILED); return None
+    session.set_state(SESSION_STATE_RECOVERED)
+    logger_func(f"[FFmpegRecorder] Прерванная запись восстановлена: {output_file}")
+    if not DEBUG_KEEP_TEMP_FILES: session.remove()
+    return output_file
+
+
 class FFmpegRecorder:
-    def __init__(self, hwnd, output_file, audio_device_names_list, framerate, logger_func, on_critical_error_callback=None):
+    def __init__(self, hwnd, output_file, audio_device_names_list, framerate, logger_func, on_critical_error_callback=None,
+                 zero_copy=DEFAULT_ZERO_COPY_CAPTURE, suppress_duplicates=DEFAULT_SUPPRESS_DUPLICATE_FRAMES,
+                 variable_frame_rate=DEFAULT_VARIABLE_FRAME_RATE, max_output_width=DEFAULT_MAX_OUTPUT_WIDTH,
+                 max_output_height=DEFAULT_MAX_OUTPUT_HEIGHT, output_scale=DEFAULT_OUTPUT_SCALE, scale_stage=DEFAULT_SCALE_STAGE,
+                 crop=None, capture_method=DEFAULT_CAPTURE_METHOD, frame_source=None, capture_options=None,
+                 frame_queue_policy=DEFAULT_FRAME_QUEUE_POLICY, frame_queue_depth=DEFAULT_FRAME_QUEUE_DEPTH,
+                 canvas_fit=DEFAULT_CANVAS_FIT, target_title_pattern=None, size_budget_mb=DEFAULT_SIZE_BUDGET_MB,
+                 expected_duration_min=DEFAULT_EXPECTED_DURATION_MIN, rate_control_options=None, auto_tune_encoder=DEFAULT_AUTO_TUNE_ENCODER,
+                 video_codec=DEFAULT_VIDEO_CODEC_PROFILE, pipe_pixel_format=DEFAULT_PIPE_PIXEL_FORMAT,
+                 convert_threads=DEFAULT_CONVERT_THREADS, frame_transport=DEFAULT_FRAME_TRANSPORT, pipe_buffer_mb=DEFAULT_PIPE_BUFFER_MB,
+                 encoder_backend=DEFAULT_ENCODER_BACKEND, segmented_recording=DEFAULT_SEGMENTED_RECORDING,
+                 segment_duration_sec=DEFAULT_SEGMENT_DURATION_SEC, mp4_layout=None, incremental_mux=DEFAULT_INCREMENTAL_MUX,
+                 process_stop_timeout_sec=DEFAULT_PROCESS_STOP_TIMEOUT_SEC, live_audio_mix=DEFAULT_LIVE_AUDIO_MIX):
         self.hwnd = hwnd
         self.final_output_file = output_file 
         self.audio_device_names_list = audio_device_names_list if audio_device_names_list else []
         self.framerate = framerate if framerate > 0 else DEFAULT_FRAMERATE
         self.logger = logger_func
         self.on_critical_error_callback = on_critical_error_callback
+        self.zero_copy = zero_copy
+        self.requested_pipe_pixel_format = pipe_pixel_format
+        self.pipe_pixel_format = None # Согласуется при старте: bgr0/bgra - кадр как есть, bgr24 - cvtColor в потоке захвата
+        self.convert_threads = convert_threads # Потоки swscale в ffmpeg (преобразование в YUV и уменьшение)
+        self.suppress_duplicates = suppress_duplicates
+        self.change_detector = None
+        self.variable_frame_rate = variable_frame_rate
+        self._matroska_writer = None
+        self.missed_ticks_count = 0
+        self.frame_scheduler = None # FrameScheduler текущей записи (статистика опоздания тиков)
+        self.max_output_width = max_output_width
+        self.max_output_height = max_output_height
+        self.output_scale = output_scale
+        self.scale_stage = scale_stage
+        self.output_scaler = None # OutputScaler, если выход меньше захвата
+        self.active_scale_stage = None # Фактически выбранный этап: SCALE_STAGE_PYTHON или SCALE_STAGE_FFMPEG
+        # Обрезка: словарь x, y, width, height, reference_width, reference_height (см. settings_manager.get_window_crop)
+        self.frame_crop = FrameCrop.from_settings(crop)
+        self.canvas_fit = canvas_fit
+        self._pipe_fitter = None # CanvasFitter: приводит кадр к фиксированному холсту pipe в потоке записи
+        self.pipeline_stats = FramePipelineStats()
         
+        # Источник кадров (FrameSource): готовый frame_source или бэкенд capture_method из реестра capture_initializer
+        self.capture_method = capture_method
+        self.capture_options = capture_options or {} # Параметры бэкенда (например, width/height/profile синтетики)
+        self._external_frame_source = frame_source
         self.frame_grabber = None 
+        # Смена окна на лету (retarget): новый источник готовится в отдельном потоке и подменяется в цикле захвата
+        self.target_title_pattern = target_title_pattern # regex заголовка: при потере окна оно ищется заново
+        self._source_swap_lock = threading.Lock()
+        self._pending_frame_source = None # (источник, hwnd), готовый к подмене
+        self._source_reinit_thread = None
+        self._source_lost = False # Окно потеряно, ждем новое: в pipe идут повторы последнего кадра
+        self._repeat_frame = None # Копия последнего записанного кадра (поток записи) для повторов в разрыве
+        self.retarget_count = 0
         self.ffmpeg_video_process = None 
+        self.frame_transport = frame_transport # Канал кадров в видео-ffmpeg (frame_transport): "pipe" или "named_pipe"
+        self.pipe_buffer_mb = pipe_buffer_mb
+        self.video_transport = None # FrameTransport текущего видео-ffmpeg (подменяется вместе с ним на границе сегмента)
+        self.encoder_backend = encoder_backend # "subprocess" или "pyav" (pyav_encoder), проверяется при старте
+        self.active_encoder_backend = None
+        self.video_encoder = None # PyAVVideoEncoder текущего сегмента (бэкенд pyav), вместо ffmpeg_video_process + video_transport
         self.ffmpeg_audio_processes_list = [] 
+        self._audio_stderr_threads = []
+        self.live_audio_mix = live_audio_mix # Несколько устройств звука - один ffmpeg с amix на лету (одна дорожка)
+        self.audio_capture_groups = [] # Устройства каждого процесса звука: [[имя, ...], ...] по дорожкам
+        self.process_stop_timeout_sec = process_stop_timeout_sec # Общий срок остановки всех ffmpeg (process_supervisor)
+        self.last_process_stop_report = [] # [{name, returncode, exit_sec, action}] последней остановки
+        # Бюджет размера файла: SizeBudgetController меняет maxrate/CRF на границах сегментов видео
+        self.size_budget_mb = size_budget_mb
+        self.expected_duration_min = expected_duration_min
+        self.rate_control_options = rate_control_options or {} # tolerance/interval_sec/min_segment_sec контроллера
+        self.rate_controller = None
+        self._rate_control_thread = None
+        self.auto_tune_encoder = auto_tune_encoder
+        self.encoder_tuning = EncoderTuning() # preset/потоки x264: из кэша калибровки encoder_tuning при старте
+        self.video_codec = video_codec
+        self.codec_profile = get_codec_profile(CODEC_PROFILE_X264) # Профиль из реестра codec_profiles, проверяется при старте
+        self._video_command_args = None # (ширина, высота, формат pipe, фильтр) для команд следующих сегментов
+        self._video_segments = [] # {"path", "start" - метка первого кадра, "settings"}; склеиваются при остановке
+        self._pending_video_segment = None # Запущенный ffmpeg следующего сегмента, подменяется потоком записи
+        self._segment_closer_threads = []
+        self._segment_temp_files = [] # Файлы сегментов и список склейки (удаляются вместе с временным видео)
         self.temp_audio_files_list = []       
+        # Сегментная запись: видео и звук пишутся сегментами Matroska в папку RecordingSession (recording_session),
+        # при остановке - склейка и перенос в mp4 без перекодирования; после сбоя сегменты восстанавливаются
+        self.segmented_recording = segmented_recording
+        self.segment_duration_sec = segment_duration_sec
+        self.recording_session = None # В этом режиме temp_video_file и temp_audio_files_list - шаблоны файлов сегментов
+        self.mp4_layout = mp4_layout # Раскладка итогового mp4; None - из профиля кодека или DEFAULT_MP4_LAYOUT
+        self.active_mp4_layout = DEFAULT_MP4_LAYOUT
+        self.incremental_mux = incremental_mux # Сборка итогового mp4 по ходу записи (incremental_mux), только для fragmented
+        self.incremental_muxer = None
+        self._finalize_thread = None # Поток stop_async
 
         self._stop_event = threading.Event()
         self._video_recording_thread = None 
+        self.frame_queue_policy = frame_queue_policy
+        self.frame_queue_depth = max(1, int(frame_queue_depth))
+        self._frame_handoff_queue = None # FrameQueue: (кадр, слот кольца, метка) от потока захвата к потоку записи
+        self._writer_error_msg = None
         
         self.temp_video_file = ""
         
@@ -43,6 +263,121 @@ class FFmpegRecorder:
     def get_frames_written(self):
         return self.frames_written_count
 
+    def get_suppressed_frames(self):
+        return self.change_detector.suppressed_frames if self.change_detector else 0
+
+    def get_pipeline_stats(self):
+        return self.pipeline_stats.snapshot(1.0 / self.framerate)
+
+    def get_stats_snapshot(self):
+        """
+        Живой снимок горячего пути: гистограммы этапов кадра (grab, crop, change_detect, convert, copy/scale, write)
+        и опоздания тиков планировщика, с числом значений сверх бюджета кадра (1 / framerate), плюс счетчики и очередь.
+        """
+        return {
+            "frame_budget_ms": round(1000.0 / self.framerate, 3),
+            "stages": self.get_pipeline_stats(),
+            "scheduler_lateness": self.get_pacing_stats(),
+            "frame_queue": self.get_frame_queue_stats(),
+            "frames_written": self.frames_written_count, "frames_suppressed": self.get_suppressed_frames(),
+            "frames_dropped": self.get_dropped_frames(), "missed_ticks": self.missed_ticks_count,
+        }
+
+    def get_dropped_frames(self):
+        return self._frame_handoff_queue.snapshot()["dropped"] if self._frame_handoff_queue else 0
+
+    def get_frame_queue_stats(self):
+        # Живые метрики очереди захват -> запись; write_blocked_ms - суммарное время в записи в stdin ffmpeg
+        stats = self._frame_handoff_queue.snapshot() if self._frame_handoff_queue else {}
+        write_stats = self.pipeline_stats.snapshot().get("write")
+        if stats: stats["write_blocked_ms"] = write_stats.get("total_ms", 0.0) if write_stats else 0.0
+        return stats
+
+    def get_rate_control_stats(self):
+        # Бюджет размера: цель, записано видео, решения контроллера и число сегментов
+        if not self.rate_controller: return {}
+        return {"target_mb": round(self.rate_controller.target_bytes / 1e6, 2),
+                "video_budget_mb": round(self.rate_controller.video_budget_bytes / 1e6, 2),
+                "video_written_mb": round(self._get_video_bytes_written() / 1e6, 2),
+                "segments": len(self._video_segments), "decisions": list(self.rate_controller.decisions)}
+
+    def retarget(self, hwnd=None, title_pattern=None):
+        """
+        Переключает идущую запись на другое окно без перезапуска ffmpeg и аудио: hwnd - конкретное окно,
+        title_pattern - regex заголовка (ищется сейчас и заново при каждой следующей потере окна).
+        Источник для нового окна открывается в отдельном потоке; до подмены захват продолжается из старого окна,
+        а если оно уже закрыто - в pipe повторяется последний кадр. Возвращает True, если переключение начато.
+        """
+        if not self.is_recording or self._external_frame_source is not None: return False
+        if title_pattern is not None: self.target_title_pattern = title_pattern
+        if not hwnd and not self.target_title_pattern: return False
+        return self._start_source_reinit(hwnd)
+
+    def _resolve_target_window(self):
+        if not self.target_title_pattern: return None, None
+        from windows_utils import get_active_windows
+        for title, hwnd in get_active_windows().items():
+            if hwnd == self.hwnd and not self._source_lost: continue # Текущее окно: ищем именно новое
+            if re.search(self.target_title_pattern, title, re.IGNORECASE): return hwnd, title
+        return None, None
+
+    def _create_window_source(self, hwnd):
+        # Кольцо: кадры в очереди + пишущийся + захватываемый, чтобы захват не ждал слот при полной очереди
+        source_kwargs = {"ring_depth": self.frame_queue_depth + 2}; source_kwargs.update(self.capture_options)
+        required_capabilities = (CAPABILITY_WINDOW,) if hwnd else () # Без hwnd (синтетика и т.п.) окно не проверяем
+        return create_frame_source(self.capture_method, required_capabilities, self.logger,
+                                   hwnd=hwnd, zero_copy=self.zero_copy, **source_kwargs)
+
+    def _start_source_reinit(self, hwnd=None):
+        with self._source_swap_lock:
+            if self._source_reinit_thread and self._source_reinit_thread.is_alive(): return False
+            self._source_reinit_thread = threading.Thread(target=self._source_reinit_loop, args=(hwnd,), daemon=True)
+            self._source_reinit_thread.start()
+        return True
+
+    def _source_reinit_loop(self, hwnd):
+        # Вне потоков захвата и записи: поиск окна и инициализация источника могут занимать сотни мс
+        while not self._stop_event.is_set():
+            target_hwnd, title = (hwnd, None) if hwnd else self._resolve_target_window()
+            if target_hwnd:
+                source, method_used, source_error = self._create_window_source(target_hwnd)
+                if source is not None:
+                    with self._source_swap_lock:
+                        accepted = not self._stop_event.is_set() # После остановки цикл захвата уже не подменит источник
+                        if accepted: self._pending_frame_source = (source, target_hwnd)
+                    if not accepted: source.close(); return
+                    self.logger(f"[FFmpegRecorder] Новый источник '{method_used}' для окна {target_hwnd}" + (f" ('{title}')" if title else "") +
+                                f" готов: {source.width}x{source.height}.")
+                    return
+                self.logger(f"[FFmpegRecorder] Окно {target_hwnd}: источник не открылся ({source_error}).")
+                if hwnd: return # Явно заданное окно не повторяем
+            self._stop_event.wait(DEFAULT_RETARGET_POLL_SEC)
+
+    def _swap_pending_frame_source(self):
+        # Поток захвата, между тиками: слоты старого источника в очереди вернутся ему (источник едет в элементе очереди)
+        with self._source_swap_lock:
+            pending = self._pending_frame_source; self._pending_frame_source = None
+        if pending is None: return
+        old_source = self.frame_grabber
+        self.frame_grabber, self.hwnd = pending
+        self._source_lost = False; self.retarget_count += 1
+        self.logger(f"[FFmpegRecorder] Захват переключен на окно {self.hwnd} (переключений: {self.retarget_count}).")
+        if old_source is not None:
+            threading.Thread(target=self._close_retired_source, args=(old_source,), daemon=True).start()
+
+    def _close_retired_source(self, source):
+        if not source.frame_ring.wait_all_released(timeout=5.0):
+            self.logger(f"[FFmpegRecorder] Старый источник: слоты не возвращены за 5с, освобождение принудительно.")
+        try: source.close()
+        except Exception as e_close: self.logger(f"[FFmpegRecorder] Ошибка закрытия старого источника: {e_close}")
+
+    def get_pacing_stats(self):
+        return self.frame_scheduler.lateness_snapshot() if self.frame_scheduler else {}
+
+    def get_frames_recorded(self):
+        # Кадры на временной шкале записи: отправленные + подавленные и выброшенные (они покрыты предыдущим кадром)
+        return self.frames_written_count + self.get_suppressed_frames() + self.get_dropped_frames()
+
     def _add_error_message(self, message, is_critical=False):
         if message:
             self.accumulated_error_messages.append(message)
@@ -58,89 +393,142 @@ class FFmpegRecorder:
 
 
     def _initialize_grabber(self):
-        if not (self.hwnd and win32gui.IsWindow(self.hwnd)):
-            self.accumulated_error_messages.append("HWND окна недействителен или окно закрыто."); return False
-        
-        if win32gui.IsIconic(self.hwnd): 
-            self.logger(f"[FFmpegRecorder] Окно {self.hwnd} свернуто, попытка восстановления...")
-            win32gui.ShowWindow(self.hwnd, win32con.SW_RESTORE); time.sleep(0.5) 
-            if not win32gui.IsWindow(self.hwnd) or win32gui.IsIconic(self.hwnd):
-                self.accumulated_error_messages.append("Не удалось восстановить свернутое окно."); return False
-            self.logger(f"[FFmpegRecorder] Окно {self.hwnd} восстановлено.")
+        if self._external_frame_source is not None:
+            self.frame_grabber = self._external_frame_source
+            if not self.frame_grabber.is_initialized and not self.frame_grabber.open():
+                self.accumulated_error_messages.append(f"Источник кадров '{self.frame_grabber.name}' не удалось открыть.")
+                self.frame_grabber = None; return False
+            self.logger(f"[FFmpegRecorder] Источник кадров '{self.frame_grabber.name}': {self.frame_grabber.width}x{self.frame_grabber.height} ({self.frame_grabber.pixel_format})")
+            return True
         
-        self.frame_grabber = WindowFrameGrabberGDI(self.hwnd, self.logger)
+        if self.hwnd:
+            if win32gui is None:
+                self.accumulated_error_messages.append("pywin32 недоступен: захват окна невозможен."); return False
+            if not win32gui.IsWindow(self.hwnd):
+                self.accumulated_error_messages.append("HWND окна недействителен или окно закрыто."); return False
+            
+            if win32gui.IsIconic(self.hwnd): 
+                self.logger(f"[FFmpegRecorder] Окно {self.hwnd} свернуто, попытка восстановления...")
+                win32gui.ShowWindow(self.hwnd, win32con.SW_RESTORE); time.sleep(0.5) 
+                if not win32gui.IsWindow(self.hwnd) or win32gui.IsIconic(self.hwnd):
+                    self.accumulated_error_messages.append("Не удалось восстановить свернутое окно."); return False
+                self.logger(f"[FFmpegRecorder] Окно {self.hwnd} восстановлено.")
         
-        if not self.frame_grabber.is_initialized or self.frame_grabber.width <= 0 or self.frame_grabber.height <= 0:
-            w_val = getattr(self.frame_grabber, 'width', 'N/A_grabber_w')
-            h_val = getattr(self.frame_grabber, 'height', 'N/A_grabber_h')
-            self.accumulated_error_messages.append(f"GDI граббер: ошибка инициализации/размеров (w={w_val}, h={h_val}).")
-            if self.frame_grabber: self.frame_grabber.close(); self.frame_grabber = None
-            return False
-        self.logger(f"[FFmpegRecorder] GDI граббер инициализирован: {self.frame_grabber.width}x{self.frame_grabber.height}")
+        self.frame_grabber, method_used, source_error = self._create_window_source(self.hwnd)
+        if self.frame_grabber is None:
+            self.accumulated_error_messages.append(f"Источник кадров: {source_error}"); return False
+        self.logger(f"[FFmpegRecorder] Источник кадров '{method_used}' инициализирован: {self.frame_grabber.width}x{self.frame_grabber.height} ({self.frame_grabber.pixel_format}, zero_copy={self.frame_grabber.zero_copy})")
         return True
 
+    def _setup_output_scaler(self):
+        self.output_scaler = None; self.active_scale_stage = None
+        capture_w, capture_h = self._get_source_frame_size()
+        if self.frame_crop:
+            crop_x, crop_y = self.frame_crop.resolve(self.frame_grabber.width, self.frame_grabber.height)[:2]
+            self.logger(f"[FFmpegRecorder] Обрезка: {self.frame_grabber.width}x{self.frame_grabber.height} -> {capture_w}x{capture_h} с ({crop_x}, {crop_y}).")
+        out_w, out_h = compute_output_size(capture_w, capture_h, self.max_output_width, self.max_output_height, self.output_scale)
+        if (out_w, out_h) == (capture_w, capture_h): return
+        
+        self.output_scaler = OutputScaler(out_w, out_h)
+        stage = self.scale_stage; cost_ms = None
+        if stage == SCALE_STAGE_AUTO:
+            slot = self.frame_grabber.acquire_frame()
+            try: stage, cost_ms = choose_scale_stage(self.output_scaler, self._crop_frame(slot.frame) if slot else None, self.framerate)
+            finally: self.frame_grabber.release_frame(slot)
+        self.active_scale_stage = SCALE_STAGE_PYTHON if stage == SCALE_STAGE_PYTHON else SCALE_STAGE_FFMPEG
+        cost_str = f", cv2.resize {cost_ms:.1f} мс/кадр" if cost_ms is not None else ""
+        self.logger(f"[FFmpegRecorder] Выходное разрешение: {capture_w}x{capture_h} -> {out_w}x{out_h} (этап: {self.active_scale_stage}{cost_str}).")
+
+    def _get_source_frame_size(self):
+        # Размер кадра после обрезки (до масштабирования)
+        if self.frame_crop: return self.frame_crop.resolve(self.frame_grabber.width, self.frame_grabber.height)[2:]
+        return self.frame_grabber.width, self.frame_grabber.height
 
-    def _build_ffmpeg_video_command(self, width, height, temp_video_path):
+    def _get_pipe_frame_size(self):
+        # Размер кадра в pipe: уменьшенный, если уменьшение идет до pipe, иначе размер после обрезки
+        if self.active_scale_stage == SCALE_STAGE_PYTHON: return self.output_scaler.width, self.output_scaler.height
+        return self._get_source_frame_size()
+
+    def _crop_frame(self, frame):
+        # Срез-представление без копии; при изменении размера окна область переякоривается в FrameCrop
+        if not self.frame_crop: return frame
+        stage_start = time.perf_counter()
+        frame = self.frame_crop.apply(frame)
+        self.pipeline_stats.add("crop", time.perf_counter() - stage_start)
+        return frame
+
+
+    def _build_ffmpeg_video_command(self, width, height, temp_video_path, input_pixel_format="bgr24", video_filter=None, rate_settings=None,
+                                    input_url="pipe:0"):
         command = [FFMPEG_PATH if FFMPEG_PATH.lower() != "ffmpeg" and os.path.exists(FFMPEG_PATH) else "ffmpeg"]
         command.extend(['-nostdin', '-threads', '1', '-hide_banner', '-loglevel', 'error'])
-        command.extend(['-fflags', '+genpts', '-f', 'rawvideo', '-pix_fmt', 'bgr24', 
-                        '-s', f'{width}x{height}', '-r', str(self.framerate), '-i', 'pipe:0'])
-        command.extend(['-c:v', 'libx264', '-preset', DEFAULT_VIDEO_PRESET, '-crf', str(DEFAULT_VIDEO_CRF)])
-        command.extend(['-pix_fmt', 'yuv420p', '-an']) 
-        command.extend([temp_video_path, '-y'])
+        if self.variable_frame_rate:
+            # Каждый кадр несет метку времени захвата (Matroska), ffmpeg сохраняет реальные интервалы.
+            # passthrough: без заполнения пропусков повторами; база времени 1 мс, чтобы метки не округлялись.
+            command.extend(['-f', 'matroska', '-i', input_url])
+            command.extend(['-fps_mode', 'passthrough', '-enc_time_base', '1:1000'])
+            if not self.recording_session: command.extend(['-video_track_timescale', '1000']) # Для сегментов - в команде mux
+        elif self.suppress_duplicates:
+            # Неизменившиеся кадры не приходят в pipe: кадр получает метку времени прихода,
+            # а -fps_mode cfr на выходе повторяет предыдущий кадр в пропущенных тиках.
+            # Входной -r не используем: он заставил бы ffmpeg игнорировать метки.
+            command.extend(['-use_wallclock_as_timestamps', '1', '-f', 'rawvideo', '-pix_fmt', input_pixel_format,
+                            '-s', f'{width}x{height}', '-framerate', str(self.framerate), '-i', input_url])
+            command.extend(['-fps_mode', 'cfr', '-r', str(self.framerate)])
+        else:
+            command.extend(['-fflags', '+genpts', '-f', 'rawvideo', '-pix_fmt', input_pixel_format, 
+                            '-s', f'{width}x{height}', '-r', str(self.framerate), '-i', input_url])
+        if video_filter: command.extend(['-vf', video_filter])
+        # Бюджет размера: CRF под потолком VBV (maxrate/bufsize), иначе только CRF
+        command.extend(self.codec_profile.encoder_args(self.encoder_tuning.preset, self.encoder_tuning.threads,
+                                                       rate_settings.crf if rate_settings else None,
+                                                       rate_settings.maxrate_bps if rate_settings else None,
+                                                       rate_settings.bufsize_bits if rate_settings else None))
+        # Контроллеру нужен размер вывода: без -flush_packets mp4 сбрасывается на диск блоками по сотням КБ (десятки секунд
+        # статичного экрана), с ним файл и total_size из -progress растут с каждым пакетом
+        if rate_settings: command.extend(['-flush_packets', '1', '-progress', 'pipe:1', '-stats_period', '0.5'])
+        command.extend(['-an']) 
+        if self._get_max_b_frames(capture_timestamps=self.variable_frame_rate) is not None:
+            command.extend(['-bf', str(self._get_max_b_frames(capture_timestamps=self.variable_frame_rate))])
+        if self.recording_session:
+            # Ключевой кадр на каждой границе сегмента: сегментный muxer режет только по ключевым кадрам
+            command.extend(['-force_key_frames', f'expr:gte(t,n_forced*{self.recording_session.manifest["segment_duration_sec"]})'])
+            command.extend(self.recording_session.segment_muxer_args(temp_video_path))
+        else: command.append(temp_video_path)
+        command.append('-y')
         return command
 
-    def _build_ffmpeg_audio_command(self, audio_device_name, temp_audio_path):
-        if not audio_device_name or audio_device_name == NO_AUDIO_DEVICE_SELECTED:
+    def _get_audio_capture_groups(self):
+        # Устройства по процессам звука: при live_audio_mix несколько устройств пишет один ffmpeg (одна дорожка)
+        if self.live_audio_mix and len(self.audio_device_names_list) > 1: return [list(self.audio_device_names_list)]
+        return [[device_name] for device_name in self.audio_device_names_list]
+
+    def _audio_input_args(self, audio_device_name):
+        return ['-f', 'dshow', '-guess_layout_max', '0', '-i', f'audio={audio_device_name}']
+
+    def _build_ffmpeg_audio_command(self, audio_device_names, temp_audio_path):
+        audio_device_names = [name for name in audio_device_names if name and name != NO_AUDIO_DEVICE_SELECTED]
+        if not audio_device_names:
             return None 
         
         command = [FFMPEG_PATH if FFMPEG_PATH.lower() != "ffmpeg" and os.path.exists(FFMPEG_PATH) else "ffmpeg"]
-        command.extend(['-nostdin', '-threads', '1', '-nostats', '-hide_banner', '-loglevel', 'info']) 
-        command.extend(['-f', 'dshow', '-guess_layout_max', '0', '-i', f'audio={audio_device_name}'])
-        command.extend(['-af', 'asetpts=PTS-STARTPTS']) 
+        # Без -nostdin: остановка - команда "q" в stdin (process_supervisor), ffmpeg сам дописывает файл
+        command.extend(['-threads', '1', '-nostats', '-hide_banner', '-loglevel', 'info']) 
+        for audio_device_name in audio_device_names: command.extend(self._audio_input_args(audio_device_name))
+        if len(audio_device_names) == 1: command.extend(['-af', 'asetpts=PTS-STARTPTS']) 
+        else:
+            # amix на лету: звук кодируется один раз, mux при остановке - копирование одной дорожки
+            filter_parts = [f"[{i}:a]asetpts=PTS-STARTPTS[a{i}]" for i in range(len(audio_device_names))]
+            filter_parts.append(build_amix_filter([f"a{i}" for i in range(len(audio_device_names))]))
+            command.extend(['-filter_complex', ";".join(filter_parts), '-map', '[a_out]'])
         command.extend(['-c:a', DEFAULT_AUDIO_CODEC, '-b:a', DEFAULT_AUDIO_BITRATE, '-ar', '44100', '-ac', '2'])
-        command.extend([temp_audio_path, '-y'])
+        if self.recording_session: command.extend(self.recording_session.segment_muxer_args(temp_audio_path))
+        else: command.append(temp_audio_path)
+        command.append('-y')
         return command
 
-    def _build_ffmpeg_mux_command(self, temp_video_path, temp_audio_files_list, final_output_path):
-        command = [FFMPEG_PATH if FFMPEG_PATH.lower() != "ffmpeg" and os.path.exists(FFMPEG_PATH) else "ffmpeg"]
-        command.extend(['-hide_banner', '-loglevel', 'error']) 
-        command.extend(['-i', temp_video_path]) 
-        
-        valid_temp_audio_files = [f for f in temp_audio_files_list if f and os.path.exists(f) and os.path.getsize(f) > 0]
-        for audio_file_path in valid_temp_audio_files: 
-            command.extend(['-i', audio_file_path]) 
-        
-        map_video_args = ["-map", "0:v"]
-        audio_codec_args = ['-c:a', DEFAULT_AUDIO_CODEC] 
-        
-        if not valid_temp_audio_files:
-            command.extend(['-c:v', 'copy', '-an'])
-            command.extend(map_video_args) 
-        else:
-            command.extend(['-c:v', 'copy']) 
-            command.extend(map_video_args)
-
-            if len(valid_temp_audio_files) == 1:
-                command.extend(['-c:a', 'copy'])
-                command.extend(["-map", "1:a"]) 
-            else: 
-                filter_complex_parts = []
-                for i in range(len(valid_temp_audio_files)): 
-                    filter_complex_parts.append(f"[{i+1}:a]") 
-                
-                filter_complex_str = "".join(filter_complex_parts)
-                weights_str = " ".join(["1"] * len(valid_temp_audio_files))
-                filter_complex_str += f"amix=inputs={len(valid_temp_audio_files)}:duration=longest:dropout_transition=2:weights='{weights_str}'[a_out]"
-                
-                command.extend(['-filter_complex', filter_complex_str])
-                command.extend(["-map", "[a_out]"]) 
-                command.extend(audio_codec_args) 
-                
-        command.extend(['-shortest'])
-        command.extend(['-movflags', '+faststart'])
-        command.extend([final_output_path, '-y'])
-        return command
+    def _build_ffmpeg_mux_command(self, temp_video_path, temp_audio_files_list, final_output_path, video_tag=None):
+        return build_ffmpeg_mux_command(temp_video_path, temp_audio_files_list, final_output_path, video_tag, self.active_mp4_layout)
 
     def _get_creation_flags(self):
         flags = 0
@@ -150,50 +538,317 @@ class FFmpegRecorder:
                 flags |= 0x08000000  # subprocess.CREATE_NO_WINDOW
         return flags
 
+    def _resolve_encoder_backend(self):
+        # pyav - только если PyAV установлен и профиль кодека работает в его сборке libav; иначе видео-ffmpeg
+        if self.encoder_backend not in (ENCODER_BACKEND_SUBPROCESS, ENCODER_BACKEND_PYAV):
+            self.logger(f"[FFmpegRecorder] Неизвестный бэкенд кодирования '{self.encoder_backend}', используется {ENCODER_BACKEND_SUBPROCESS}.")
+        if self.encoder_backend != ENCODER_BACKEND_PYAV: return ENCODER_BACKEND_SUBPROCESS
+        try: available, reason = probe_pyav_codec_profile(self.video_codec)
+        except KeyError as e_profile: available, reason = False, e_profile.args[0]
+        if available: return ENCODER_BACKEND_PYAV
+        self.logger(f"[FFmpegRecorder] ВНИМАНИЕ: бэкенд {ENCODER_BACKEND_PYAV} недоступен ({reason}), запись идет через {ENCODER_BACKEND_SUBPROCESS}.")
+        return ENCODER_BACKEND_SUBPROCESS
+
+    def _resolve_codec_profile(self):
+        # Профиль, который не прошел проверку на этой сборке ffmpeg, заменяется на x264 (запись важнее кодека)
+        try: profile = get_codec_profile(self.video_codec)
+        except KeyError as e_profile:
+            self.logger(f"[FFmpegRecorder] {e_profile.args[0]}, используется {CODEC_PROFILE_X264}."); return get_codec_profile(CODEC_PROFILE_X264)
+        if self.active_encoder_backend == ENCODER_BACKEND_PYAV: return profile # Уже проверен в сборке libav PyAV
+        available, reason = probe_codec_profile(profile.name, resolve_ffmpeg_path())
+        if available: return profile
+        self.logger(f"[FFmpegRecorder] Профиль кодека '{profile.name}' недоступен ({reason}), используется {CODEC_PROFILE_X264}.")
+        return get_codec_profile(CODEC_PROFILE_X264)
+
+    def _resolve_mp4_layout(self):
+        layout = self.mp4_layout or self.codec_profile.mp4_layout or DEFAULT_MP4_LAYOUT
+        if layout in MP4_LAYOUT_ARGS: return layout
+        self.logger(f"[FFmpegRecorder] Неизвестная раскладка mp4 '{layout}', используется {DEFAULT_MP4_LAYOUT}.")
+        return DEFAULT_MP4_LAYOUT
+
+    def _create_rate_controller(self):
+        if not self.size_budget_mb or self.size_budget_mb <= 0: return None
+        # Звук всех устройств сводится в одну дорожку DEFAULT_AUDIO_BITRATE
+        audio_bitrate_bps = parse_bitrate(DEFAULT_AUDIO_BITRATE) if self.audio_device_names_list else 0
+        controller = SizeBudgetController(self.size_budget_mb * 1000000, self.expected_duration_min * 60.0, audio_bitrate_bps,
+                                          logger_func=self.logger, **self.rate_control_options)
+        self.logger(f"[FFmpegRecorder] Бюджет размера: {controller.describe_budget()}.")
+        if not self.variable_frame_rate:
+            # Смена настроек - это новый сегмент с меткой времени первого кадра; без VFR меток нет
+            self.logger("[FFmpegRecorder] Бюджет размера без VFR: только постоянный потолок VBV, без пересчета по ходу записи.")
+        return controller
+
+    def _get_video_bytes_written(self):
+        # По сегментам: total_size из -progress ffmpeg или размер файла, если он больше (сегмент уже закрыт)
+        total = 0
+        for segment in list(self._video_segments):
+            file_size = self._temp_output_size(segment["path"])
+            total += max(file_size, segment["encoder"].bytes_written if "encoder" in segment else segment.get("bytes", 0))
+        return total
+
+    def _read_video_progress(self, process, segment):
+        # Поток чтения stdout ffmpeg (-progress pipe:1) одного сегмента
+        try:
+            for line in process.stdout:
+                if line.startswith(b"total_size="):
+                    try: segment["bytes"] = int(line[11:])
+                    except ValueError: pass # total_size=N/A до первого пакета
+        except Exception: pass
+
+    def _start_video_progress_reader(self, process, segment):
+        if process.stdout: threading.Thread(target=self._read_video_progress, args=(process, segment), daemon=True).start()
+
+    def _rate_control_loop(self):
+        # Отдельный поток: сверка с бюджетом раз в interval_sec; новый ffmpeg запускается заранее, поток записи лишь подменяет pipe
+        controller = self.rate_controller
+        start_time = time.perf_counter(); segment_start_time = start_time
+        while not self._stop_event.wait(controller.interval_sec):
+            if self._pending_video_segment is not None: continue # Предыдущий сегмент еще не подхвачен потоком записи
+            now = time.perf_counter()
+            settings = controller.update(now - start_time, self._get_video_bytes_written(), now - segment_start_time)
+            if settings is not None and self._start_video_segment(settings): segment_start_time = now
+
+    def _launch_video_process(self, output_path, rate_settings):
+        # Канал кадров готовится до ffmpeg (его путь - вход -i) и подключается после запуска. -> (процесс, транспорт, команда)
+        pipe_w, pipe_h, pixel_format, scale_filter = self._video_command_args
+        transport = create_frame_transport(self.frame_transport, int(self.pipe_buffer_mb * 1024 * 1024), self.logger)
+        try:
+            transport.prepare()
+            video_cmd_list = self._build_ffmpeg_video_command(pipe_w, pipe_h, output_path, input_pixel_format=pixel_format,
+                                                              video_filter=scale_filter, rate_settings=rate_settings, input_url=transport.input_url)
+            progress_stdout = subprocess.PIPE if rate_settings else None # -progress pipe:1 для контроллера бюджета
+            process = subprocess.Popen(video_cmd_list, stdin=transport.popen_stdin, stdout=progress_stdout, stderr=subprocess.PIPE,
+                                       creationflags=self._get_creation_flags(), bufsize=0)
+        except Exception:
+            transport.close(); raise
+        if not transport.connect(process):
+            transport.close(); process.kill(); process.wait()
+            raise RuntimeError(f"ffmpeg не подключился к каналу кадров ({transport.name})")
+        return process, transport, video_cmd_list
+
+    def _open_video_encoder(self, output_path, rate_settings):
+        # Бэкенд pyav: кодировщик libav в этом процессе; уменьшение этапа ffmpeg делает его swscale при переводе в YUV
+        pipe_w, pipe_h, pixel_format, _ = self._video_command_args
+        encode_w, encode_h = (self.output_scaler.width, self.output_scaler.height) if self.output_scaler else (pipe_w, pipe_h)
+        return PyAVVideoEncoder(output_path, encode_w, encode_h, self.codec_profile, self.framerate, self.encoder_tuning.preset,
+                                self.encoder_tuning.threads, rate_settings.crf if rate_settings else None,
+                                rate_settings.maxrate_bps if rate_settings else None, rate_settings.bufsize_bits if rate_settings else None,
+                                input_pixel_format=pixel_format, use_timestamps=self.variable_frame_rate or self.suppress_duplicates,
+                                convert_threads=self.convert_threads,
+                                max_b_frames=self._get_max_b_frames(capture_timestamps=self.variable_frame_rate or self.suppress_duplicates),
+                                **self._encoder_container_args(output_path))
+
+    def _get_max_b_frames(self, capture_timestamps):
+        # Без B-кадров: сегменты Matroska (SEGMENT_MAX_B_FRAMES) и метки захвата - задержка B-кадров там в реальных
+        # интервалах между кадрами (секунды статичного экрана): первый DTS уходит в минус, итог начинается и кончается позже
+        if self.recording_session or capture_timestamps: return SEGMENT_MAX_B_FRAMES
+        return None
+
+    def _encoder_container_args(self, output_path):
+        # Сегментная запись: тот же сегментный muxer Matroska, что у видео-ffmpeg, с ключевым кадром на каждой границе
+        if not self.recording_session: return {}
+        return {"container_format": "segment", "container_options": self.recording_session.segment_muxer_options(output_path),
+                "keyframe_interval_sec": self.recording_session.manifest["segment_duration_sec"]}
+
+    def _temp_output_size(self, path):
+        # Размер временного вывода: файл или (сегментная запись) сумма уже созданных сегментов шаблона
+        if self.recording_session: return self.recording_session.output_size(path)
+        try: return os.path.getsize(path)
+        except OSError: return 0
+
+    def _new_video_segment_path(self):
+        if self.recording_session: return self.recording_session.add_video_part()
+        temp_file_obj = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4', prefix='_rec_vid_')
+        segment_path = temp_file_obj.name; temp_file_obj.close()
+        if os.path.exists(segment_path): os.remove(segment_path)
+        return segment_path
+
+    def _start_video_segment(self, rate_settings):
+        segment_path = self._new_video_segment_path()
+        if self.active_encoder_backend == ENCODER_BACKEND_PYAV:
+            try: encoder = self._open_video_encoder(segment_path, rate_settings)
+            except Exception as e_segment:
+                self.logger(f"[FFmpegRecorder] Не удалось открыть кодировщик нового сегмента ({e_segment}), настройки кодировщика не изменены.")
+                self._remove_video_segment_output(segment_path); return False
+            self.logger(f"[FFmpegRecorder] Кодировщик сегмента {len(self._video_segments) + 1} открыт: {rate_settings.describe()}.")
+            self._pending_video_segment = {"path": segment_path, "start": None, "settings": rate_settings, "encoder": encoder}
+            return True
+        try: process, transport, _ = self._launch_video_process(segment_path, rate_settings)
+        except Exception as e_segment:
+            self.logger(f"[FFmpegRecorder] Не удалось запустить ffmpeg нового сегмента ({e_segment}), настройки кодировщика не изменены.")
+            self._remove_video_segment_output(segment_path); return False
+        self.logger(f"[FFmpegRecorder] FFmpeg сегмента {len(self._video_segments) + 1} запущен (PID: {process.pid}): {rate_settings.describe()}.")
+        segment = {"path": segment_path, "start": None, "settings": rate_settings, "process": process, "transport": transport}
+        self._start_video_progress_reader(process, segment)
+        self._pending_video_segment = segment
+        return True
+
+    def _switch_video_segment(self, timestamp):
+        # Поток записи, перед кадром: дальше кадры идут в новый ffmpeg, старый дописывает свой файл в фоне
+        segment = self._pending_video_segment; self._pending_video_segment = None
+        if "encoder" in segment:
+            # pyav: прежний кодировщик дописывает задержанные кадры и moov в фоне
+            closer_target, closer_args = self._finish_encoder_segment, (self.video_encoder,)
+            self.video_encoder = segment["encoder"]
+        else:
+            closer_target, closer_args = self._finish_video_segment, (self.ffmpeg_video_process, self.video_transport)
+            self.ffmpeg_video_process = segment.pop("process"); self.video_transport = segment.pop("transport")
+            self._matroska_writer = MatroskaPipeWriter(self.video_transport.stream, self._matroska_writer.width,
+                                                       self._matroska_writer.height, self._matroska_writer.pixel_format)
+        segment["start"] = timestamp
+        if self.recording_session and self._video_segments[0]["start"] is not None:
+            # Метки новой части начинаются с нуля: смещение ставит ее на общую шкалу при склейке
+            self.recording_session.set_video_part_offset(segment["path"], timestamp - self._video_segments[0]["start"])
+        self._video_segments.append(segment)
+        closer_thread = threading.Thread(target=closer_target, args=closer_args + (len(self._video_segments) - 1,), daemon=True)
+        closer_thread.start(); self._segment_closer_threads.append(closer_thread)
+
+    def _finish_video_segment(self, process, transport, segment_number):
+        transport.close() # EOF для ffmpeg сегмента
+        stderr_output = process.stderr.read() if process.stderr else b"" # До EOF: ffmpeg дописал хвост и moov
+        return_code = process.wait()
+        for line in stderr_output.decode('utf-8', errors='ignore').splitlines():
+            if line.strip(): self.logger(f"[FFmpegVideo-segment{segment_number}-stderr] {line.strip()}")
+        if return_code != 0: self._add_error_message(f"FFmpeg сегмента {segment_number} завершился с ошибкой (код {return_code}).")
+        else: self.logger(f"[FFmpegRecorder] Сегмент {segment_number} закрыт.")
+
+    def _finish_encoder_segment(self, encoder, segment_number):
+        try: encoder.close()
+        except Exception as e_close: self._add_error_message(f"Кодировщик сегмента {segment_number} (PyAV) завершился с ошибкой: {e_close}."); return
+        self.logger(f"[FFmpegRecorder] Сегмент {segment_number} закрыт ({encoder.frames_encoded} кадров).")
+
+    def _discard_pending_video_segment(self):
+        # Остановка раньше, чем поток записи подхватил новый сегмент: его ffmpeg не получил ни одного кадра
+        segment = self._pending_video_segment; self._pending_video_segment = None
+        if segment is None: return
+        if "encoder" in segment: segment["encoder"].close()
+        else:
+            process = segment["process"]
+            segment["transport"].close()
+            try: process.wait(timeout=5)
+            except Exception: process.kill()
+        self._remove_video_segment_output(segment["path"])
+
+    def _remove_video_segment_output(self, segment_path):
+        if self.recording_session: self.recording_session.remove_video_part(segment_path)
+        elif os.path.exists(segment_path): os.remove(segment_path)
+
+    def _concat_video_segments(self):
+        # Склейка сегментов без перекодирования; duration из меток первых кадров сохраняет шкалу времени для звука
+        segments = [segment for segment in self._video_segments if segment["start"] is not None and os.path.exists(segment["path"])]
+        if len(segments) < 2: return True
+        list_path = self.temp_video_file + ".ffconcat"
+        concat_path = self.temp_video_file[:-4] + "_concat.mp4"
+        with open(list_path, "w", encoding="utf-8") as list_file:
+            list_file.write("ffconcat version 1.0\n")
+            for index, segment in enumerate(segments):
+                list_file.write("file '" + segment["path"].replace("\\", "/").replace("'", "'\\''") + "'\n")
+                if index + 1 < len(segments): list_file.write(f"duration {segments[index + 1]['start'] - segment['start']:.3f}\n")
+        command = [FFMPEG_PATH if FFMPEG_PATH.lower() != "ffmpeg" and os.path.exists(FFMPEG_PATH) else "ffmpeg"]
+        command.extend(['-hide_banner', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', concat_path, '-y'])
+        self.logger(f"[FFmpegRecorder] Склейка {len(segments)} сегментов видео: {' '.join(command)}")
+        self._segment_temp_files = [segment["path"] for segment in self._video_segments] + [list_path]
+        result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore', creationflags=self._get_creation_flags())
+        if result.returncode != 0:
+            self._add_error_message(f"Ошибка склейки сегментов видео (FFmpeg код {result.returncode}): {result.stderr.strip()}", is_critical=True)
+            return False
+        self.temp_video_file = concat_path
+        return True
+
     def start(self):
         self.logger("[FFmpegRecorder] Попытка запуска раздельной записи видео и аудио...")
         if self.is_recording: self.logger("[FFmpegRecorder] Запись уже идет."); return True, None
         self.frames_written_count = 0; self.accumulated_error_messages = [] 
-        self.ffmpeg_audio_processes_list = []; self.temp_audio_files_list = []
+        self.change_detector = FrameChangeDetector() if self.suppress_duplicates else None
+        self.missed_ticks_count = 0; self._matroska_writer = None; self.pipeline_stats.reset()
+        self.ffmpeg_audio_processes_list = []; self.temp_audio_files_list = []; self._audio_stderr_threads = []
+        self._video_segments = []; self._pending_video_segment = None; self._segment_closer_threads = []; self._segment_temp_files = []
+        self.rate_controller = self._create_rate_controller()
         
         if not self._initialize_grabber(): 
             final_err_msg = "; ".join(self.accumulated_error_messages) if self.accumulated_error_messages else "Ошибка инициализации граббера"
             self.logger(f"[FFmpegRecorder] Отмена запуска: {final_err_msg}"); return False, final_err_msg
+        self._setup_output_scaler()
         
         self._stop_event.clear()
         
-        temp_video_file_obj = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4', prefix='_rec_vid_')
-        if temp_video_file_obj:
-            self.temp_video_file = temp_video_file_obj.name
-            temp_video_file_obj.close() 
-            if os.path.exists(self.temp_video_file): os.remove(self.temp_video_file) 
+        self.recording_session = None
+        self.audio_capture_groups = self._get_audio_capture_groups()
+        if self.segmented_recording:
+            try:
+                self.recording_session = RecordingSession.create(self.final_output_file, len(self.audio_capture_groups), self.segment_duration_sec)
+            except OSError as e_session:
+                self._add_error_message(f"Ошибка создания папки сегментов записи: {e_session}", is_critical=True)
+                return False, "; ".join(self.accumulated_error_messages)
+            self.temp_video_file = self.recording_session.add_video_part()
+            self.temp_audio_files_list = [self.recording_session.audio_track_pattern(i) for i in range(len(self.audio_capture_groups))]
+            self.logger(f"[FFmpegRecorder] Сегментная запись: сегменты по {self.segment_duration_sec} с в {self.recording_session.session_dir}.")
         else:
-            self._add_error_message("Ошибка создания временного видеофайла (NamedTemporaryFile вернул None)", is_critical=True)
-            return False, "; ".join(self.accumulated_error_messages)
-
-        for i, _ in enumerate(self.audio_device_names_list):
-            temp_audio_file_obj = tempfile.NamedTemporaryFile(delete=False, suffix='.aac', prefix=f'_rec_aud_{i}_')
-            if temp_audio_file_obj:
-                temp_path = temp_audio_file_obj.name
-                temp_audio_file_obj.close()
-                if os.path.exists(temp_path): os.remove(temp_path)
-                self.temp_audio_files_list.append(temp_path)
+            temp_video_file_obj = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4', prefix='_rec_vid_')
+            if temp_video_file_obj:
+                self.temp_video_file = temp_video_file_obj.name
+                temp_video_file_obj.close() 
+                if os.path.exists(self.temp_video_file): os.remove(self.temp_video_file) 
             else:
-                self._add_error_message(f"Ошибка создания временного аудиофайла {i} (NamedTemporaryFile вернул None)", is_critical=True)
-                self._cleanup_temp_files(); return False, "; ".join(self.accumulated_error_messages)
+                self._add_error_message("Ошибка создания временного видеофайла (NamedTemporaryFile вернул None)", is_critical=True)
+                return False, "; ".join(self.accumulated_error_messages)
+
+            for i, _ in enumerate(self.audio_capture_groups):
+                temp_audio_file_obj = tempfile.NamedTemporaryFile(delete=False, suffix='.aac', prefix=f'_rec_aud_{i}_')
+                if temp_audio_file_obj:
+                    temp_path = temp_audio_file_obj.name
+                    temp_audio_file_obj.close()
+                    if os.path.exists(temp_path): os.remove(temp_path)
+                    self.temp_audio_files_list.append(temp_path)
+                else:
+                    self._add_error_message(f"Ошибка создания временного аудиофайла {i} (NamedTemporaryFile вернул None)", is_critical=True)
+                    self._cleanup_temp_files(); return False, "; ".join(self.accumulated_error_messages)
 
         current_creation_flags = self._get_creation_flags()
 
         video_process_started = False
         try: 
-            video_cmd_list = self._build_ffmpeg_video_command(self.frame_grabber.width, self.frame_grabber.height, self.temp_video_file)
-            self.logger(f"[FFmpegRecorder] Видео команда: {' '.join(video_cmd_list)}")
-            self.ffmpeg_video_process = subprocess.Popen(video_cmd_list, stdin=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=current_creation_flags, bufsize=0) 
-            if self.ffmpeg_video_process and self.ffmpeg_video_process.pid:
-                self.logger(f"[FFmpegRecorder] FFmpeg ВИДЕО процесс запущен (PID: {self.ffmpeg_video_process.pid}).")
+            pipe_w, pipe_h = self._get_pipe_frame_size()
+            self._pipe_fitter = CanvasFitter(pipe_w, pipe_h, *self._get_source_frame_size(), mode=self.canvas_fit)
+            self.active_encoder_backend = self._resolve_encoder_backend()
+            self.codec_profile = self._resolve_codec_profile()
+            self.active_mp4_layout = self._resolve_mp4_layout()
+            if self.recording_session:
+                self.recording_session.update_manifest(video_tag=self.codec_profile.mp4_tag, mp4_layout=self.active_mp4_layout)
+            self.pipe_pixel_format = negotiate_pipe_pixel_format(self.requested_pipe_pixel_format, logger_func=self.logger)
+            # Уменьшение (если оно в ffmpeg) и перевод в YUV кодировщика - один многопоточный проход swscale
+            scale_filter = build_conversion_filter(self.codec_profile.pix_fmt,
+                                                   self.output_scaler if self.active_scale_stage == SCALE_STAGE_FFMPEG else None,
+                                                   self.convert_threads)
+            convert_place = "в libav (PyAV)" if self.active_encoder_backend == ENCODER_BACKEND_PYAV else "в ffmpeg"
+            self.logger(f"[FFmpegRecorder] Формат pipe: {self.pipe_pixel_format} -> {self.codec_profile.pix_fmt} {convert_place} "
+                        f"(потоков swscale: {self.convert_threads or 'авто'}).")
+            self._video_command_args = (pipe_w, pipe_h, self.pipe_pixel_format, scale_filter)
+            if self.auto_tune_encoder:
+                # Калибровка - по размеру, который кодирует кодировщик (после уменьшения в ffmpeg, если оно там)
+                encode_w, encode_h = (self.output_scaler.width, self.output_scaler.height) if self.output_scaler else (pipe_w, pipe_h)
+                self.encoder_tuning = get_encoder_tuning(encode_w, encode_h, self.framerate, codec_profile=self.codec_profile.name,
+                                                         logger_func=self.logger)
+            self.logger(f"[FFmpegRecorder] Кодировщик: {self.codec_profile.name} ({self.codec_profile.encoder}), {self.encoder_tuning.describe()}.")
+            rate_settings = self.rate_controller.current if self.rate_controller else None
+            self._video_segments = [{"path": self.temp_video_file, "start": None, "settings": rate_settings}]
+            if self.active_encoder_backend == ENCODER_BACKEND_PYAV:
+                self.video_encoder = self._open_video_encoder(self.temp_video_file, rate_settings)
+                self._video_segments[0]["encoder"] = self.video_encoder
+                pts_mode = "метки захвата" if self.video_encoder.use_timestamps else f"постоянные {self.framerate} к/с"
+                self.logger(f"[FFmpegRecorder] Кодирование внутри процесса: {self.video_encoder.describe()}, PTS: {pts_mode}.")
                 video_process_started = True
             else:
-                self._add_error_message("subprocess.Popen для видео вернул None или без PID.", is_critical=True)
+                self.ffmpeg_video_process, self.video_transport, video_cmd_list = self._launch_video_process(self.temp_video_file, rate_settings)
+                self.logger(f"[FFmpegRecorder] Видео команда: {' '.join(video_cmd_list)}")
+                if self.ffmpeg_video_process and self.ffmpeg_video_process.pid:
+                    self.logger(f"[FFmpegRecorder] FFmpeg ВИДЕО процесс запущен (PID: {self.ffmpeg_video_process.pid}), кадры: {self.video_transport.describe()}.")
+                    if rate_settings: self._start_video_progress_reader(self.ffmpeg_video_process, self._video_segments[0])
+                    if self.variable_frame_rate:
+                        self._matroska_writer = MatroskaPipeWriter(self.video_transport.stream, pipe_w, pipe_h, self.pipe_pixel_format)
+                    video_process_started = True
+                else:
+                    self._add_error_message("subprocess.Popen для видео вернул None или без PID.", is_critical=True)
         except Exception as e_start_vid: 
             self._add_error_message(f"Ошибка при запуске видеопроцесса ffmpeg: {e_start_vid}", is_critical=True)
         
@@ -201,17 +856,22 @@ class FFmpegRecorder:
             self._cleanup_temp_files(); return False, "; ".join(self.accumulated_error_messages)
 
         audio_processes_all_started = True
-        if self.audio_device_names_list:
-            for i, device_name in enumerate(self.audio_device_names_list):
+        if self.audio_capture_groups:
+            for i, device_names in enumerate(self.audio_capture_groups):
+                device_name = "', '".join(device_names)
                 temp_audio_file_for_device = self.temp_audio_files_list[i]
-                audio_cmd_list = self._build_ffmpeg_audio_command(device_name, temp_audio_file_for_device)
+                audio_cmd_list = self._build_ffmpeg_audio_command(device_names, temp_audio_file_for_device)
                 current_audio_process_started = False
                 if audio_cmd_list:
                     self.logger(f"[FFmpegRecorder] Аудио команда [{i}] для '{device_name}': {' '.join(audio_cmd_list)}")
                     try: 
-                        audio_proc = subprocess.Popen(audio_cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=current_creation_flags) 
+                        audio_proc = subprocess.Popen(audio_cmd_list, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                                      creationflags=current_creation_flags) 
                         if audio_proc and audio_proc.pid:
                             self.ffmpeg_audio_processes_list.append(audio_proc)
+                            # stderr читается всю запись: заполненный канал остановил бы ffmpeg
+                            audio_stderr_thread = threading.Thread(target=self._read_ffmpeg_pipe, args=(audio_proc.stderr, f"FFmpegAudio[{i}]-stderr"), daemon=True)
+                            audio_stderr_thread.start(); self._audio_stderr_threads.append(audio_stderr_thread)
                             self.logger(f"[FFmpegRecorder] FFmpeg АУДИО процесс [{i}] запущен (PID: {audio_proc.pid}) для '{device_name}'.")
                             current_audio_process_started = True
                         else:
@@ -231,8 +891,26 @@ class FFmpegRecorder:
         self._video_recording_thread = threading.Thread(target=self._video_feed_loop, daemon=True)
         self._video_recording_thread.start()
         self.logger("[FFmpegRecorder] Поток передачи видеокадров запущен.")
+        if self.rate_controller and self.variable_frame_rate:
+            self._rate_control_thread = threading.Thread(target=self._rate_control_loop, daemon=True)
+            self._rate_control_thread.start()
+        self._start_incremental_muxer()
         return True, None 
     
+    def _start_incremental_muxer(self):
+        self.incremental_muxer = None
+        if not (self.recording_session and self.incremental_mux): return
+        if self.active_mp4_layout != MP4_LAYOUT_FRAGMENTED:
+            self.logger(f"[FFmpegRecorder] Сборка по ходу записи недоступна для mp4 {self.active_mp4_layout}, итог соберет mux при остановке."); return
+        if len(self.audio_capture_groups) > 1:
+            self.logger("[FFmpegRecorder] Сборка по ходу записи выключена: звук нескольких устройств смешивается при остановке (live_audio_mix выключен)."); return
+        session = self.recording_session
+        session.update_manifest(incremental_output=True)
+        self.incremental_muxer = IncrementalMuxer(session, self.final_output_file, ["video"] + session.manifest["audio_tracks"],
+                                                  session.manifest.get("video_tag"), resolve_ffmpeg_path(), self.logger)
+        self.incremental_muxer.start()
+        self.logger(f"[FFmpegRecorder] Сборка итогового mp4 по ходу записи: {self.final_output_file}")
+
     def _read_ffmpeg_pipe(self, pipe, pipe_name_prefix, stop_event_local=None):
         try:
             while True:
@@ -256,95 +934,228 @@ class FFmpegRecorder:
                 try: pipe.close()
                 except: pass
 
+    def _video_write_loop(self):
+        # Поток записи: забирает кадры из очереди передачи, пишет их в stdin ffmpeg и возвращает слоты в кольцо граббера.
+        # Пока слот пишется, поток захвата уже делает PrintWindow следующего кадра в другой слот.
+        while True:
+            item = self._frame_handoff_queue.get()
+            if item is None: break # Очередь закрыта потоком захвата и пуста
+            frame, slot, timestamp, source = item # source - источник слота (после retarget это может быть уже не frame_grabber)
+            try:
+                if frame is None: frame = self._repeat_frame # Повтор последнего кадра в разрыве между окнами
+                if self._writer_error_msg is None and frame is not None: # После ошибки только возвращаем слоты, не пишем
+                    # Уменьшение/копия обрезки/вписывание в холст в потоке записи (один потребитель - один выходной буфер)
+                    stage_start = time.perf_counter()
+                    fitted_frame = self._pipe_fitter.fit(frame)
+                    if fitted_frame is not frame:
+                        # "copy" - копия среза обрезки, "scale" - уменьшение, "canvas" - кадр после изменения размера окна
+                        self.pipeline_stats.add(self._pipe_fitter.last_stage, time.perf_counter() - stage_start)
+                        frame = fitted_frame
+                        if slot is not None: source.release_frame(slot); slot = None # Слот захвата больше не нужен
+                    if self._pending_video_segment is not None and (self._matroska_writer or self.video_encoder): self._switch_video_segment(timestamp)
+                    if self._video_segments[0]["start"] is None: self._video_segments[0]["start"] = timestamp
+                    stage_start = time.perf_counter()
+                    if self.video_encoder is not None: self.video_encoder.write_frame(frame, timestamp) # Кадр слота - сразу в swscale libav
+                    elif self._matroska_writer: self._matroska_writer.write_frame(frame, timestamp)
+                    else: write_frame_buffer(self.video_transport.stream, frame)
+                    self.pipeline_stats.add("write", time.perf_counter() - stage_start)
+                    self.frames_written_count += 1
+                    if self.target_title_pattern and frame is not self._repeat_frame:
+                        # Окно может исчезнуть в любой момент: держим копию кадра (слот вернется в кольцо источника)
+                        if self._repeat_frame is None or self._repeat_frame.shape != frame.shape: self._repeat_frame = np.empty_like(frame)
+                        stage_start = time.perf_counter()
+                        np.copyto(self._repeat_frame, frame)
+                        self.pipeline_stats.add("repeat_copy", time.perf_counter() - stage_start)
+            except (IOError, BrokenPipeError) as e_pipe: 
+                self._writer_error_msg = f"Видео Pipe error: {e_pipe}"; self._stop_event.set()
+            except Exception as e_write: 
+                self._writer_error_msg = f"Видео Stdin write error: {e_write}"; self._stop_event.set()
+            finally:
+                if slot is not None: source.release_frame(slot)
+
+    def _release_queued_item(self, item):
+        if item[1] is not None: item[3].release_frame(item[1])
+
+    def _on_frame_dropped(self, item):
+        # Детектор уже считает выброшенный кадр отправленным: без сброса следующие такие же кадры подавлялись бы
+        # относительно кадра, которого нет в видео. Вызывается из потока захвата (put), как и should_send
+        self._release_queued_item(item)
+        if self.change_detector: self.change_detector.reset()
+
+    def _create_frame_queue(self):
+        policy = self.frame_queue_policy
+        if policy != FRAME_QUEUE_POLICY_BLOCK and not self.variable_frame_rate and not self.suppress_duplicates:
+            # Rawvideo с фиксированным -r: выброшенный кадр укоротил бы видео и сдвинул его относительно звука
+            self.logger(f"[FFmpegRecorder] Политика очереди '{policy}' требует меток времени (VFR или подавление повторов), используется 'block'.")
+            policy = FRAME_QUEUE_POLICY_BLOCK
+        maxsize = self.frame_queue_depth
+        if self.pipe_pixel_format != PIPE_PIXEL_FORMAT_BGR24:
+            # Кадр идет в pipe прямо из слота кольца, слоты в очереди заняты:
+            # один остается потоку записи, один - захвату (при block захват может подождать слот)
+            ring_depth = self.frame_grabber.frame_ring.depth
+            maxsize = min(maxsize, max(1, ring_depth - (1 if policy == FRAME_QUEUE_POLICY_BLOCK else 2)))
+        return FrameQueue(maxsize, policy, on_drop=self._on_frame_dropped)
+
+    def _handoff_frame(self, frame, slot, timestamp, ignore_stop=False):
+        # Передача в поток записи; при policy=block ожидание прерывается _stop_event, чтобы stop() не зависал.
+        # False - кадр не принят (выброшен или запись останавливается), его слот уже возвращен.
+        stop_event = None if ignore_stop else self._stop_event
+        if self._frame_handoff_queue.put((frame, slot, timestamp, self.frame_grabber), timeout=1.0 if ignore_stop else None, stop_event=stop_event):
+            return True
+        if slot is not None: self.frame_grabber.release_frame(slot)
+        if self.change_detector: self.change_detector.reset() # Кадр не принят (drop_newest) - как _on_frame_dropped
+        return False
+
+    def _prepare_frame_for_writer(self, frame, slot):
+        if self.pipe_pixel_format == PIPE_PIXEL_FORMAT_BGR24:
+            # Прежний путь bgr24: конвертируем в отдельный массив (только область обрезки) и сразу возвращаем слот
+            stage_start = time.perf_counter()
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+            self.pipeline_stats.add("convert", time.perf_counter() - stage_start)
+            self.frame_grabber.release_frame(slot); slot = None
+        return frame, slot
+
+    def _send_final_frame(self):
+        if self._source_lost:
+            # Запись закончилась в разрыве между окнами: повтор последнего кадра доводит видео до конца записи
+            if self._handoff_frame(None, None, time.perf_counter(), ignore_stop=True):
+                self.logger("[FFmpegRecorder] Отправлен финальный повтор последнего кадра (окно захвата потеряно).")
+            return
+        slot = self.frame_grabber.acquire_frame() if self.frame_grabber else None
+        if slot is None: return
+        timestamp = slot.timestamp
+        frame, slot = self._prepare_frame_for_writer(self._crop_frame(slot.frame), slot)
+        if self._handoff_frame(frame, slot, timestamp, ignore_stop=True):
+            self.logger("[FFmpegRecorder] Отправлен финальный кадр после статичного хвоста записи.")
+
+    def _get_video_health_error(self):
+        # Проверки для HealthMonitor (раз в DEFAULT_HEALTH_CHECK_INTERVAL_SEC, не на каждом кадре)
+        if not self._source_lost and not self.frame_grabber.is_alive():
+            if not self.target_title_pattern or self._external_frame_source is not None: return "Окно захвата закрыто (видеоцикл)."
+            # Окно пересоздано (например, переход в сессионный зал): ищем новое по заголовку, ffmpeg и аудио продолжают
+            self._source_lost = True
+            self.logger(f"[FFmpegRecorder] Окно захвата {self.hwnd} закрыто, поиск нового окна по шаблону '{self.target_title_pattern}'...")
+            self._start_source_reinit()
+        if self.video_encoder is not None: return None # pyav: ошибки libav приходят исключением в поток записи
+        process = self.ffmpeg_video_process # Поток записи может подменить процесс на границе сегмента
+        transport = self.video_transport
+        error_message = None
+        ffmpeg_poll_code = process.poll()
+        if ffmpeg_poll_code is not None:
+            error_message = f"FFmpeg видео завершился (код: {ffmpeg_poll_code})."
+            if ffmpeg_poll_code == 0 and not transport.closed:
+                error_message += " (канал кадров еще был открыт)"
+        elif transport.closed:
+            error_message = "FFmpeg видео: канал кадров закрыт (неожиданно)."
+        if error_message and process is not self.ffmpeg_video_process: return None # Это закрываемый прошлый сегмент
+        return error_message
+
     def _video_feed_loop(self):
         self.logger("[FFmpegRecorder] Начало цикла передачи видеокадров...")
-        frames_written_in_loop_local = 0; start_time_loop_overall = time.time() 
+        start_time_loop_overall = time.time() 
         loop_internal_error_msg_obj = {"msg": None}; vid_stderr_thread = None
         
         if self.ffmpeg_video_process and self.ffmpeg_video_process.stderr:
             vid_stderr_thread = threading.Thread(target=self._read_ffmpeg_pipe, args=(self.ffmpeg_video_process.stderr, "FFmpegVideo-stderr", self._stop_event), daemon=True)
             vid_stderr_thread.start()
             
-        time_per_frame = 1.0 / self.framerate
         run_loop = True
         if not self.frame_grabber or not self.frame_grabber.is_initialized:
             loop_internal_error_msg_obj["msg"] = "GDI граббер не инициализирован перед видео циклом."
             run_loop = False
+
+        self._frame_handoff_queue = self._create_frame_queue() if self.frame_grabber else FrameQueue(1)
+        self._writer_error_msg = None
+        video_writer_thread = threading.Thread(target=self._video_write_loop, daemon=True)
+        video_writer_thread.start()
+
+        # Темп - дедлайны тиков на perf_counter с одним Event.wait на тик; проверки окна/ffmpeg - в HealthMonitor
+        self.frame_scheduler = FrameScheduler(self.framerate, self._stop_event)
+        health_monitor = HealthMonitor(self._get_video_health_error, DEFAULT_HEALTH_CHECK_INTERVAL_SEC, self._stop_event, self.logger)
+        if run_loop and health_monitor.check_now(): run_loop = False
+        if run_loop: health_monitor.start(); self.frame_scheduler.start()
         
-        last_frame_target_time = time.time() 
-        while run_loop: 
-            if self._stop_event.is_set(): self.logger("[FFmpegRecorder _video_feed_loop] _stop_event (начало цикла), выход."); break
-            
-            if not (self.hwnd and win32gui.IsWindow(self.hwnd)): 
-                loop_internal_error_msg_obj["msg"] = "Окно захвата закрыто (видеоцикл)."; break 
+        last_tick_suppressed = False; last_frame_size = None; last_repeat_time = 0.0
+        # В разрыве между окнами повторы нужны на каждом тике только rawvideo с фиксированным -r; с метками времени
+        # предыдущий кадр и так длится до следующего, повтор раз в интервал лишь держит файл "живым"
+        repeat_interval = 0.0 if not self.variable_frame_rate and not self.suppress_duplicates else DEFAULT_MAX_REPEAT_INTERVAL_SEC
+        while run_loop and self.frame_scheduler.wait_next_tick():
+            if self._pending_frame_source is not None: self._swap_pending_frame_source()
+            if self._source_lost:
+                now = time.perf_counter()
+                if now - last_repeat_time >= repeat_interval and self._repeat_frame is not None:
+                    self._handoff_frame(None, None, now); last_repeat_time = now
+                last_tick_suppressed = True
+                continue
+            stage_start = time.perf_counter()
+            slot = self.frame_grabber.acquire_frame()
+            if slot is not None: self.pipeline_stats.add("grab", time.perf_counter() - stage_start) # PrintWindow / копия источника
+            if self._stop_event.is_set(): 
+                if slot is not None: self.frame_grabber.release_frame(slot)
+                self.logger("[FFmpegRecorder _video_feed_loop] _stop_event (после acquire_frame), выход."); break 
             
-            ffmpeg_poll_code = self.ffmpeg_video_process.poll()
-            if ffmpeg_poll_code is not None: 
-                loop_internal_error_msg_obj["msg"] = f"FFmpeg видео завершился (код: {ffmpeg_poll_code})."
-                if ffmpeg_poll_code == 0 and self.ffmpeg_video_process.stdin and not self.ffmpeg_video_process.stdin.closed:
-                     loop_internal_error_msg_obj["msg"] += " (stdin еще был открыт)"
-                break 
-            
-            if not self.ffmpeg_video_process.stdin or self.ffmpeg_video_process.stdin.closed: 
-                loop_internal_error_msg_obj["msg"] = "FFmpeg видео stdin закрыт (неожиданно)."; break 
-            
-            frame_bgr = self.frame_grabber.grab_frame()
-            if self._stop_event.is_set(): self.logger("[FFmpegRecorder _video_feed_loop] _stop_event (после grab_frame), выход."); break 
-            
-            if frame_bgr is None:
+            if slot is None:
                 if not self.frame_grabber.is_initialized: 
-                    loop_internal_error_msg_obj["msg"] = "GDI граббер неинициализирован (видеоцикл)."; break 
-                
-                time_to_next_tick = last_frame_target_time + time_per_frame - time.time()
-                if time_to_next_tick > 0.001: 
-                    sleep_end_time = time.time() + min(time_to_next_tick, 0.01)
-                    while time.time() < sleep_end_time:
-                        if self._stop_event.is_set(): break
-                        time.sleep(0.001) 
-                if self._stop_event.is_set(): break
-                continue 
-            
-            fh, fw, _ = frame_bgr.shape
-            if fw != self.frame_grabber.width or fh != self.frame_grabber.height: 
-                loop_internal_error_msg_obj["msg"] = f"Размер кадра ({fw}x{fh}) != DIB ({self.frame_grabber.width}x{self.frame_grabber.height})."; break 
-            
-            frame_written_successfully = False
-            try:
-                self.ffmpeg_video_process.stdin.write(frame_bgr.tobytes())
-                frames_written_in_loop_local += 1
-                self.frames_written_count = frames_written_in_loop_local 
-                frame_written_successfully = True
-            except (IOError, BrokenPipeError) as e_pipe: 
-                loop_internal_error_msg_obj["msg"] = f"Видео Pipe error: {e_pipe}"; break 
-            except Exception as e_write: 
-                loop_internal_error_msg_obj["msg"] = f"Видео Stdin write error: {e_write}"; break 
+                    # Источник сломался; если окно закрыто и его можно найти по заголовку, проверка начнет retarget
+                    health_error = self._get_video_health_error()
+                    if self._source_lost: continue
+                    loop_internal_error_msg_obj["msg"] = health_error or "GDI граббер неинициализирован (видеоцикл)."; break 
+                continue # Кадр не получен (смена размера и т.п.): повтор на следующем тике
             
-            if not frame_written_successfully: break
-
-            last_frame_target_time += time_per_frame
-            current_time_after_send = time.time()
-            sleep_duration = last_frame_target_time - current_time_after_send
-            if sleep_duration > 0:
-                end_sleep_time = current_time_after_send + sleep_duration
-                while time.time() < end_sleep_time:
-                    if self._stop_event.is_set(): break
-                    actual_sleep_this_chunk = min(0.005, end_sleep_time - time.time()) 
-                    if actual_sleep_this_chunk <=0: break
-                    time.sleep(actual_sleep_this_chunk)
-            
-            if self._stop_event.is_set(): self.logger("[FFmpegRecorder _video_feed_loop] _stop_event (после сна), выход."); break
-            if time.time() > last_frame_target_time + time_per_frame : last_frame_target_time = time.time()
+            frame = slot.frame
+            frame_size = (frame.shape[1], frame.shape[0])
+            if frame_size != last_frame_size:
+                # Источник уже переразместил буферы под новый размер; ffmpeg продолжает с тем же холстом
+                if last_frame_size is not None:
+                    self.logger(f"[FFmpegRecorder] Размер кадра изменился: {last_frame_size[0]}x{last_frame_size[1]} -> {frame_size[0]}x{frame_size[1]}, "
+                                f"кадры вписываются в холст {self._pipe_fitter.width}x{self._pipe_fitter.height} ({self.canvas_fit}).")
+                last_frame_size = frame_size
+
+            frame = self._crop_frame(frame)
+            stage_start = time.perf_counter()
+            frame_changed = self.change_detector.should_send(frame) if self.change_detector else True
+            if self.change_detector: self.pipeline_stats.add("change_detect", time.perf_counter() - stage_start)
+            if not frame_changed:
+                # Кадр не изменился: в pipe не отправляем, предыдущий кадр просто длится дольше (VFR) или повторяется ffmpeg (CFR)
+                self.frame_grabber.release_frame(slot)
+                last_tick_suppressed = True
+            else:
+                timestamp = slot.timestamp # Слот может вернуться в кольцо в _prepare_frame_for_writer
+                frame, slot = self._prepare_frame_for_writer(frame, slot)
+                if not self._handoff_frame(frame, slot, timestamp) and self._stop_event.is_set(): break
+                last_tick_suppressed = False
         
+        health_monitor.stop(); self.frame_scheduler.stop()
+        with self._source_swap_lock:
+            pending = self._pending_frame_source; self._pending_frame_source = None
+        if pending is not None: pending[0].close() # Готов, но не подменен до остановки
+        # Пропущенные тики не догоняются (в VFR это лишь более длинный интервал между метками, а не сдвиг относительно звука)
+        self.missed_ticks_count = self.frame_scheduler.missed_ticks
+        if not loop_internal_error_msg_obj["msg"] and health_monitor.error_message: loop_internal_error_msg_obj["msg"] = health_monitor.error_message
         self.logger("[FFmpegRecorder] Цикл передачи видеокадров завершается.")
-        self.frames_written_count = frames_written_in_loop_local 
+        if last_tick_suppressed and not loop_internal_error_msg_obj["msg"] and self._writer_error_msg is None:
+            # Хвост записи был статичным: отправляем финальный кадр, иначе видео закончится на последнем изменении
+            self._send_final_frame()
+        # Поток записи дописывает уже переданные кадры и завершается на закрытой пустой очереди
+        self._frame_handoff_queue.close()
+        video_writer_thread.join(timeout=5.0)
+        if video_writer_thread.is_alive():
+            self.logger("[FFmpegRecorder] Поток записи видеокадров не завершился за 5с.")
+            for item in self._frame_handoff_queue.drain(): self._release_queued_item(item)
+        self._discard_pending_video_segment()
+        if not loop_internal_error_msg_obj["msg"] and self._writer_error_msg: loop_internal_error_msg_obj["msg"] = self._writer_error_msg
         if loop_internal_error_msg_obj["msg"]: self._add_error_message(loop_internal_error_msg_obj["msg"], is_critical=True) 
         
-        if self.ffmpeg_video_process and self.ffmpeg_video_process.stdin and not self.ffmpeg_video_process.stdin.closed:
-            self.logger("[FFmpegRecorder] Закрытие stdin видеопроцесса FFmpeg (из finally)...")
+        if self.video_transport and not self.video_transport.closed:
+            self.logger("[FFmpegRecorder] Закрытие канала кадров видеопроцесса FFmpeg (из finally)...")
             try: 
-                self.ffmpeg_video_process.stdin.flush(); self.ffmpeg_video_process.stdin.close()
-                self.logger("[FFmpegRecorder] stdin видеопроцесса FFmpeg успешно закрыт (из finally).")
-            except Exception as e_close_stdin_finally: self.logger(f"[FFmpegRecorder] Ошибка при закрытии stdin (finally): {e_close_stdin_finally}")
+                self.video_transport.close()
+                self.logger("[FFmpegRecorder] Канал кадров видеопроцесса FFmpeg успешно закрыт (из finally).")
+            except Exception as e_close_stdin_finally: self.logger(f"[FFmpegRecorder] Ошибка при закрытии канала кадров (finally): {e_close_stdin_finally}")
+        if self.video_encoder is not None and not self.video_encoder.closed:
+            # pyav: сброс задержанных кодировщиком кадров и moov (то, что видео-ffmpeg делает после EOF)
+            try: self.video_encoder.close(); self.logger(f"[FFmpegRecorder] Кодировщик PyAV закрыт ({self.video_encoder.frames_encoded} кадров).")
+            except Exception as e_close_encoder: self._add_error_message(f"Ошибка при закрытии кодировщика PyAV: {e_close_encoder}", is_critical=True)
         
         if vid_stderr_thread and vid_stderr_thread.is_alive(): 
             vid_stderr_thread.join(timeout=2.0) 
@@ -354,123 +1165,86 @@ class FFmpegRecorder:
         if self.frames_written_count > 0 : 
             avg_fps_sent_actual = self.frames_written_count / actual_duration_of_loop if actual_duration_of_loop > 0.01 else self.framerate
             self.logger(f"[FFmpegRecorder] Видеоцикл: {self.frames_written_count} кадров за {actual_duration_of_loop:.2f}с. (Отправлено ~{avg_fps_sent_actual:.1f} FPS).")
+            if self.change_detector:
+                self.logger(f"[FFmpegRecorder] Подавлено неизменившихся кадров: {self.change_detector.suppressed_frames} (отправлено: {self.change_detector.sent_frames}).")
+            if self.missed_ticks_count: self.logger(f"[FFmpegRecorder] Пропущено тиков из-за задержек захвата: {self.missed_ticks_count}.")
+            self.logger(f"[FFmpegRecorder] Очередь кадров: {self._frame_handoff_queue.format_summary()}")
+            self.logger(f"[FFmpegRecorder] Темп тиков: {self.frame_scheduler.format_summary()}")
+            self.logger(f"[FFmpegRecorder] Этапы конвейера кадра (бюджет {1000.0 / self.framerate:.1f} мс): {self.pipeline_stats.format_summary(1.0 / self.framerate)}")
         elif actual_duration_of_loop > 0.1 : self.logger(f"[FFmpegRecorder] Видеоцикл: 0 кадров за {actual_duration_of_loop:.2f}с.")
 
 
-    def _stop_ffmpeg_process(self, process, process_name, timeout_graceful=3, timeout_signal=7, timeout_terminate=3, is_audio=False, audio_file_path_for_check=None):
-        if not process: return
-        
-        return_code = process.poll() # Проверяем перед созданием потоков
-        
-        stderr_reader_thread_stop = None
-        audio_stdout_thread = None
-        stop_stderr_event_local_stop = threading.Event()
-
-        if process.stderr and not process.stderr.closed:
-            stderr_reader_thread_stop = threading.Thread(
-                target=self._read_ffmpeg_pipe, 
-                args=(process.stderr, f"{process_name}-stderr", stop_stderr_event_local_stop), 
-                daemon=True)
-            stderr_reader_thread_stop.start()
-        
-        if is_audio and process.stdout and not process.stdout.closed:
-            audio_stdout_thread = threading.Thread(
-                target=self._read_ffmpeg_pipe, 
-                args=(process.stdout, f"{process_name}-stdout", stop_stderr_event_local_stop), 
-                daemon=True)
-            audio_stdout_thread.start()
-
-        if return_code is None: 
-            self.logger(f"[FFmpegRecorder] {process_name} активен. Попытка корректного завершения...")
-            if process_name == "FFmpegVideo" and process.stdin and not process.stdin.closed:
-                self.logger(f"[FFmpegRecorder] Внимание: stdin {process_name} не закрыт до _stop_ffmpeg_process. Закрытие...")
-                try: process.stdin.close()
-                except: pass # Ошибки закрытия stdin здесь не критичны для остановки процесса
-            
-            try: 
-                process.wait(timeout=timeout_graceful)
-                return_code = process.returncode 
-                self.logger(f"[FFmpegRecorder] {process_name} завершился после wait({timeout_graceful}s) с кодом {return_code}.")
-            except subprocess.TimeoutExpired:
-                self.logger(f"[FFmpegRecorder] {process_name} не завершился за {timeout_graceful}s. SIGINT/CTRL_C...")
-                process_terminated_by_signal = False
-                try: 
-                    if os.name == 'nt': process.send_signal(signal.CTRL_C_EVENT)
-                    else: process.send_signal(signal.SIGINT)
-                    process.wait(timeout=timeout_signal) 
-                    return_code = process.returncode
-                    self.logger(f"[FFmpegRecorder] {process_name} завершился после сигнала с кодом {return_code}.")
-                    process_terminated_by_signal = True
-                except subprocess.TimeoutExpired:
-                    self.logger(f"[FFmpegRecorder] {process_name} не завершился после сигнала за {timeout_signal}s. Terminate()...")
-                except Exception as e_signal: # Ловим ProcessLookupError и другие ошибки от send_signal/wait
-                    self.logger(f"[FFmpegRecorder] Исключение при отправке сигнала/ожидании {process_name}: {type(e_signal).__name__}: {e_signal}")
-                    return_code = process.poll() # Проверяем, не завершился ли процесс из-за ошибки
-                    if return_code is None: self.logger(f"[FFmpegRecorder] {process_name} все еще активен после ошибки сигнала.")
-                    process_terminated_by_signal = True # Считаем, что попытка была, и переходим к terminate/kill если надо
-
-                if not process_terminated_by_signal and process.poll() is None: # Если не завершился и все еще жив
-                    self.logger(f"[FFmpegRecorder] {process_name} все еще активен, используем terminate().")
-                    process.terminate()
-                    try: 
-                        process.wait(timeout=timeout_terminate) 
-                        return_code = process.returncode
-                    except subprocess.TimeoutExpired: 
-                        self.logger(f"[FFmpegRecorder] {process_name} не завершился после terminate за {timeout_terminate}s. Kill()...")
-                        # Перед kill убедимся, что он все еще жив
-                        if process.poll() is None:
-                            try:
-                                process.kill()
-                                process.wait(timeout=1) # Короткое ожидание после kill
-                            except Exception as e_kill:
-                                self.logger(f"[FFmpegRecorder] Исключение при kill/wait для {process_name}: {type(e_kill).__name__}: {e_kill}")
-                        return_code = process.poll() 
-                    self.logger(f"[FFmpegRecorder] {process_name} завершен после terminate/kill с кодом {return_code}.")
+    def _check_ffmpeg_exit(self, process_name, return_code, is_audio=False, audio_file_path_for_check=None):
+        if return_code is None or return_code == 0: return
+        is_killed_audio_ok = is_audio and return_code in (1, 255) and \
+                             audio_file_path_for_check and \
+                             self._temp_output_size(audio_file_path_for_check) > 0
+        if not is_killed_audio_ok:
+            err_msg = f"{process_name} завершился с ошибкой (код {return_code}). Проверьте лог stderr выше."
+            self._add_error_message(err_msg) 
         else: 
-            self.logger(f"[FFmpegRecorder] {process_name} уже был завершен с кодом {return_code}.")
-        
-        stop_stderr_event_local_stop.set()
-        if stderr_reader_thread_stop and stderr_reader_thread_stop.is_alive():
-            stderr_reader_thread_stop.join(timeout=1.0)
-        if audio_stdout_thread and audio_stdout_thread.is_alive():
-            audio_stdout_thread.join(timeout=1.0)
-        
-        final_return_code = process.poll() # Получаем самый актуальный код возврата
-        if final_return_code is not None and final_return_code != 0:
-            is_killed_audio_ok = is_audio and final_return_code == 1 and \
-                                 audio_file_path_for_check and \
-                                 os.path.exists(audio_file_path_for_check) and \
-                                 os.path.getsize(audio_file_path_for_check) > 0
-            if not is_killed_audio_ok:
-                err_msg = f"{process_name} завершился с ошибкой (код {final_return_code}). Проверьте лог stderr выше."
-                self._add_error_message(err_msg) 
-            else: 
-                self.logger(f"[FFmpegRecorder] {process_name} (аудио) завершился с кодом {final_return_code}, но временный файл аудио {os.path.basename(audio_file_path_for_check) if audio_file_path_for_check else ''} существует. Не рассматривается как основная ошибка.")
-        
-        # Закрываем пайпы, если они все еще открыты и принадлежат этому процессу
-        for pipe_to_close in [process.stderr, process.stdout if is_audio else None]:
-            if pipe_to_close and hasattr(pipe_to_close, 'closed') and not pipe_to_close.closed:
-                try: pipe_to_close.close()
-                except: pass
+            self.logger(f"[FFmpegRecorder] {process_name} (аудио) завершился с кодом {return_code}, но временный файл аудио {os.path.basename(audio_file_path_for_check) if audio_file_path_for_check else ''} существует. Не рассматривается как основная ошибка.")
+
+    def _stop_ffmpeg_processes(self):
+        """
+        Видео и звук останавливаются одновременно (ProcessSupervisor, общий срок process_stop_timeout_sec): видео-ffmpeg
+        выходит по EOF канала кадров, звук - по "q" в stdin. Пока они дописывают файлы, закрываются кодировщик PyAV
+        и предыдущие сегменты видео. Время остановки - самый медленный процесс, а не сумма.
+        """
+        supervisor = ProcessSupervisor(self.logger, self.process_stop_timeout_sec)
+        supervisor.add("FFmpegVideo", self.ffmpeg_video_process)
+        for i, audio_proc in enumerate(self.ffmpeg_audio_processes_list):
+            supervisor.add(f"FFmpegAudio[{i}]", audio_proc, send_quit_command,
+                           self._audio_stderr_threads[i:i + 1])
+        self.logger(f"[FFmpegRecorder] Остановка процессов FFmpeg ({len(supervisor.entries)}), общий срок {self.process_stop_timeout_sec} с...")
+        if self.video_transport: self.video_transport.close() # EOF видео-ffmpeg; FIFO именованного канала удаляется здесь
+        self.video_transport = None
+        supervisor.request_stop()
+        if self.video_encoder is not None: # Поток записи не завершился сам
+            try: self.video_encoder.close()
+            except Exception as e_close_encoder: self._add_error_message(f"Ошибка при закрытии кодировщика PyAV: {e_close_encoder}", is_critical=True)
+            self.video_encoder = None
+        for closer_thread in self._segment_closer_threads:
+            closer_thread.join(timeout=30.0)
+            if closer_thread.is_alive(): self.logger("[FFmpegRecorder] Предыдущий сегмент видео не закрылся за 30с.")
+        self._segment_closer_threads = []
+        self.last_process_stop_report = supervisor.wait()
+        for result in self.last_process_stop_report:
+            if result["name"] == "FFmpegVideo": self._check_ffmpeg_exit(result["name"], result["returncode"]); continue
+            index = int(result["name"][len("FFmpegAudio["):-1])
+            temp_file_to_check = self.temp_audio_files_list[index] if index < len(self.temp_audio_files_list) else None
+            self._check_ffmpeg_exit(result["name"], result["returncode"], True, temp_file_to_check)
+        self.ffmpeg_video_process = None; self.ffmpeg_audio_processes_list = []; self._audio_stderr_threads = []
         
     def _mux_files(self):
+        if self.incremental_muxer is not None:
+            # Итоговый файл уже собран по ходу записи: дописывается только последний кусок
+            muxer = self.incremental_muxer; self.incremental_muxer = None
+            if muxer.finish(): self.recording_session.set_state(SESSION_STATE_DONE); return True
+            self.logger("[FFmpegRecorder] Итоговый файл по ходу записи не собран, полный mux сегментов.")
         self.logger("[FFmpegRecorder] Попытка объединения временных файлов...")
-        if not (self.temp_video_file and os.path.exists(self.temp_video_file) and os.path.getsize(self.temp_video_file) > 0):
+        temp_video_input, temp_audio_inputs, video_tag = self.temp_video_file, self.temp_audio_files_list, None
+        if self.recording_session:
+            # Только stream copy сегментов: время остановки не зависит от длины записи
+            temp_video_input, temp_audio_inputs = build_session_mux_inputs(self.recording_session)
+            video_tag = self.recording_session.manifest.get("video_tag")
+        if not (temp_video_input and os.path.exists(temp_video_input) and os.path.getsize(temp_video_input) > 0):
             err_msg = "Временный видеофайл отсутствует или пуст. Объединение невозможно."
             self._add_error_message(err_msg, is_critical=True); return False 
         
-        valid_temp_audio_files = [f for f in self.temp_audio_files_list if f and os.path.exists(f) and os.path.getsize(f) > 0]
-        mux_cmd_list = self._build_ffmpeg_mux_command(self.temp_video_file, valid_temp_audio_files, self.final_output_file)
+        valid_temp_audio_files = [f for f in temp_audio_inputs if f and os.path.exists(f) and os.path.getsize(f) > 0]
+        mux_cmd_list = self._build_ffmpeg_mux_command(temp_video_input, valid_temp_audio_files, self.final_output_file, video_tag)
         self.logger(f"[FFmpegRecorder] Mux команда: {' '.join(mux_cmd_list)}")
         
         mux_successful = False
         try:
-            current_creation_flags = self._get_creation_flags()
+            current_creation_flags = self._get_creation_flags(); mux_start_time = time.perf_counter()
             mux_process_result = subprocess.run(mux_cmd_list, capture_output=True, text=True, check=False, 
                                                 encoding='utf-8', errors='ignore', creationflags=current_creation_flags)
             if mux_process_result.returncode == 0:
-                self.logger("[FFmpegRecorder] Файлы успешно объединены.")
+                self.logger(f"[FFmpegRecorder] Файлы успешно объединены за {time.perf_counter() - mux_start_time:.2f} с (mp4: {self.active_mp4_layout}).")
                 mux_successful = True
+                if self.recording_session: self.recording_session.set_state(SESSION_STATE_DONE)
             else:
                 mux_stderr_output = mux_process_result.stderr.strip() if mux_process_result.stderr else "Нет вывода stderr от mux"
                 err_msg = f"Ошибка объединения файлов (FFmpeg код {mux_process_result.returncode}). Stderr: {mux_stderr_output}"
@@ -481,13 +1255,22 @@ class FFmpegRecorder:
         return mux_successful
 
 
+    def _log_size_budget_result(self):
+        final_bytes = os.path.getsize(self.final_output_file) if os.path.exists(self.final_output_file) else 0
+        target_bytes = self.rate_controller.target_bytes
+        self.logger(f"[FFmpegRecorder] Бюджет размера: итог {final_bytes / 1e6:.1f} МБ из {target_bytes / 1e6:.1f} МБ "
+                    f"({(final_bytes / target_bytes - 1.0) * 100.0:+.1f}%), сегментов {len(self._video_segments)}, "
+                    f"решений контроллера {len(self.rate_controller.decisions)}.")
+
     def _cleanup_temp_files(self):
+        if self.recording_session: self._cleanup_recording_session(); return
         if DEBUG_KEEP_TEMP_FILES:
             self.logger("[FFmpegRecorder] DEBUG_KEEP_TEMP_FILES=True, временные файлы не удалены.")
             if self.temp_video_file and os.path.exists(self.temp_video_file): 
                  self.logger(f"  Видео: {self.temp_video_file}")
             else:
                  self.logger(f"  Видео: {self.temp_video_file} (не найден или не был создан)")
+            for f_path in self._segment_temp_files: self.logger(f"  Сегмент видео: {f_path}")
 
             for i, f_path in enumerate(self.temp_audio_files_list):
                 if f_path and os.path.exists(f_path):
@@ -496,7 +1279,7 @@ class FFmpegRecorder:
                     self.logger(f"  Аудио[{i}]: {f_path} (не найден или не был создан)")
             return
 
-        files_to_delete = [self.temp_video_file] + self.temp_audio_files_list
+        files_to_delete = [self.temp_video_file] + self._segment_temp_files + self.temp_audio_files_list
         for f_path in files_to_delete:
             if f_path and os.path.exists(f_path):
                 try: 
@@ -506,8 +1289,19 @@ class FFmpegRecorder:
                     self.logger(f"[FFmpegRecorder] Не удалось удалить временный файл {f_path} (OSError): {e_os}")
                 except Exception as e_gen: 
                     self.logger(f"[FFmpegRecorder] Ошибка при удалении временного файла {f_path}: {e_gen}")
-        self.temp_video_file = ""; self.temp_audio_files_list = []
+        self.temp_video_file = ""; self.temp_audio_files_list = []; self._segment_temp_files = []
         
+    def _cleanup_recording_session(self):
+        # Незавершенная сессия с кадрами (mux не удался) остается на диске: ее подберет восстановление при следующем запуске
+        session = self.recording_session; self.recording_session = None
+        self.temp_video_file = ""; self.temp_audio_files_list = []
+        if DEBUG_KEEP_TEMP_FILES:
+            self.logger(f"[FFmpegRecorder] DEBUG_KEEP_TEMP_FILES=True, сегменты записи не удалены: {session.session_dir}"); return
+        if session.state != SESSION_STATE_DONE and session.has_segments():
+            self.logger(f"[FFmpegRecorder] Сегменты записи сохранены для восстановления: {session.session_dir}"); return
+        session.remove()
+        self.logger(f"[FFmpegRecorder] Удалена папка сегментов записи: {session.session_dir}")
+
     def _cleanup_ffmpeg_processes(self, force_kill=False):
         processes_to_clean = []
         if self.ffmpeg_video_process and self.ffmpeg_video_process.poll() is None: 
@@ -524,14 +1318,39 @@ class FFmpegRecorder:
         
         if processes_to_clean: 
             self.ffmpeg_video_process = None; self.ffmpeg_audio_processes_list = []
+        if self.incremental_muxer is not None: self.incremental_muxer.stop(); self.incremental_muxer = None
+        if self.video_encoder is not None: # Бэкенд pyav: процесса нет, закрываем кодировщик (файл все равно будет удален)
+            try: self.video_encoder.close()
+            except Exception as e_close: self.logger(f"[FFmpegRecorder] Ошибка при закрытии кодировщика PyAV: {e_close}")
+            self.video_encoder = None
+
 
+    def _report_stop_progress(self, on_progress, stage_text, fraction):
+        if on_progress is None: return
+        try: on_progress(stage_text, fraction)
+        except Exception as e_progress: self.logger(f"[FFmpegRecorder] Ошибка обработчика прогресса остановки: {e_progress}")
 
-    def stop(self):
+    def stop_async(self, on_finished=None, on_progress=None):
+        """
+        stop() в потоке финализации: управление сразу возвращается вызывающему (GUI). on_progress(этап, доля 0..1) и
+        on_finished(ошибки или None) вызываются из этого потока. Поток не daemon: выход из программы дождется итогового файла.
+        """
+        def finalize():
+            try: final_errors_str = self.stop(on_progress)
+            except Exception as e_stop:
+                final_errors_str = f"Исключение при остановке записи: {e_stop}"; self.logger(f"[FFmpegRecorder] {final_errors_str}")
+            if on_finished: on_finished(final_errors_str)
+        self._finalize_thread = threading.Thread(target=finalize, name="FFmpegRecorderFinalize")
+        self._finalize_thread.start()
+        return self._finalize_thread
+
+    def stop(self, on_progress=None):
         self.logger(f"[FFmpegRecorder] Команда stop получена (is_recording: {self.is_recording}).")
         if not self.is_recording: 
             self.logger("[FFmpegRecorder] Запись не была активна (is_recording=False при вызове stop).")
             return "; ".join(self.accumulated_error_messages) if self.accumulated_error_messages else None
         
+        self._report_stop_progress(on_progress, "остановка захвата", 0.0)
         self.logger(f"[FFmpegRecorder] Установка _stop_event (время: {time.time():.3f}).")
         self._stop_event.set() 
         
@@ -551,16 +1370,11 @@ class FFmpegRecorder:
             else: self.logger("[FFmpegRecorder] Frame grabber закрыт.")
             self.frame_grabber = None
             
-        self.logger("[FFmpegRecorder] Остановка видеопроцесса FFmpeg...")
-        self._stop_ffmpeg_process(self.ffmpeg_video_process, "FFmpegVideo", timeout_graceful=2, timeout_signal=5, timeout_terminate=2)
-        self.ffmpeg_video_process = None 
-        
-        for i, audio_proc in enumerate(self.ffmpeg_audio_processes_list):
-            if audio_proc:
-                temp_file_to_check = self.temp_audio_files_list[i] if i < len(self.temp_audio_files_list) else None
-                self.logger(f"[FFmpegRecorder] Остановка аудиопроцесса FFmpeg[{i}] (файл: {os.path.basename(temp_file_to_check) if temp_file_to_check else 'N/A'})...")
-                self._stop_ffmpeg_process(audio_proc, f"FFmpegAudio[{i}]", timeout_graceful=2, timeout_signal=10, timeout_terminate=3, is_audio=True, audio_file_path_for_check=temp_file_to_check)
-        self.ffmpeg_audio_processes_list = []
+        if self._rate_control_thread and self._rate_control_thread.is_alive(): self._rate_control_thread.join(timeout=2.0)
+        self._rate_control_thread = None
+        self._discard_pending_video_segment() # Если поток захвата не завершился сам
+        self._report_stop_progress(on_progress, "остановка кодировщика и записи звука", 0.25)
+        self._stop_ffmpeg_processes()
         
         mux_successful = False 
         # Проверяем, были ли ошибки ДО объединения. Если да, и они не связаны с mux, то mux не будет выполнен
@@ -571,9 +1385,13 @@ class FFmpegRecorder:
                 # Если ошибка mux уже была, то не нужно пытаться снова или добавлять "неизвестную причину"
                 can_try_muxing = False; break 
         
+        # Сегментная запись склеивает части и сегменты в самой команде mux (списки ffconcat)
+        if can_try_muxing and len(self._video_segments) > 1 and not self.recording_session: can_try_muxing = self._concat_video_segments()
         if can_try_muxing:
+             self._report_stop_progress(on_progress, "сборка итогового файла", 0.7)
              self.logger("[FFmpegRecorder] Начало объединения файлов...")
              mux_successful = self._mux_files() 
+             if mux_successful and self.rate_controller: self._log_size_budget_result()
              if not mux_successful:
                  # Добавляем общую ошибку mux, только если _mux_files сам ее не добавил
                  mux_error_already_logged = any("Ошибка объединения файлов" in m or "Исключение при выполнении команды объединения" in m for m in self.accumulated_error_messages)
@@ -583,11 +1401,13 @@ class FFmpegRecorder:
                  self.logger(f"[FFmpegRecorder] Объединение файлов успешно, но ранее возникли сообщения: {'; '.join(self.accumulated_error_messages)}")
         else:
             self.logger("[FFmpegRecorder] Объединение файлов пропущено из-за предыдущих критических ошибок или ошибок mux.")
+        if self.incremental_muxer is not None: self.incremental_muxer.stop(); self.incremental_muxer = None
             
         self._cleanup_temp_files()
         self.is_recording = False 
         final_errors_str = "; ".join(self.accumulated_error_messages) if self.accumulated_error_messages else None
         self.logger(f"[FFmpegRecorder] Раздельная запись остановлена. Итоговые сообщения: {final_errors_str if final_errors_str else 'Успешно'}")
+        self._report_stop_progress(on_progress, "готово", 1.0)
         return final_errors_str
 
     def __del__(self):
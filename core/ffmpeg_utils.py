@@ -2,7 +2,8 @@ import subprocess
 import re
 import psutil 
 from config import FFMPEG_PATH, DEFAULT_FRAMERATE
-from config import DEFAULT_VIDEO_PRESET, DEFAULT_VIDEO_CRF, DEFAULT_AUDIO_CODEC, DEFAULT_AUDIO_BITRATE
+from config import DEFAULT_AUDIO_CODEC, DEFAULT_AUDIO_BITRATE, DEFAULT_VIDEO_CODEC_PROFILE
+from codec_profiles import get_codec_profile
 
 def get_dshow_audio_devices(logger_func=print):
     # ... (код без изменений, оставлен для полноты) ...
@@ -53,7 +54,8 @@ def run_ffmpeg_direct_window_capture(
     audio_device_names_list: list, 
     video_fps: int, 
     record_audio: bool, 
-    logger_func=print
+    logger_func=print,
+    video_codec: str = DEFAULT_VIDEO_CODEC_PROFILE
 ):
     logger_func(f"[FFmpegUtils] Запуск FFmpeg для захвата окна '{window_title}' @ {video_fps}fps.")
     
@@ -131,11 +133,8 @@ def run_ffmpeg_direct_window_capture(
     else: 
         command.extend(['-map', '0:v', '-an'])
 
+    command.extend(get_codec_profile(video_codec).encoder_args())
     command.extend([
-        '-c:v', 'libx264', 
-        '-preset', DEFAULT_VIDEO_PRESET, 
-        '-crf', str(DEFAULT_VIDEO_CRF),       
-        '-pix_fmt', 'yuv420p', 
         '-movflags', '+faststart', 
         output_file
     ])
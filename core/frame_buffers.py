@@ -0,0 +1,131 @@
+import ctypes
+import threading
+from collections import deque
+
+import numpy as np
+
+BGRA_BYTES_PER_PIXEL = 4
+BGR_BYTES_PER_PIXEL = 3
+
+
+def dib_frame_view(bits_address, width, height):
+    """
+    Возвращает постоянное представление памяти DIBSection как массив (height, width, 4) BGRA.
+    Данные не копируются: массив смотрит прямо в память битмапа и остается валидным,
+    пока битмап не удален (DeleteObject). Содержимое меняется при каждом PrintWindow.
+    """
+    if not bits_address or width <= 0 or height <= 0:
+        return None
+    buffer_size = width * height * BGRA_BYTES_PER_PIXEL
+    raw_buffer = (ctypes.c_uint8 * buffer_size).from_address(bits_address)
+    return np.frombuffer(raw_buffer, dtype=np.uint8).reshape((height, width, BGRA_BYTES_PER_PIXEL))
+
+
+def write_frame_buffer(stream, frame):
+    """
+    Пишет кадр в поток (stdin ffmpeg) прямо из его памяти, без промежуточного bytes-объекта.
+    Небуферизованный stdin (bufsize=0) может принять только часть данных, поэтому дописываем остаток
+    через срезы memoryview (срезы тоже не копируют память).
+    Возвращает количество записанных байт.
+    """
+    view = memoryview(frame).cast('B')
+    total_size = len(view)
+    written_total = 0
+    while written_total < total_size:
+        written_now = stream.write(view[written_total:])
+        if not written_now: # 0 или None (неблокирующий поток) - для блокирующего stdin ffmpeg это обрыв
+            raise BrokenPipeError("Поток принял 0 байт (pipe закрыт?).")
+        written_total += written_now
+    return written_total
+
+
+class FrameSlot:
+    """Один буфер кольца: представление кадра + ресурсы бэкенда (например, DC и HBITMAP DIBSection)."""
+    __slots__ = ("index", "frame", "handle", "generation", "timestamp")
+
+    def __init__(self, index, frame, handle=None):
+        self.index = index
+        self.frame = frame
+        self.handle = handle
+        self.generation = 0
+        self.timestamp = 0.0 # time.perf_counter() момента захвата текущего содержимого
+
+
+class FrameBufferRing:
+    """
+    Кольцо заранее выделенных буферов захвата с явными acquire/release.
+    Поток захвата берет свободный слот (acquire), заполняет его и передает дальше;
+    потребитель (запись в ffmpeg) возвращает слот через release. Пока слот "в полете",
+    следующий кадр захватывается в другой слот, без выделения памяти на кадр.
+    allocate_slot(index, width, height) -> FrameSlot | None и free_slot(slot) задает бэкенд.
+    """
+    def __init__(self, depth, allocate_slot, free_slot, logger_func=print):
+        self.depth = max(1, int(depth))
+        self._allocate_slot = allocate_slot
+        self._free_slot = free_slot
+        self.logger = logger_func
+        self._condition = threading.Condition()
+        self._free_slots = deque()
+        self._slots = []
+        self._generation = 0
+        self.width = 0
+        self.height = 0
+
+    @property
+    def in_flight_count(self):
+        with self._condition:
+            return len(self._slots) - len(self._free_slots)
+
+    def allocate(self, width, height, release_timeout=2.0):
+        """Переразмещает все кольцо сразу (например, при изменении размера окна). Ждет возврата слотов "в полете"."""
+        if not self.wait_all_released(release_timeout):
+            self.logger(f"[FrameBufferRing] Не дождались возврата {self.in_flight_count} слотов за {release_timeout}с. Переразмещение отменено.")
+            return False
+        self.free_all()
+        new_slots = []
+        for index in range(self.depth):
+            slot = self._allocate_slot(index, width, height)
+            if slot is None:
+                self.logger(f"[FrameBufferRing] Не удалось выделить слот {index + 1}/{self.depth} ({width}x{height}).")
+                for allocated_slot in new_slots: self._free_slot(allocated_slot)
+                return False
+            new_slots.append(slot)
+        with self._condition:
+            self._generation += 1
+            for slot in new_slots: slot.generation = self._generation
+            self._slots = new_slots
+            self._free_slots.extend(new_slots)
+            self.width = width; self.height = height
+            self._condition.notify_all()
+        return True
+
+    def acquire(self, timeout=None):
+        with self._condition:
+            if not self._slots: return None
+            if not self._free_slots and not self._condition.wait_for(lambda: self._free_slots or not self._slots, timeout):
+                return None
+            if not self._free_slots: return None
+            return self._free_slots.popleft()
+
+    def release(self, slot):
+        if slot is None: return
+        with self._condition:
+            # Слот из прошлого поколения (кольцо уже переразмещено) повторно не возвращаем
+            if slot.generation != self._generation or slot in self._free_slots: return
+            self._free_slots.append(slot)
+            self._condition.notify_all()
+
+    def wait_all_released(self, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._free_slots) == len(self._slots), timeout)
+
+    def free_all(self):
+        with self._condition:
+            slots_to_free = self._slots
+            self._slots = []; self._free_slots.clear()
+            self._generation += 1
+            self.width = 0; self.height = 0
+            self._condition.notify_all()
+        for slot in slots_to_free:
+            try: self._free_slot(slot)
+            except Exception as e_free: self.logger(f"[FrameBufferRing] Ошибка освобождения слота {slot.index}: {e_free}")
@@ -0,0 +1,250 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from config import DEFAULT_CHANGE_SAMPLE_STEP, DEFAULT_MAX_REPEAT_INTERVAL_SEC, DEFAULT_SCALE_CPU_BUDGET, DEFAULT_CONVERT_THREADS
+from config import PIPE_PIXEL_FORMAT_AUTO, PIPE_PIXEL_FORMAT_BGR0, PIPE_PIXEL_FORMAT_BGRA, PIPE_PIXEL_FORMAT_BGR24
+from latency_stats import StageLatencyStats
+
+SCALE_STAGE_PYTHON = "python"
+SCALE_STAGE_FFMPEG = "ffmpeg"
+SCALE_STAGE_AUTO = "auto"
+
+CANVAS_FIT_LETTERBOX = "letterbox" # Пропорции сохраняются, кадр по центру холста, поля черные
+CANVAS_FIT_STRETCH = "stretch"     # Кадр растягивается на весь холст
+
+
+class FrameChangeDetector:
+    """
+    Детектор неизменившихся кадров для статичного контента (слайды, превью участников).
+    Сравнивает прореженную сетку пикселей (каждый sample_step-й по строкам и столбцам) с сеткой
+    последнего отправленного кадра: срез - это представление без копии, сравнение векторное.
+    Кадр, совпавший с предыдущим, не отправляется; не реже раза в max_repeat_interval_sec кадр
+    отправляется принудительно, чтобы мелкое изменение между точками сетки не "застряло".
+    """
+    def __init__(self, sample_step=DEFAULT_CHANGE_SAMPLE_STEP, max_repeat_interval_sec=DEFAULT_MAX_REPEAT_INTERVAL_SEC):
+        self.sample_step = max(1, int(sample_step))
+        self.max_repeat_interval_sec = max_repeat_interval_sec
+        self._reference_sample = None # Сетка последнего отправленного кадра (единственная копия, ~1/step^2 кадра)
+        self._last_sent_time = 0.0
+        self.sent_frames = 0
+        self.suppressed_frames = 0
+
+    def reset(self):
+        self._reference_sample = None
+        self._last_sent_time = 0.0
+
+    def should_send(self, frame, now=None):
+        now = time.monotonic() if now is None else now
+        # Альфа-канал BGRA не сравниваем: PrintWindow его не заполняет осмысленно
+        sample = frame[::self.sample_step, ::self.sample_step, :3]
+        reference = self._reference_sample
+        repeat_expired = now - self._last_sent_time >= self.max_repeat_interval_sec
+
+        if reference is None or reference.shape != sample.shape:
+            self._reference_sample = np.array(sample) # Первый кадр или новый размер: новая сетка
+        elif not repeat_expired and np.array_equal(sample, reference):
+            self.suppressed_frames += 1
+            return False
+        else:
+            np.copyto(reference, sample)
+
+        self._last_sent_time = now
+        self.sent_frames += 1
+        return True
+
+
+def compute_output_size(width, height, max_width=0, max_height=0, scale_factor=1.0):
+    """
+    Выходной размер с сохранением пропорций: не больше max_width x max_height (0 - без ограничения),
+    дополнительно умноженный на scale_factor. Стороны четные (yuv420p). Увеличение не делается.
+    """
+    factor = scale_factor if 0 < scale_factor < 1.0 else 1.0
+    if max_width and width > max_width: factor = min(factor, max_width / width)
+    if max_height and height > max_height: factor = min(factor, max_height / height)
+    if factor >= 1.0: return width, height
+    return max(2, int(width * factor) // 2 * 2), max(2, int(height * factor) // 2 * 2)
+
+
+class OutputScaler:
+    """
+    Этап уменьшения кадра до выходного размера. INTER_AREA усредняет все исходные пиксели,
+    попадающие в выходной, поэтому тонкие штрихи текста не пропадают, как при билинейной выборке.
+    Результат пишется в заранее выделенный буфер, который переиспользуется от кадра к кадру.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._output = None
+
+    def _output_buffer(self, channels):
+        if self._output is None or self._output.shape[2] != channels:
+            self._output = np.empty((self.height, self.width, channels), dtype=np.uint8)
+        return self._output
+
+    def scale(self, frame):
+        output = self._output_buffer(frame.shape[2])
+        cv2.resize(frame, (self.width, self.height), dst=output, interpolation=cv2.INTER_AREA)
+        return output
+
+    def fit(self, frame):
+        """
+        Приводит кадр к выходному размеру с минимумом работы: кадр нужного размера с непрерывной памятью
+        возвращается как есть, срез нужного размера (обрезка) копируется в буфер, иначе - уменьшение.
+        """
+        if frame.shape[0] == self.height and frame.shape[1] == self.width:
+            if frame.flags['C_CONTIGUOUS']: return frame
+            output = self._output_buffer(frame.shape[2])
+            np.copyto(output, frame)
+            return output
+        return self.scale(frame)
+
+    def ffmpeg_filter(self):
+        # Тот же алгоритм (усреднение по площади) внутри процесса ffmpeg
+        return f"scale={self.width}:{self.height}:flags=area"
+
+    def measure_cost_ms(self, frame, iterations=5):
+        self.scale(frame) # Прогрев и выделение буфера
+        start_time = time.perf_counter()
+        for _ in range(iterations): self.scale(frame)
+        return (time.perf_counter() - start_time) * 1000.0 / iterations
+
+
+class CanvasFitter:
+    """
+    Приводит кадры к фиксированному холсту pipe: размер холста выбирается при старте записи,
+    и при изменении размера окна ffmpeg не перезапускается, а запись остается одним файлом.
+    Кадр исходного размера (source_width x source_height) идет как в OutputScaler.fit: как есть,
+    одной копией среза или уменьшением на весь холст. Кадр другого размера вписывается в холст:
+    letterbox - в масштабе исходного кадра (не крупнее) с сохранением пропорций, по центру;
+    stretch - на весь холст. Прямоугольник вписывания кешируется на размер входа, а поля заливаются
+    только при его смене, поэтому кадр после изменения размера стоит одного resize/copyto прямо в холст.
+    """
+    def __init__(self, width, height, source_width, source_height, mode=CANVAS_FIT_LETTERBOX):
+        self.width = width
+        self.height = height
+        self.source_size = (source_width, source_height)
+        self.mode = mode
+        self.last_stage = None # Последняя операция fit(): None, "copy", "scale" или "canvas" (вписывание в холст)
+        self.resize_count = 0  # Сколько раз менялся размер входа относительно исходного
+        self._scaler = OutputScaler(width, height)
+        self._canvas = None
+        self._cached_input_key = None
+        self._target_rect = None
+
+    def _compute_target_rect(self, width, height):
+        if self.mode == CANVAS_FIT_STRETCH: return 0, 0, self.width, self.height
+        source_scale = self.width / self.source_size[0] if self.source_size[0] else 1.0
+        scale = min(self.width / width, self.height / height, source_scale)
+        target_w = max(2, min(self.width, int(round(width * scale)) // 2 * 2))
+        target_h = max(2, min(self.height, int(round(height * scale)) // 2 * 2))
+        return (self.width - target_w) // 2, (self.height - target_h) // 2, target_w, target_h
+
+    def fit(self, frame):
+        height, width, channels = frame.shape
+        if (width, height) == self.source_size or (width, height) == (self.width, self.height):
+            fitted = self._scaler.fit(frame)
+            self.last_stage = None if fitted is frame else ("copy" if (width, height) == (self.width, self.height) else "scale")
+            return fitted
+        input_key = (width, height, channels)
+        if input_key != self._cached_input_key:
+            if self._canvas is None or self._canvas.shape[2] != channels:
+                self._canvas = np.zeros((self.height, self.width, channels), dtype=np.uint8)
+            else:
+                self._canvas.fill(0) # Прежний прямоугольник мог быть больше: поля заливаются один раз
+            self._target_rect = self._compute_target_rect(width, height)
+            self._cached_input_key = input_key; self.resize_count += 1
+        x, y, target_w, target_h = self._target_rect
+        target = self._canvas[y:y + target_h, x:x + target_w]
+        if (target_w, target_h) == (width, height): np.copyto(target, frame)
+        else:
+            # До 2x уменьшения INTER_LINEAR почти не теряет штрихов и в ~8 раз дешевле дробного INTER_AREA,
+            # поэтому кадр после изменения размера стоит не дороже обычного
+            interpolation = cv2.INTER_AREA if target_w * 2 < width else cv2.INTER_LINEAR
+            cv2.resize(frame, (target_w, target_h), dst=target, interpolation=interpolation) # Прямо в срез холста, без буфера
+        self.last_stage = "canvas"
+        return self._canvas
+
+    def describe_target(self):
+        if self._target_rect is None: return f"{self.width}x{self.height}"
+        x, y, target_w, target_h = self._target_rect
+        return f"{target_w}x{target_h} в ({x}, {y}) холста {self.width}x{self.height}"
+
+
+def choose_scale_stage(scaler, sample_frame, framerate, cpu_budget=DEFAULT_SCALE_CPU_BUDGET):
+    """
+    Выбирает этап уменьшения по измеренной стоимости: если cv2.resize укладывается в cpu_budget
+    интервала кадра, уменьшаем до pipe (в ffmpeg идет в разы меньше байт), иначе - фильтром ffmpeg,
+    который работает в процессе кодировщика параллельно с захватом. Возвращает (этап, мс на кадр).
+    """
+    if sample_frame is None: return SCALE_STAGE_FFMPEG, None
+    cost_ms = scaler.measure_cost_ms(sample_frame)
+    budget_ms = cpu_budget * 1000.0 / framerate
+    return (SCALE_STAGE_PYTHON if cost_ms <= budget_ms else SCALE_STAGE_FFMPEG), cost_ms
+
+
+def negotiate_pipe_pixel_format(requested, cpu_count=None, logger_func=print):
+    """
+    Формат кадров в pipe ffmpeg. Слоты источников всегда BGRA, поэтому "auto" - bgr0: те же байты без прохода
+    в Python (поток захвата держит GIL), преобразование идет в ffmpeg параллельно с захватом, альфа не учитывается.
+    На одном ядре параллельности нет, а у swscale есть быстрый путь bgr24 -> yuv420p: суммарно дешевле cvtColor в Python
+    (benchmarks.py pixfmt), поэтому "auto" там - bgr24.
+    """
+    if requested in (PIPE_PIXEL_FORMAT_BGR0, PIPE_PIXEL_FORMAT_BGRA, PIPE_PIXEL_FORMAT_BGR24): return requested
+    if requested != PIPE_PIXEL_FORMAT_AUTO: logger_func(f"[FramePipeline] Неизвестный формат pipe '{requested}', выбирается автоматически.")
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return PIPE_PIXEL_FORMAT_BGR0 if cpu_count > 1 else PIPE_PIXEL_FORMAT_BGR24
+
+
+def build_conversion_filter(output_pix_fmt, scaler=None, threads=DEFAULT_CONVERT_THREADS):
+    """
+    Фильтр ffmpeg для кадров из pipe: один проход swscale в threads потоков переводит кадр в pix_fmt кодировщика
+    и, если scaler задан, уменьшает его (без отдельного преобразования формата перед кодировщиком).
+    """
+    scale_filter = f"{scaler.ffmpeg_filter()}:threads={threads}" if scaler else f"scale=threads={threads}"
+    return f"{scale_filter},format={output_pix_fmt}"
+
+
+class FrameCrop:
+    """
+    Обрезка кадра до области интереса (например, панели демонстрации экрана без тулбара и ленты участников).
+    Прямоугольник задан относительно клиентской области размера reference_width x reference_height.
+    При другом размере окна область переякоривается: сохраняются отступы от всех четырех краев,
+    т.е. область растягивается вместе с окном, как это делает панель демонстрации.
+    apply() возвращает срез-представление: отброшенные пиксели не копируются и не конвертируются.
+    """
+    def __init__(self, x, y, width, height, reference_width, reference_height):
+        self.left_margin = max(0, int(x))
+        self.top_margin = max(0, int(y))
+        self.right_margin = max(0, int(reference_width) - int(x) - int(width))
+        self.bottom_margin = max(0, int(reference_height) - int(y) - int(height))
+        self._resolved_size = None
+        self._resolved_rect = None
+
+    @classmethod
+    def from_settings(cls, crop_dict):
+        if not crop_dict: return None
+        return cls(crop_dict["x"], crop_dict["y"], crop_dict["width"], crop_dict["height"],
+                   crop_dict["reference_width"], crop_dict["reference_height"])
+
+    def resolve(self, frame_width, frame_height):
+        """Прямоугольник (x, y, w, h) для кадра данного размера; стороны четные. Без места под область - весь кадр."""
+        if self._resolved_size == (frame_width, frame_height): return self._resolved_rect
+        x, y = self.left_margin, self.top_margin
+        width = (frame_width - self.left_margin - self.right_margin) // 2 * 2
+        height = (frame_height - self.top_margin - self.bottom_margin) // 2 * 2
+        if width < 2 or height < 2 or x + width > frame_width or y + height > frame_height:
+            x, y, width, height = 0, 0, frame_width, frame_height
+        self._resolved_size = (frame_width, frame_height)
+        self._resolved_rect = (x, y, width, height)
+        return self._resolved_rect
+
+    def apply(self, frame):
+        x, y, width, height = self.resolve(frame.shape[1], frame.shape[0])
+        return frame[y:y + height, x:x + width]
+
+
+class FramePipelineStats(StageLatencyStats):
+    """Время этапов конвейера кадра (захват, обрезка, сравнение, конвертация, копия/масштаб, запись) - гистограммы по этапам."""
@@ -0,0 +1,103 @@
+import collections
+import threading
+import time
+
+FRAME_QUEUE_POLICY_BLOCK = "block"             # Захват ждет, пока поток записи освободит место (прежнее поведение)
+FRAME_QUEUE_POLICY_DROP_OLDEST = "drop_oldest" # Полная очередь: выбрасывается самый старый кадр, новый встает в конец
+FRAME_QUEUE_POLICY_DROP_NEWEST = "drop_newest" # Полная очередь: выбрасывается новый кадр, очередь не трогается
+FRAME_QUEUE_POLICIES = (FRAME_QUEUE_POLICY_BLOCK, FRAME_QUEUE_POLICY_DROP_OLDEST, FRAME_QUEUE_POLICY_DROP_NEWEST)
+
+
+class FrameQueue:
+    """
+    Ограниченная очередь кадров между потоком захвата и потоком записи в ffmpeg.
+    При переполнении поведение задает policy (FRAME_QUEUE_POLICY_*); выброшенный элемент
+    передается в on_drop (вернуть слот в кольцо граббера). close() будит потребителя:
+    get() дочитывает оставшееся и затем возвращает None.
+    Счетчики (глубина, выброшенные кадры, время ожидания обеих сторон) читаются snapshot() из любого потока.
+    """
+    def __init__(self, maxsize, policy=FRAME_QUEUE_POLICY_BLOCK, on_drop=None):
+        if policy not in FRAME_QUEUE_POLICIES:
+            raise ValueError(f"Неизвестная политика очереди кадров: {policy} (доступны: {', '.join(FRAME_QUEUE_POLICIES)})")
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.on_drop = on_drop
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self.enqueued_count = 0
+        self.dropped_oldest_count = 0
+        self.dropped_newest_count = 0
+        self.max_depth_seen = 0
+        self.put_blocked_sec = 0.0 # Захват ждал места в очереди (только policy=block)
+        self.get_wait_sec = 0.0    # Поток записи ждал кадр (простой кодировщика)
+
+    def put(self, item, timeout=None, stop_event=None):
+        """
+        Ставит элемент в очередь. Возвращает True, если элемент принят (возможно, ценой самого старого),
+        False - если он выброшен (drop_newest), истек timeout, выставлен stop_event или очередь закрыта.
+        Непринятый элемент остается у вызывающего (on_drop для него не вызывается).
+        """
+        dropped_item = None
+        with self._condition:
+            if self._closed: return False
+            if len(self._items) >= self.maxsize:
+                if self.policy == FRAME_QUEUE_POLICY_DROP_NEWEST:
+                    self.dropped_newest_count += 1; return False
+                if self.policy == FRAME_QUEUE_POLICY_DROP_OLDEST:
+                    dropped_item = self._items.popleft(); self.dropped_oldest_count += 1
+                else:
+                    wait_start = time.perf_counter()
+                    deadline = None if timeout is None else wait_start + timeout
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        if stop_event is not None and stop_event.is_set(): break
+                        remaining = 0.1 if deadline is None else min(0.1, deadline - time.perf_counter())
+                        if remaining <= 0: break
+                        self._condition.wait(remaining) # Короткие ожидания: stop_event проверяется без отдельного уведомления
+                    self.put_blocked_sec += time.perf_counter() - wait_start
+                    if len(self._items) >= self.maxsize or self._closed: return False
+            self._items.append(item)
+            self.enqueued_count += 1
+            self.max_depth_seen = max(self.max_depth_seen, len(self._items))
+            self._condition.notify_all()
+        if dropped_item is not None and self.on_drop: self.on_drop(dropped_item) # Вне блокировки: release слота может ждать свою
+        return True
+
+    def get(self):
+        """Следующий элемент; блокирует, пока он не появится. После close() и опустошения - None."""
+        with self._condition:
+            wait_start = time.perf_counter()
+            while not self._items and not self._closed: self._condition.wait()
+            self.get_wait_sec += time.perf_counter() - wait_start
+            if not self._items: return None
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        with self._condition:
+            self._closed = True; self._condition.notify_all()
+
+    def drain(self):
+        # Забрать все непрочитанные элементы (например, чтобы вернуть их слоты, если потребитель не завершился)
+        with self._condition:
+            items = list(self._items); self._items.clear(); self._condition.notify_all()
+        return items
+
+    def qsize(self):
+        with self._condition: return len(self._items)
+
+    def snapshot(self):
+        with self._condition:
+            return {
+                "policy": self.policy, "maxsize": self.maxsize, "depth": len(self._items), "max_depth_seen": self.max_depth_seen,
+                "enqueued": self.enqueued_count, "dropped_oldest": self.dropped_oldest_count, "dropped_newest": self.dropped_newest_count,
+                "dropped": self.dropped_oldest_count + self.dropped_newest_count,
+                "put_blocked_ms": round(self.put_blocked_sec * 1000.0, 1), "get_wait_ms": round(self.get_wait_sec * 1000.0, 1),
+            }
+
+    def format_summary(self):
+        stats = self.snapshot()
+        return (f"политика {stats['policy']}, глубина {stats['depth']}/{stats['maxsize']} (макс. {stats['max_depth_seen']}), "
+                f"принято {stats['enqueued']}, выброшено старых {stats['dropped_oldest']} / новых {stats['dropped_newest']}, "
+                f"ожидание захвата {stats['put_blocked_ms']:.0f} мс, простой записи {stats['get_wait_ms']:.0f} мс")
@@ -0,0 +1,114 @@
+import sys
+import threading
+import time
+
+from latency_stats import LatencyHistogram
+
+
+class FrameScheduler:
+    """
+    Тики захвата по абсолютным дедлайнам монотонных часов: дедлайн N-го тика = начало + N * период,
+    поэтому ошибка сна одного тика не накапливается. Между тиками поток спит одним stop_event.wait(timeout),
+    stop() будит его сразу. Если тик опоздал больше чем на период, пропущенные тики не догоняются, а считаются.
+    Опоздание пробуждения относительно дедлайна копится в гистограмму lateness (lateness_snapshot).
+    """
+    def __init__(self, framerate, stop_event):
+        self.period = 1.0 / framerate
+        self.stop_event = stop_event
+        self.tick_index = 0
+        self.missed_ticks = 0
+        self._start_time = None
+        self.lateness = LatencyHistogram() # Пишет только поток захвата; снимок из другого потока допускает неточность в 1 тик
+        self._timer_resolution_raised = False
+
+    def start(self):
+        self._raise_timer_resolution()
+        self._start_time = time.perf_counter(); self.tick_index = 0
+
+    def stop(self):
+        self._restore_timer_resolution()
+
+    def _raise_timer_resolution(self):
+        # Windows: ожидания по умолчанию квантуются ~15.6 мс, timeBeginPeriod(1) дает ~1 мс на время записи
+        if sys.platform != "win32" or self._timer_resolution_raised: return
+        try:
+            import ctypes
+            self._timer_resolution_raised = ctypes.windll.winmm.timeBeginPeriod(1) == 0
+        except Exception: pass
+
+    def _restore_timer_resolution(self):
+        if not self._timer_resolution_raised: return
+        try:
+            import ctypes
+            ctypes.windll.winmm.timeEndPeriod(1)
+        except Exception: pass
+        self._timer_resolution_raised = False
+
+    def wait_next_tick(self):
+        """Ждет дедлайн следующего тика. False - выставлен stop_event (ожидание прервано)."""
+        if self._start_time is None: self.start()
+        deadline = self._start_time + self.tick_index * self.period
+        now = time.perf_counter()
+        if now > deadline + self.period:
+            # Отстали больше чем на тик (долгий захват): переходим к ближайшему будущему тику
+            skipped = int((now - deadline) / self.period)
+            self.missed_ticks += skipped; self.tick_index += skipped
+            deadline = self._start_time + self.tick_index * self.period
+        timeout = deadline - now
+        if timeout > 0 and self.stop_event.wait(timeout): return False
+        if self.stop_event.is_set(): return False
+        self.lateness.record(max(0.0, time.perf_counter() - deadline))
+        self.tick_index += 1
+        return True
+
+    def lateness_snapshot(self):
+        # Опоздание пробуждения относительно дедлайна тика, мс; over_budget - опоздания больше периода кадра
+        stats = self.lateness.snapshot(self.period)
+        stats["missed_ticks"] = self.missed_ticks
+        return stats
+
+    def format_summary(self):
+        stats = self.lateness_snapshot()
+        if not stats["count"]: return "нет тиков"
+        return (f"тиков {stats['count']}, пропущено {stats['missed_ticks']}, опоздание avg {stats['avg_ms']:.2f} / "
+                f"p50 {stats['p50_ms']:.2f} / p95 {stats['p95_ms']:.2f} / p99 {stats['p99_ms']:.2f} / max {stats['max_ms']:.2f} мс")
+
+
+class HealthMonitor:
+    """
+    Редкие проверки состояния записи (окно живо, ffmpeg работает, stdin открыт) в отдельном потоке,
+    вне горячего цикла захвата. check_func() возвращает None или текст ошибки; при ошибке
+    он сохраняется в error_message и выставляется stop_event.
+    """
+    def __init__(self, check_func, interval_sec, stop_event, logger_func=print):
+        self.check_func = check_func
+        self.interval_sec = interval_sec
+        self.stop_event = stop_event
+        self.logger = logger_func
+        self.error_message = None
+        self._monitor_stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._monitor_stop.wait(self.interval_sec):
+            if self.stop_event.is_set(): break
+            self.check_now()
+
+    def check_now(self):
+        # Вызывается и из цикла монитора, и синхронно (перед стартом цикла захвата)
+        if self.error_message: return self.error_message
+        try: error_message = self.check_func()
+        except Exception as e_check: error_message = f"Ошибка проверки состояния записи: {e_check}"
+        if error_message:
+            self.error_message = error_message
+            self.logger(f"[HealthMonitor] {error_message}")
+            self.stop_event.set()
+        return error_message
+
+    def stop(self):
+        self._monitor_stop.set()
+        if self._thread and self._thread.is_alive(): self._thread.join(timeout=2.0)
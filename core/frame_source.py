@@ -0,0 +1,132 @@
+import abc
+import time
+
+import cv2
+import numpy as np
+
+from frame_buffers import FrameBufferRing, FrameSlot, BGRA_BYTES_PER_PIXEL
+from config import DEFAULT_CAPTURE_RING_DEPTH
+
+# Возможности источников кадров: по ним capture_initializer выбирает бэкенд
+CAPABILITY_WINDOW = "window"        # Захват конкретного окна по HWND
+CAPABILITY_SCREEN = "screen"        # Захват области экрана (перекрывающие окна попадают в кадр)
+CAPABILITY_ZERO_COPY = "zero_copy"  # Слоты acquire_frame смотрят прямо в память захвата, без копии в буфер
+CAPABILITY_RESIZE = "resize"        # Размер кадра может меняться во время записи
+CAPABILITY_SYNTHETIC = "synthetic"  # Без захвата ОС (бенчмарки, отладка, не-Windows)
+
+
+class FrameSource(abc.ABC):
+    """
+    Протокол источника кадров для FFmpegRecorder (abc: источник без open/grab_into не создается).
+    Бэкенд реализует open() -> bool, grab_into(out) -> bool (заполнить буфер вызывающего
+    BGRA (height, width, 4)), close() и поддерживает width, height, pixel_format
+    (прежний формат pipe для zero_copy: "bgra" или "bgr24"; кадры в слотах всегда BGRA,
+    формат pipe FFmpegRecorder согласует сам - negotiate_pipe_pixel_format).
+    Если grab_into обнаружил новый размер, он обновляет width/height и возвращает False.
+    acquire_frame()/release_frame() по умолчанию работают через grab_into и кольцо numpy-буферов;
+    бэкенды со своей памятью захвата (DIBSection GDI) переопределяют их и обходятся без копии.
+    """
+    name = "base"
+    capabilities = frozenset()
+
+    def __init__(self, logger_func=print, zero_copy=True, ring_depth=DEFAULT_CAPTURE_RING_DEPTH):
+        self.logger = logger_func
+        self.zero_copy = zero_copy
+        self.pixel_format = "bgra" if zero_copy else "bgr24"
+        self.width = 0
+        self.height = 0
+        self.is_initialized = False
+        self.frame_ring = FrameBufferRing(ring_depth, self._allocate_array_slot, self._free_array_slot, logger_func)
+
+    @abc.abstractmethod
+    def open(self):
+        pass
+
+    @abc.abstractmethod
+    def grab_into(self, out):
+        pass
+
+    def close(self):
+        self.frame_ring.free_all()
+        self.is_initialized = False
+
+    def is_alive(self):
+        # Источник еще может отдавать кадры (например, окно не закрыто)
+        return self.is_initialized
+
+    def bytes_copied_per_frame(self):
+        # Байт, копируемых источником на кадр в acquire_frame (для бенчмарков); по умолчанию - копия в буфер слота
+        return self.width * self.height * BGRA_BYTES_PER_PIXEL
+
+    def _allocate_array_slot(self, index, width, height):
+        return FrameSlot(index, np.zeros((height, width, BGRA_BYTES_PER_PIXEL), dtype=np.uint8))
+
+    def _free_array_slot(self, slot):
+        slot.frame = None
+
+    def acquire_frame(self, timeout=1.0):
+        if not self.is_initialized: return None
+        if (self.frame_ring.width, self.frame_ring.height) != (self.width, self.height):
+            if not self.frame_ring.allocate(self.width, self.height): return None
+        slot = self.frame_ring.acquire(timeout=timeout)
+        if slot is None: return None
+        if not self.grab_into(slot.frame):
+            self.frame_ring.release(slot); return None
+        slot.timestamp = time.perf_counter()
+        return slot
+
+    def release_frame(self, slot):
+        self.frame_ring.release(slot)
+
+
+class GrabFrameSourceAdapter(FrameSource):
+    """
+    FrameSource поверх захватчика со старым интерфейсом grab_frame() -> BGR/BGRA ndarray или None
+    (window_capture.WindowCapture, wgc_capture.WGCCapture). Кадр копируется в буфер слота;
+    стороны обрезаются до четных (yuv420p).
+    """
+    def __init__(self, name, create_grabber, capabilities=(), hwnd=None, logger_func=print, zero_copy=True,
+                 ring_depth=DEFAULT_CAPTURE_RING_DEPTH, grabber_copy_bytes_per_pixel=0):
+        super().__init__(logger_func, zero_copy, ring_depth)
+        self.name = name
+        self.capabilities = frozenset(capabilities)
+        self.hwnd = hwnd
+        self._create_grabber = create_grabber
+        self._grabber = None
+        self.grabber_copy_bytes_per_pixel = grabber_copy_bytes_per_pixel # Копии внутри grab_frame() обернутого захватчика
+
+    def open(self):
+        self._grabber = self._create_grabber()
+        frame = self._grabber.grab_frame() if self._grabber else None
+        if frame is None:
+            self.logger(f"[FrameSource {self.name}] Не удалось получить первый кадр.")
+            self.close(); return False
+        self.width = frame.shape[1] // 2 * 2; self.height = frame.shape[0] // 2 * 2
+        self.is_initialized = self.width > 0 and self.height > 0
+        return self.is_initialized
+
+    def grab_into(self, out):
+        frame = self._grabber.grab_frame()
+        if frame is None: return False
+        width = frame.shape[1] // 2 * 2; height = frame.shape[0] // 2 * 2
+        if (width, height) != (self.width, self.height):
+            self.width, self.height = width, height # Кольцо переразместится при следующем acquire_frame
+            return False
+        frame = frame[:height, :width]
+        if frame.shape[2] == 3: cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA, dst=out)
+        else: np.copyto(out, frame)
+        return True
+
+    def bytes_copied_per_frame(self):
+        return self.width * self.height * (self.grabber_copy_bytes_per_pixel + BGRA_BYTES_PER_PIXEL)
+
+    def is_alive(self):
+        if not self.is_initialized: return False
+        if not self.hwnd: return True
+        import win32gui
+        return bool(win32gui.IsWindow(self.hwnd))
+
+    def close(self):
+        if self._grabber is not None:
+            self._grabber.close(); self._grabber = None
+        super().close()
@@ -0,0 +1,197 @@
+import abc
+import io
+import itertools
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from config import FRAME_TRANSPORT_PIPE, FRAME_TRANSPORT_NAMED_PIPE, DEFAULT_PIPE_BUFFER_MB
+
+# fcntl Linux: емкость pipe (по умолчанию 64 КБ - 16 страниц)
+F_SETPIPE_SZ = 1031
+F_GETPIPE_SZ = 1032
+PIPE_MAX_SIZE_PATH = "/proc/sys/fs/pipe-max-size"
+# WinAPI именованных каналов (в _winapi есть не все)
+PIPE_ACCESS_OUTBOUND = 0x00000002
+PIPE_TYPE_BYTE = 0x00000000
+PIPE_WAIT = 0x00000000
+ERROR_PIPE_CONNECTED = 535
+
+_named_pipe_counter = itertools.count(1)
+
+
+def _set_pipe_size(fd, buffer_size):
+    """Увеличивает емкость pipe (Linux); без прав больше pipe-max-size не дается - берем максимум. Возвращает емкость или None."""
+    try: import fcntl
+    except ImportError: return None
+    if not buffer_size: return _get_pipe_size(fd)
+    try: return fcntl.fcntl(fd, F_SETPIPE_SZ, buffer_size)
+    except OSError:
+        try:
+            with open(PIPE_MAX_SIZE_PATH, 'r') as f: max_size = int(f.read().strip())
+            return fcntl.fcntl(fd, F_SETPIPE_SZ, min(buffer_size, max_size))
+        except (OSError, ValueError): return _get_pipe_size(fd)
+
+
+def _get_pipe_size(fd):
+    try:
+        import fcntl
+        return fcntl.fcntl(fd, F_GETPIPE_SZ)
+    except (ImportError, OSError): return None
+
+
+class FrameTransport(abc.ABC):
+    """
+    Канал кадров от потока записи к видео-ffmpeg. Порядок: prepare() до Popen (popen_stdin и input_url - в Popen и -i),
+    connect(process) после Popen (абстрактный: True - ffmpeg подключен), дальше stream.write(memoryview) (write_frame_buffer),
+    close() - EOF для ffmpeg.
+    """
+    name = "base"
+    input_url = "pipe:0"
+
+    def __init__(self, buffer_size=DEFAULT_PIPE_BUFFER_MB * 1024 * 1024, logger_func=print):
+        self.buffer_size = int(buffer_size or 0)
+        self.logger = logger_func
+        self.popen_stdin = subprocess.PIPE
+        self.stream = None
+        self.actual_buffer_size = None # Емкость канала после настройки (None - неизвестна)
+
+    def prepare(self):
+        pass
+
+    @abc.abstractmethod
+    def connect(self, process, timeout=10.0):
+        pass
+
+    @property
+    def closed(self):
+        return self.stream is None or self.stream.closed
+
+    def close(self):
+        if self.stream is not None and not self.stream.closed:
+            try: self.stream.close()
+            except OSError: pass # ffmpeg уже закрыл свой конец
+
+    def describe(self):
+        size_str = f"{self.actual_buffer_size // 1024} КБ" if self.actual_buffer_size else "системный"
+        return f"{self.name} (буфер {size_str})"
+
+
+class StdinPipeTransport(FrameTransport):
+    """
+    stdin ffmpeg через анонимный pipe, созданный заранее с нужной емкостью: на Windows размер задается
+    в CreatePipe (subprocess.PIPE создает канал системного размера), на Linux - F_SETPIPE_SZ.
+    """
+    name = FRAME_TRANSPORT_PIPE
+
+    def prepare(self):
+        if os.name == 'nt':
+            import _winapi, msvcrt
+            read_handle, write_handle = _winapi.CreatePipe(None, self.buffer_size)
+            read_fd = msvcrt.open_osfhandle(read_handle, os.O_RDONLY); write_fd = msvcrt.open_osfhandle(write_handle, 0)
+            self.actual_buffer_size = self.buffer_size or None
+        else:
+            read_fd, write_fd = os.pipe()
+            self.actual_buffer_size = _set_pipe_size(write_fd, self.buffer_size)
+        self.popen_stdin = read_fd # Popen дублирует его в stdin ffmpeg
+        self.stream = io.FileIO(write_fd, 'wb')
+
+    def connect(self, process, timeout=10.0):
+        # Конец чтения теперь у ffmpeg; наша копия закрывается, иначе ffmpeg не увидит EOF
+        os.close(self.popen_stdin); self.popen_stdin = None
+        return True
+
+    def close(self):
+        if isinstance(self.popen_stdin, int): # Popen не состоялся
+            try: os.close(self.popen_stdin)
+            except OSError: pass
+            self.popen_stdin = None
+        super().close()
+
+
+class NamedPipeTransport(FrameTransport):
+    """
+    Именованный канал: Windows - \\\\.\\pipe\\... с буфером buffer_size, POSIX - FIFO во временной папке (+ F_SETPIPE_SZ).
+    ffmpeg открывает его как файл (-i <путь>), stdin ffmpeg не используется.
+    """
+    name = FRAME_TRANSPORT_NAMED_PIPE
+
+    def __init__(self, buffer_size=DEFAULT_PIPE_BUFFER_MB * 1024 * 1024, logger_func=print):
+        super().__init__(buffer_size, logger_func)
+        self.popen_stdin = subprocess.DEVNULL
+        self._pipe_handle = None
+        self._fifo_dir = None
+
+    def prepare(self):
+        if os.name == 'nt':
+            import _winapi
+            self.input_url = rf"\\.\pipe\VideoConfRecorder_{os.getpid()}_{next(_named_pipe_counter)}"
+            self._pipe_handle = _winapi.CreateNamedPipe(self.input_url, PIPE_ACCESS_OUTBOUND, PIPE_TYPE_BYTE | PIPE_WAIT, 1,
+                                                        self.buffer_size, self.buffer_size, 0, _winapi.NULL)
+            self.actual_buffer_size = self.buffer_size or None
+        else:
+            self._fifo_dir = tempfile.mkdtemp(prefix='_rec_fifo_')
+            self.input_url = os.path.join(self._fifo_dir, "frames")
+            os.mkfifo(self.input_url, 0o600)
+
+    def connect(self, process, timeout=10.0):
+        # ffmpeg открывает вход сразу после старта; если он упал раньше, не ждем вечно
+        deadline = time.monotonic() + timeout
+        if os.name == 'nt': return self._connect_windows(process, deadline)
+        while True:
+            try: fd = os.open(self.input_url, os.O_WRONLY | os.O_NONBLOCK); break
+            except OSError: # ENXIO: читатель еще не открыл FIFO
+                if process.poll() is not None or time.monotonic() > deadline:
+                    self.logger(f"[FrameTransport] ffmpeg не открыл FIFO {self.input_url}."); return False
+                time.sleep(0.01)
+        os.set_blocking(fd, True)
+        self.actual_buffer_size = _set_pipe_size(fd, self.buffer_size)
+        self.stream = io.FileIO(fd, 'wb')
+        return True
+
+    def _connect_windows(self, process, deadline):
+        import _winapi, msvcrt
+        connect_error = []
+
+        def wait_for_client():
+            try: _winapi.ConnectNamedPipe(self._pipe_handle, False)
+            except OSError as e_connect: connect_error.append(e_connect)
+
+        waiter = threading.Thread(target=wait_for_client, daemon=True); waiter.start()
+        while waiter.is_alive():
+            if process.poll() is not None or time.monotonic() > deadline:
+                # Блокирующий ConnectNamedPipe не прерывается: подключаемся сами, чтобы освободить поток
+                try: _winapi.CloseHandle(_winapi.CreateFile(self.input_url, _winapi.GENERIC_READ, 0, _winapi.NULL, _winapi.OPEN_EXISTING, 0, _winapi.NULL))
+                except OSError: pass
+                waiter.join(1.0)
+                self.logger(f"[FrameTransport] ffmpeg не подключился к {self.input_url}."); return False
+            waiter.join(0.01)
+        # ERROR_PIPE_CONNECTED: ffmpeg открыл канал раньше, чем мы начали ждать - это успех
+        if connect_error and getattr(connect_error[0], "winerror", None) != ERROR_PIPE_CONNECTED:
+            self.logger(f"[FrameTransport] Ошибка подключения именованного канала: {connect_error[0]}"); return False
+        self.stream = io.FileIO(msvcrt.open_osfhandle(self._pipe_handle, 0), 'wb'); self._pipe_handle = None
+        return True
+
+    def close(self):
+        super().close()
+        if self._pipe_handle is not None: # Канал создан, но клиент так и не подключился
+            import _winapi
+            _winapi.CloseHandle(self._pipe_handle); self._pipe_handle = None
+        if self._fifo_dir:
+            shutil.rmtree(self._fifo_dir, ignore_errors=True); self._fifo_dir = None
+
+
+FRAME_TRANSPORTS = {
+    FRAME_TRANSPORT_PIPE: StdinPipeTransport,
+    FRAME_TRANSPORT_NAMED_PIPE: NamedPipeTransport,
+}
+
+
+def create_frame_transport(name=FRAME_TRANSPORT_PIPE, buffer_size=DEFAULT_PIPE_BUFFER_MB * 1024 * 1024, logger_func=print):
+    """Транспорт по имени; неизвестное имя - ValueError."""
+    if name not in FRAME_TRANSPORTS:
+        raise ValueError(f"Неизвестный транспорт кадров: {name} (доступны: {', '.join(FRAME_TRANSPORTS)})")
+    return FRAME_TRANSPORTS[name](buffer_size, logger_func)
@@ -0,0 +1,316 @@
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from config import DEFAULT_INCREMENTAL_MUX_INTERVAL_SEC
+
+# Расхождение начала фрагмента с концом предыдущего (в секундах), которое считается округлением меток Matroska (1 мс),
+# а не разрывом: такой фрагмент продолжает дорожку встык (звук без щелчков на границах)
+CONTINUITY_TOLERANCE_SEC = 0.002
+
+
+def _get_creation_flags():
+    # Как в FFmpegRecorder: без консольного окна в собранном exe
+    return 0x08000000 if os.name == 'nt' and getattr(sys, 'frozen', False) else 0
+
+
+def _iter_boxes(data, start=0, end=None):
+    # -> (тип, начало, размер, длина заголовка) боксов ISO BMFF подряд в data[start:end]
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset); header = 8
+        if size == 1: size = struct.unpack_from(">Q", data, offset + 8)[0]; header = 16
+        elif size == 0: size = end - offset
+        if size < header or offset + size > end: raise ValueError(f"Поврежденный бокс {box_type!r} на смещении {offset}")
+        yield box_type, offset, size, header
+        offset += size
+
+
+def _find_box(data, start, end, box_type):
+    for child_type, offset, size, header in _iter_boxes(data, start, end):
+        if child_type == box_type: return offset, size, header
+    return None
+
+
+def _find_path(data, start, end, path):
+    box = None
+    for box_type in path:
+        box = _find_box(data, start, end, box_type)
+        if box is None: return None
+        start, end = box[0] + box[2], box[0] + box[1]
+    return box
+
+
+def _full_box_version(data, box):
+    return data[box[0] + box[2]]
+
+
+def _read_movie_tracks(data):
+    """moov -> {тип обработчика (b"vide"/b"soun"): описание дорожки}: track_id, timescale, подпись кодека, сдвиг показа, trex."""
+    moov = _find_box(data, 0, len(data), b"moov")
+    if moov is None: raise ValueError("Нет moov")
+    moov_start, moov_end = moov[0] + moov[2], moov[0] + moov[1]
+    mvhd = _find_box(data, moov_start, moov_end, b"mvhd")
+    movie_timescale = struct.unpack_from(">I", data, mvhd[0] + mvhd[2] + (20 if _full_box_version(data, mvhd) == 1 else 12))[0]
+    trex_durations = {}
+    mvex = _find_box(data, moov_start, moov_end, b"mvex")
+    if mvex is not None:
+        for box_type, offset, size, header in _iter_boxes(data, mvex[0] + mvex[2], mvex[0] + mvex[1]):
+            if box_type == b"trex":
+                track_id, _, default_duration = struct.unpack_from(">III", data, offset + header + 4)
+                trex_durations[track_id] = default_duration
+    tracks = {}
+    for box_type, offset, size, header in _iter_boxes(data, moov_start, moov_end):
+        if box_type != b"trak": continue
+        trak_start, trak_end = offset + header, offset + size
+        tkhd = _find_box(data, trak_start, trak_end, b"tkhd")
+        track_id = struct.unpack_from(">I", data, tkhd[0] + tkhd[2] + (20 if _full_box_version(data, tkhd) == 1 else 12))[0]
+        mdhd = _find_path(data, trak_start, trak_end, (b"mdia", b"mdhd"))
+        timescale = struct.unpack_from(">I", data, mdhd[0] + mdhd[2] + (20 if _full_box_version(data, mdhd) == 1 else 12))[0]
+        hdlr = _find_path(data, trak_start, trak_end, (b"mdia", b"hdlr"))
+        handler = bytes(data[hdlr[0] + hdlr[2] + 8:hdlr[0] + hdlr[2] + 12])
+        stsd = _find_path(data, trak_start, trak_end, (b"mdia", b"minf", b"stbl", b"stsd"))
+        tracks[handler] = {"track_id": track_id, "timescale": timescale, "codec": _codec_signature(data[stsd[0]:stsd[0] + stsd[1]]),
+                           "presentation_shift": _read_presentation_shift(data, trak_start, trak_end, timescale, movie_timescale),
+                           "trex_duration": trex_durations.get(track_id, 0)}
+    return tracks
+
+
+def _read_descriptor_header(data, offset):
+    # Дескриптор MPEG-4 (esds): тег и длина переменной длины (7 бит на байт) -> (тег, длина, начало данных)
+    tag = data[offset]; length = 0; offset += 1
+    for _ in range(4):
+        byte = data[offset]; offset += 1
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80: break
+    return tag, length, offset
+
+
+def _codec_signature(stsd):
+    """
+    stsd без полей битрейта (btrt, битрейты DecoderConfigDescriptor в esds): их ffmpeg считает по содержимому файла,
+    и у каждого фрагмента они свои. Совпадение подписей - те же параметры кодека (avcC, esds, размер, частота).
+    """
+    data = bytearray(stsd)
+    for box_type, offset, size, header in _iter_boxes(data, 16, len(data)): # Сэмпл-энтри после заголовка stsd и entry_count
+        entry_fixed = 78 if box_type in (b"avc1", b"avc3", b"hvc1", b"hev1", b"av01", b"vp09") else 28
+        for child_type, child_offset, child_size, child_header in _iter_boxes(data, offset + header + entry_fixed, offset + size):
+            if child_type == b"btrt": data[child_offset + child_header:child_offset + child_size] = bytes(child_size - child_header)
+            elif child_type == b"esds":
+                tag, length, payload = _read_descriptor_header(data, child_offset + child_header + 4)
+                if tag != 0x03: continue
+                data[payload:payload + 2] = bytes(2) # ES_ID - номер дорожки в файле фрагмента
+                flags = data[payload + 2]; position = payload + 3
+                if flags & 0x80: position += 2
+                if flags & 0x40: position += 1 + data[position]
+                if flags & 0x20: position += 2
+                tag, length, payload = _read_descriptor_header(data, position)
+                if tag == 0x04: data[payload + 2:payload + 13] = bytes(11) # bufferSizeDB, maxBitrate, avgBitrate
+    return bytes(data)
+
+
+def _read_presentation_shift(data, trak_start, trak_end, timescale, movie_timescale):
+    # Сдвиг показа по edts/elst в единицах дорожки: пустые правки задерживают показ, media_time пропускает начало
+    # (задержка B-кадров видео, priming AAC). Показ = время декодирования + ctts + сдвиг
+    elst = _find_path(data, trak_start, trak_end, (b"edts", b"elst"))
+    if elst is None: return 0
+    version = _full_box_version(data, elst)
+    entry_count = struct.unpack_from(">I", data, elst[0] + elst[2] + 4)[0]
+    offset = elst[0] + elst[2] + 8; shift = 0
+    for _ in range(entry_count):
+        if version == 1: duration, media_time = struct.unpack_from(">Qq", data, offset); offset += 16
+        else: duration, media_time = struct.unpack_from(">Ii", data, offset); offset += 8
+        offset += 4 # media_rate
+        if media_time == -1: shift += duration * timescale // movie_timescale
+        else: return shift - media_time
+    return shift
+
+
+class Fmp4Appender:
+    """
+    Дописывает фрагменты отдельных fMP4 (mp4 с +frag_keyframe+empty_moov+default_base_moof) в один файл:
+    ftyp и moov берутся из первого, от остальных - только moof+mdat. У каждого фрагмента переписываются номер (mfhd),
+    track_ID (по типу дорожки) и время декодирования (tfdt) - со start_times[тип] секунд общей шкалы;
+    смещения данных отсчитываются от moof, поэтому байты mdat копируются как есть.
+    Параметры кодека (stsd без битрейтов) каждого фрагмента должны совпадать с moov первого - иначе ValueError.
+    """
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.tracks = None # Дорожки итогового moov (_read_movie_tracks первого фрагмента)
+        self.track_ends = {} # Тип дорожки -> конец последнего дописанного фрагмента (единицы дорожки)
+        self.sequence_number = 0
+        self.bytes_written = 0
+
+    @property
+    def initialized(self):
+        return self.tracks is not None
+
+    def append(self, chunk_path, start_times):
+        with open(chunk_path, "rb") as chunk_file: data = bytearray(chunk_file.read())
+        chunk_tracks = _read_movie_tracks(data)
+        if self.tracks is None:
+            header_end = _find_box(data, 0, len(data), b"moov"); header_end = header_end[0] + header_end[1]
+            self.tracks = chunk_tracks
+            with open(self.output_path, "wb") as output_file: output_file.write(data[:header_end])
+            self.bytes_written = header_end
+        fragments = []
+        for box_type, offset, size, header in _iter_boxes(data):
+            if box_type == b"moof": fragments.append([offset, size, header, None])
+            elif box_type == b"mdat" and fragments and fragments[-1][3] is None: fragments[-1][3] = (offset, size)
+        first_decode_times = {}
+        for moof_offset, moof_size, moof_header, _ in fragments:
+            for box_type, offset, size, header in _iter_boxes(data, moof_offset + moof_header, moof_offset + moof_size):
+                if box_type != b"traf": continue
+                tfhd = _find_box(data, offset + header, offset + size, b"tfhd"); tfdt = _find_box(data, offset + header, offset + size, b"tfdt")
+                track_id = struct.unpack_from(">I", data, tfhd[0] + tfhd[2] + 4)[0]
+                if tfdt is not None and track_id not in first_decode_times: first_decode_times[track_id] = self._read_tfdt(data, tfdt)
+        deltas = {}
+        for handler, chunk_track in chunk_tracks.items():
+            track = self.tracks.get(handler)
+            if track is None: raise ValueError(f"Дорожки {handler.decode()} нет в начале файла")
+            if chunk_track["codec"] != track["codec"]: raise ValueError(f"Параметры кодека дорожки {handler.decode()} изменились")
+            # Начало фрагмента на общей шкале с поправкой на сдвиги показа (elst) его moov и итогового
+            chunk_first = first_decode_times.get(chunk_track["track_id"], 0)
+            start = int(round(start_times[handler] * track["timescale"])) + chunk_track["presentation_shift"] - track["presentation_shift"] + chunk_first
+            previous_end = self.track_ends.get(handler)
+            if previous_end is not None and abs(start - previous_end) <= CONTINUITY_TOLERANCE_SEC * track["timescale"]: start = previous_end
+            deltas[chunk_track["track_id"]] = (handler, chunk_track, start - chunk_first)
+        with open(self.output_path, "ab") as output_file:
+            for moof_offset, moof_size, moof_header, mdat in fragments:
+                self.sequence_number += 1
+                mfhd = _find_box(data, moof_offset + moof_header, moof_offset + moof_size, b"mfhd")
+                struct.pack_into(">I", data, mfhd[0] + mfhd[2] + 4, self.sequence_number)
+                for box_type, offset, size, header in _iter_boxes(data, moof_offset + moof_header, moof_offset + moof_size):
+                    if box_type == b"traf": self._patch_traf(data, offset + header, offset + size, deltas)
+                output_file.write(data[moof_offset:moof_offset + moof_size])
+                if mdat: output_file.write(data[mdat[0]:mdat[0] + mdat[1]])
+                self.bytes_written += moof_size + (mdat[1] if mdat else 0)
+
+    @staticmethod
+    def _read_tfdt(data, tfdt):
+        if _full_box_version(data, tfdt) == 1: return struct.unpack_from(">Q", data, tfdt[0] + tfdt[2] + 4)[0]
+        return struct.unpack_from(">I", data, tfdt[0] + tfdt[2] + 4)[0]
+
+    def _patch_traf(self, data, traf_start, traf_end, deltas):
+        tfhd = _find_box(data, traf_start, traf_end, b"tfhd")
+        tfhd_flags = struct.unpack_from(">I", data, tfhd[0] + tfhd[2])[0] & 0xFFFFFF
+        chunk_track_id = struct.unpack_from(">I", data, tfhd[0] + tfhd[2] + 4)[0]
+        handler, chunk_track, delta = deltas[chunk_track_id]
+        track = self.tracks[handler]
+        struct.pack_into(">I", data, tfhd[0] + tfhd[2] + 4, track["track_id"])
+        tfdt = _find_box(data, traf_start, traf_end, b"tfdt")
+        decode_time = self._read_tfdt(data, tfdt) + delta
+        if decode_time < 0: raise ValueError("Отрицательное время фрагмента")
+        if _full_box_version(data, tfdt) == 1: struct.pack_into(">Q", data, tfdt[0] + tfdt[2] + 4, decode_time)
+        elif decode_time < 2 ** 32: struct.pack_into(">I", data, tfdt[0] + tfdt[2] + 4, decode_time)
+        else: raise ValueError("Время фрагмента не помещается в tfdt версии 0")
+        # Конец фрагмента - для стыковки следующего: сумма длительностей сэмплов trun
+        default_duration = chunk_track["trex_duration"]
+        field_offset = tfhd[0] + tfhd[2] + 8
+        if tfhd_flags & 0x1: field_offset += 8
+        if tfhd_flags & 0x2: field_offset += 4
+        if tfhd_flags & 0x8: default_duration = struct.unpack_from(">I", data, field_offset)[0]
+        total_duration = 0
+        for box_type, offset, size, header in _iter_boxes(data, traf_start, traf_end):
+            if box_type != b"trun": continue
+            trun_flags = struct.unpack_from(">I", data, offset + header)[0] & 0xFFFFFF
+            sample_count = struct.unpack_from(">I", data, offset + header + 4)[0]
+            if not trun_flags & 0x100: total_duration += sample_count * default_duration; continue
+            sample_offset = offset + header + 8 + (4 if trun_flags & 0x1 else 0) + (4 if trun_flags & 0x4 else 0)
+            sample_size = 4 * bin(trun_flags & 0xF00).count("1")
+            for index in range(sample_count): total_duration += struct.unpack_from(">I", data, sample_offset + index * sample_size)[0]
+        self.track_ends[handler] = max(self.track_ends.get(handler, 0), decode_time + total_duration)
+
+
+class IncrementalMuxer:
+    """
+    Сборка итогового mp4 по ходу сегментной записи (RecordingSession): раз в interval_sec закрытые сегменты Matroska
+    (уже в CSV) видео и звука переносятся без перекодирования в fMP4-фрагмент, и Fmp4Appender дописывает его в итоговый файл.
+    finish() после остановки процессов записи добавляет остаток - при остановке обрабатывается только последний кусок.
+    Ошибка (например, сменились параметры кодека) выключает сборку: disabled_reason, итог собирает обычный mux.
+    """
+    def __init__(self, session, output_file, track_names, video_tag=None, ffmpeg_path="ffmpeg", logger_func=print,
+                 interval_sec=DEFAULT_INCREMENTAL_MUX_INTERVAL_SEC):
+        self.session = session
+        self.output_file = output_file
+        self.track_names = list(track_names) # "video" и не больше одной дорожки звука "audio_N" (смешивание - перекодирование)
+        self.video_tag = video_tag
+        self.ffmpeg_path = ffmpeg_path
+        self.logger = logger_func
+        self.interval_sec = interval_sec
+        self.appender = Fmp4Appender(output_file)
+        self.appended_counts = {name: 0 for name in self.track_names} # Сегментов каждой дорожки уже в итоговом файле
+        self.chunks_written = 0
+        self.disabled_reason = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True); self._thread.start()
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval_sec): self.poll()
+
+    def poll(self, final=False):
+        """Переносит новые закрытые сегменты (final - все оставшиеся). Возвращает False, если сборка выключена."""
+        with self._lock:
+            if self.disabled_reason: return False
+            # До остановки - только закрытые сегменты; после - все, незакрытые с началом из файла
+            pending = {name: self.session.collect_segments(name, self.ffmpeg_path if final else None)[self.appended_counts[name]:]
+                       for name in self.track_names}
+            # Первый фрагмент задает moov итогового файла: в нем должны быть все дорожки
+            if not self.appender.initialized and not final and not all(pending.values()): return True
+            pending = {name: segments for name, segments in pending.items() if segments}
+            durations = {}
+            if final and "video" in self.track_names:
+                # Как -shortest обычного mux: звук обрезается по концу видео (конец последнего сегмента из CSV)
+                video_end = self.session.track_end("video")
+                for name in [name for name in pending if name != "video" and video_end is not None]:
+                    durations[name] = video_end - pending[name][0][1]
+                    if durations[name] <= 0: del pending[name], durations[name]
+            if not pending: return True
+            try: self._append_chunk(pending, durations)
+            except Exception as e_chunk:
+                self.disabled_reason = str(e_chunk)
+                self.logger(f"[IncrementalMux] Сборка по ходу записи выключена ({e_chunk}), итог соберет mux при остановке.")
+                return False
+            return True
+
+    def _append_chunk(self, pending, durations=None):
+        # durations: дорожка -> сколько секунд взять от начала ее сегментов
+        command = [self.ffmpeg_path, '-hide_banner', '-loglevel', 'error']
+        start_times = {}
+        for input_index, (name, segments) in enumerate(pending.items()):
+            list_path = self.session.write_concat_list(f"chunk_{name}.ffconcat", segments)
+            if durations and name in durations: command.extend(['-t', f"{durations[name]:.3f}"])
+            command.extend(['-f', 'concat', '-safe', '0', '-i', list_path])
+            start_times[b"vide" if name == "video" else b"soun"] = segments[0][1]
+        for input_index in range(len(pending)): command.extend(['-map', str(input_index)])
+        chunk_path = os.path.join(self.session.session_dir, "chunk.mp4")
+        command.extend(['-c', 'copy', '-video_track_timescale', '1000'])
+        if self.video_tag and "video" in pending: command.extend(['-tag:v', self.video_tag])
+        command.extend(['-movflags', '+frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4', chunk_path, '-y'])
+        result = subprocess.run(command, capture_output=True, text=True, encoding='utf-8', errors='ignore', creationflags=_get_creation_flags())
+        if result.returncode != 0: raise RuntimeError(f"FFmpeg фрагмента код {result.returncode}: {result.stderr.strip()}")
+        self.appender.append(chunk_path, start_times)
+        os.remove(chunk_path)
+        for name, segments in pending.items(): self.appended_counts[name] += len(segments)
+        self.chunks_written += 1
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive(): self._thread.join(timeout=60.0)
+
+    def finish(self):
+        """Останавливает поток и дописывает остаток. True - итоговый файл полный."""
+        self.stop()
+        start_time = time.perf_counter()
+        if not self.poll(final=True) or not self.appender.initialized: return False
+        self.logger(f"[IncrementalMux] Последний фрагмент дописан за {time.perf_counter() - start_time:.2f} с "
+                    f"(фрагментов {self.chunks_written}, {self.appender.bytes_written / 1e6:.1f} МБ).")
+        return True
@@ -0,0 +1,102 @@
+import threading
+
+# Гистограмма задержек в стиле HDR: логарифмические октавы, каждая делится на SUB_BUCKET_COUNT линейных корзин.
+# Память фиксирована (NUM_BUCKETS счетчиков), относительная ошибка значения не больше 1 / SUB_BUCKET_COUNT (~3%).
+SUB_BUCKET_BITS = 5
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+MAX_TRACKABLE_US = (1 << 26) - 1 # ~67 с; большие значения попадают в последнюю корзину
+NUM_BUCKETS = ((MAX_TRACKABLE_US.bit_length() - SUB_BUCKET_BITS) << SUB_BUCKET_BITS) + SUB_BUCKET_COUNT
+
+
+def _bucket_index(value_us):
+    if value_us < SUB_BUCKET_COUNT: return value_us
+    exponent = value_us.bit_length() - SUB_BUCKET_BITS - 1
+    return (exponent << SUB_BUCKET_BITS) + (value_us >> exponent)
+
+
+def _bucket_bounds(index):
+    # [нижняя, верхняя] граница значений корзины в мкс
+    if index < 2 * SUB_BUCKET_COUNT: return index, index
+    exponent = (index >> SUB_BUCKET_BITS) - 1
+    lower = (index - (exponent << SUB_BUCKET_BITS)) << exponent
+    return lower, lower + (1 << exponent) - 1
+
+
+class LatencyHistogram:
+    """
+    Распределение длительностей (секунды на входе, мкс внутри) в фиксированной памяти.
+    Не потокобезопасна: блокировку держит владелец (FramePipelineStats).
+    """
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.total_count = 0
+        self.total_us = 0
+        self.max_us = 0
+        self.min_us = None
+
+    def record(self, seconds):
+        value_us = min(MAX_TRACKABLE_US, max(0, int(seconds * 1000000.0)))
+        self.counts[_bucket_index(value_us)] += 1
+        self.total_count += 1; self.total_us += value_us
+        if value_us > self.max_us: self.max_us = value_us
+        if self.min_us is None or value_us < self.min_us: self.min_us = value_us
+
+    def reset(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.total_count = 0; self.total_us = 0; self.max_us = 0; self.min_us = None
+
+    def percentile_us(self, percentile):
+        if not self.total_count: return 0
+        target = max(1, int(round(self.total_count * percentile / 100.0)))
+        running = 0
+        for index, count in enumerate(self.counts):
+            if not count: continue
+            running += count
+            if running >= target: return min(_bucket_bounds(index)[1], self.max_us) # Верх корзины, как HdrHistogram
+        return self.max_us
+
+    def count_above_us(self, threshold_us):
+        # Значений больше порога (с точностью до корзины, в которую попал порог)
+        start_index = _bucket_index(min(MAX_TRACKABLE_US, int(threshold_us))) + 1
+        return sum(self.counts[start_index:])
+
+    def snapshot(self, budget_sec=None):
+        if not self.total_count: return {"count": 0}
+        stats = {
+            "count": self.total_count, "avg_ms": round(self.total_us / self.total_count / 1000.0, 3),
+            "min_ms": round(self.min_us / 1000.0, 3), "p50_ms": round(self.percentile_us(50) / 1000.0, 3),
+            "p95_ms": round(self.percentile_us(95) / 1000.0, 3), "p99_ms": round(self.percentile_us(99) / 1000.0, 3),
+            "max_ms": round(self.max_us / 1000.0, 3), "total_ms": round(self.total_us / 1000.0, 1),
+        }
+        if budget_sec: stats["over_budget"] = self.count_above_us(budget_sec * 1000000.0)
+        return stats
+
+
+class StageLatencyStats:
+    """Гистограммы LatencyHistogram по именам этапов; add() вызывается из нескольких потоков."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None: histogram = self._stages[stage] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def reset(self):
+        with self._lock: self._stages.clear()
+
+    def snapshot(self, budget_sec=None):
+        """{этап: {count, avg_ms, min_ms, p50_ms, p95_ms, p99_ms, max_ms, total_ms[, over_budget]}}"""
+        with self._lock:
+            return {stage: histogram.snapshot(budget_sec) for stage, histogram in self._stages.items()}
+
+    def format_summary(self, budget_sec=None):
+        parts = []
+        for stage, values in self.snapshot(budget_sec).items():
+            part = (f"{stage}: p50 {values['p50_ms']:.2f} / p99 {values['p99_ms']:.2f} / макс. {values['max_ms']:.2f} мс "
+                    f"(ср. {values['avg_ms']:.2f}, {values['count']})")
+            if values.get("over_budget"): part += f", сверх бюджета кадра: {values['over_budget']}"
+            parts.append(part)
+        return "; ".join(parts)
@@ -0,0 +1,99 @@
+import struct
+
+from frame_buffers import write_frame_buffer
+
+# Минимальный потоковый Matroska-писатель для передачи сырых кадров в ffmpeg с реальными метками времени.
+# Rawvideo по pipe не несет времени (ffmpeg считает кадры строго по -r), а Matroska несет метку у каждого блока.
+
+EBML_HEADER_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+INFO_ID = 0x1549A966
+TRACKS_ID = 0x1654AE6B
+TRACK_ENTRY_ID = 0xAE
+VIDEO_ID = 0xE0
+CLUSTER_ID = 0x1F43B675
+CLUSTER_TIMESTAMP_ID = 0xE7
+SIMPLE_BLOCK_ID = 0xA3
+
+TIMESTAMP_SCALE_NS = 1000000 # Метки в миллисекундах
+UNKNOWN_SIZE = b"\x01\xff\xff\xff\xff\xff\xff\xff" # Сегмент неизвестной длины: поток пишется без seek
+
+# FourCC ColourSpace для V_UNCOMPRESSED, по ним ffmpeg выбирает pix_fmt
+PIXEL_FORMAT_FOURCC = {
+    "bgra": b"BGRA",
+    "bgr0": b"BGR\x00",
+    "bgr24": b"BGR\x18",
+}
+
+
+def _ebml_id(element_id):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+
+
+def _ebml_size(size):
+    # Всегда 8-байтовый vint: размер заголовка кадра фиксирован
+    return (0x01 << 56 | size).to_bytes(8, "big")
+
+
+def _ebml_element(element_id, payload):
+    return _ebml_id(element_id) + _ebml_size(len(payload)) + payload
+
+
+def _ebml_uint(element_id, value):
+    return _ebml_element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big"))
+
+
+def _ebml_string(element_id, value):
+    return _ebml_element(element_id, value.encode("ascii") if isinstance(value, str) else value)
+
+
+class MatroskaPipeWriter:
+    """
+    Пишет в поток (stdin ffmpeg) Matroska с одной дорожкой V_UNCOMPRESSED.
+    Каждый кадр - отдельный кластер с абсолютной меткой времени (мс от первого кадра),
+    данные кадра пишутся напрямую из его памяти (write_frame_buffer), без копии.
+    Метки строго возрастают: два кадра в одной миллисекунде разводятся на 1 мс.
+    """
+    def __init__(self, stream, width, height, pixel_format="bgra"):
+        if pixel_format not in PIXEL_FORMAT_FOURCC:
+            raise ValueError(f"Неподдерживаемый формат пикселей для Matroska: {pixel_format}")
+        self.stream = stream
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self._header_written = False
+        self._start_timestamp = None
+        self._last_timestamp_ms = -1
+
+    def write_header(self):
+        ebml_header = _ebml_element(EBML_HEADER_ID,
+            _ebml_uint(0x4286, 1) + _ebml_uint(0x42F7, 1) + _ebml_uint(0x42F2, 4) + _ebml_uint(0x42F3, 8) +
+            _ebml_string(0x4282, "matroska") + _ebml_uint(0x4287, 4) + _ebml_uint(0x4285, 2))
+        info = _ebml_element(INFO_ID,
+            _ebml_uint(0x2AD7B1, TIMESTAMP_SCALE_NS) + _ebml_string(0x4D80, "VideoConfRecorder") + _ebml_string(0x5741, "VideoConfRecorder"))
+        video = _ebml_element(VIDEO_ID,
+            _ebml_uint(0xB0, self.width) + _ebml_uint(0xBA, self.height) + _ebml_string(0x2EB524, PIXEL_FORMAT_FOURCC[self.pixel_format]))
+        track_entry = _ebml_element(TRACK_ENTRY_ID,
+            _ebml_uint(0xD7, 1) + _ebml_uint(0x73C5, 1) + _ebml_uint(0x83, 1) + _ebml_uint(0x9C, 0) +
+            _ebml_string(0x86, "V_UNCOMPRESSED") + video)
+        tracks = _ebml_element(TRACKS_ID, track_entry)
+        write_frame_buffer(self.stream, ebml_header + _ebml_id(SEGMENT_ID) + UNKNOWN_SIZE + info + tracks)
+        self._header_written = True
+
+    def write_frame(self, frame, timestamp):
+        """timestamp - секунды монотонных часов (time.perf_counter()) момента захвата кадра. Возвращает метку кадра в мс."""
+        if not self._header_written: self.write_header()
+        if self._start_timestamp is None: self._start_timestamp = timestamp
+        timestamp_ms = max(int(round((timestamp - self._start_timestamp) * 1000.0)), self._last_timestamp_ms + 1)
+        self._last_timestamp_ms = timestamp_ms
+
+        frame_size = frame.nbytes
+        cluster_timestamp = _ebml_uint(CLUSTER_TIMESTAMP_ID, timestamp_ms)
+        # SimpleBlock: номер дорожки (vint 0x81), смещение от метки кластера (int16 = 0), флаги (ключевой кадр)
+        block_header = b"\x81" + struct.pack(">hB", 0, 0x80)
+        block_size = len(block_header) + frame_size
+        cluster_size = len(cluster_timestamp) + len(_ebml_id(SIMPLE_BLOCK_ID)) + 8 + block_size
+        write_frame_buffer(self.stream, _ebml_id(CLUSTER_ID) + _ebml_size(cluster_size) + cluster_timestamp +
+                          _ebml_id(SIMPLE_BLOCK_ID) + _ebml_size(block_size) + block_header)
+        write_frame_buffer(self.stream, frame)
+        return timestamp_ms
@@ -0,0 +1,81 @@
+import numpy as np
+
+from frame_buffers import BGRA_BYTES_PER_PIXEL
+from frame_source import FrameSource, CAPABILITY_SCREEN, CAPABILITY_RESIZE
+from config import CAPTURE_METHOD_MSS, DEFAULT_CAPTURE_RING_DEPTH
+
+
+def is_mss_available():
+    # mss без дисплея (Linux без X) падает уже при создании, поэтому проверяем создание экземпляра
+    try:
+        import mss
+        with mss.mss() as screen_capture: return len(screen_capture.monitors) > 1
+    except Exception:
+        return False
+
+
+class MssFrameSource(FrameSource):
+    """
+    Захват области экрана через mss (кроссплатформенно: GDI BitBlt экрана на Windows, XGetImage/XShm на Linux).
+    С hwnd захватывается прямоугольник клиентской области окна на экране (перекрытия попадут в кадр),
+    без hwnd - область width x height от левого верхнего угла monitor.
+    mss отдает кадр в своем буфере BGRA, grab_into копирует его в буфер слота.
+    """
+    name = CAPTURE_METHOD_MSS
+    capabilities = frozenset((CAPABILITY_SCREEN, CAPABILITY_RESIZE)) # С hwnd область следует за размером окна
+
+    def __init__(self, hwnd=None, width=1920, height=1080, monitor=1, logger_func=print, zero_copy=True,
+                 ring_depth=DEFAULT_CAPTURE_RING_DEPTH):
+        super().__init__(logger_func, zero_copy, ring_depth)
+        self.hwnd = hwnd
+        self.requested_width = width
+        self.requested_height = height
+        self.monitor_index = monitor
+        self._screen_capture = None
+        self._region = None
+
+    def _get_region(self):
+        if self.hwnd:
+            import win32gui
+            client_left, client_top, client_right, client_bottom = win32gui.GetClientRect(self.hwnd)
+            screen_left, screen_top = win32gui.ClientToScreen(self.hwnd, (client_left, client_top))
+            width, height = client_right - client_left, client_bottom - client_top
+        else:
+            monitor = self._screen_capture.monitors[self.monitor_index]
+            screen_left, screen_top = monitor["left"], monitor["top"]
+            width, height = min(self.requested_width, monitor["width"]), min(self.requested_height, monitor["height"])
+        return {"left": screen_left, "top": screen_top, "width": width // 2 * 2, "height": height // 2 * 2}
+
+    def open(self):
+        import mss
+        self._screen_capture = mss.mss()
+        self._region = self._get_region()
+        self.width, self.height = self._region["width"], self._region["height"]
+        self.is_initialized = self.width > 0 and self.height > 0
+        return self.is_initialized
+
+    def grab_into(self, out):
+        if self.hwnd:
+            region = self._get_region()
+            if (region["width"], region["height"]) != (self.width, self.height):
+                self._region = region; self.width, self.height = region["width"], region["height"]
+                return False
+            self._region = region # Окно могло сдвинуться
+        shot = self._screen_capture.grab(self._region)
+        np.copyto(out, np.frombuffer(shot.raw, dtype=np.uint8).reshape((self.height, self.width, BGRA_BYTES_PER_PIXEL)))
+        return True
+
+    def bytes_copied_per_frame(self):
+        # Буфер mss + копия в слот
+        return 2 * self.width * self.height * BGRA_BYTES_PER_PIXEL
+
+    def is_alive(self):
+        if not self.is_initialized: return False
+        if not self.hwnd: return True
+        import win32gui
+        return bool(win32gui.IsWindow(self.hwnd))
+
+    def close(self):
+        if self._screen_capture is not None:
+            self._screen_capture.close(); self._screen_capture = None
+        super().close()
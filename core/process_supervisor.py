@@ -0,0 +1,96 @@
+import os
+import signal
+import time
+
+from config import DEFAULT_PROCESS_STOP_TIMEOUT_SEC
+
+# Эскалация остановки по доле общего срока: кто не вышел сам после мягкой остановки, получает сигнал, затем terminate,
+# затем kill (остаток срока - на выход после kill)
+STOP_ESCALATION = (("signal", 0.3), ("terminate", 0.6), ("kill", 0.9))
+POLL_INTERVAL_SEC = 0.02
+
+
+def send_quit_command(process):
+    """Мягкая остановка ffmpeg с stdin=PIPE: команда "q", как с клавиатуры (дописывает файл и выходит с кодом 0)."""
+    if not process.stdin or process.stdin.closed: return
+    try: process.stdin.write(b"q\n"); process.stdin.flush()
+    except (OSError, ValueError): pass
+    try: process.stdin.close()
+    except (OSError, ValueError): pass
+
+
+def _send_interrupt(process):
+    if os.name == 'nt': process.send_signal(signal.CTRL_C_EVENT)
+    else: process.send_signal(signal.SIGINT)
+
+
+class ProcessSupervisor:
+    """
+    Остановка всех дочерних ffmpeg записи разом: request_stop() мягко останавливает каждый процесс (EOF канала кадров,
+    "q" в stdin), wait() опрашивает их вместе до одного общего срока и доводит оставшихся по STOP_ESCALATION.
+    Время остановки - самый медленный процесс, а не сумма. Потоки чтения stderr процессов заводит владелец при запуске;
+    здесь они только дожидаются EOF.
+    """
+    def __init__(self, logger_func=print, timeout_sec=DEFAULT_PROCESS_STOP_TIMEOUT_SEC):
+        self.logger = logger_func
+        self.timeout_sec = timeout_sec
+        self.entries = []
+        self._stop_requested_at = None
+
+    def add(self, name, process, graceful_stop=None, reader_threads=()):
+        """graceful_stop(process) - мягкая остановка (None - процесс выходит сам, например по EOF уже закрытого канала)."""
+        if process is None: return
+        self.entries.append({"name": name, "process": process, "graceful_stop": graceful_stop,
+                             "reader_threads": [thread for thread in reader_threads if thread], "exit_sec": None, "action": None})
+
+    def request_stop(self):
+        """Мягкая остановка всех процессов без ожидания (пока они дописывают файлы, вызывающий может закрывать свое)."""
+        self._stop_requested_at = time.perf_counter()
+        for entry in self.entries:
+            if entry["process"].poll() is not None: entry["exit_sec"] = 0.0; entry["action"] = "exited"; continue
+            entry["action"] = "graceful"
+            if entry["graceful_stop"] is None: continue
+            try: entry["graceful_stop"](entry["process"])
+            except Exception as e_graceful: self.logger(f"[ProcessSupervisor] Ошибка мягкой остановки {entry['name']}: {e_graceful}")
+
+    def _escalate(self, entry, action):
+        process = entry["process"]
+        self.logger(f"[ProcessSupervisor] {entry['name']} (PID: {process.pid}) не завершился, {action}...")
+        try:
+            if action == "signal": _send_interrupt(process)
+            elif action == "terminate": process.terminate()
+            else: process.kill()
+        except Exception as e_escalate: # ProcessLookupError: процесс как раз вышел
+            self.logger(f"[ProcessSupervisor] Исключение {action} для {entry['name']}: {type(e_escalate).__name__}: {e_escalate}")
+        entry["action"] = action
+
+    def wait(self):
+        """Ждет все процессы до общего срока. Возвращает [{name, returncode, exit_sec, action}] в порядке add()."""
+        if self._stop_requested_at is None: self.request_stop()
+        stages = list(STOP_ESCALATION)
+        while True:
+            elapsed = time.perf_counter() - self._stop_requested_at
+            running = []
+            for entry in self.entries:
+                if entry["exit_sec"] is not None: continue
+                if entry["process"].poll() is not None: entry["exit_sec"] = elapsed
+                else: running.append(entry)
+            if not running or elapsed >= self.timeout_sec: break
+            while stages and elapsed >= stages[0][1] * self.timeout_sec:
+                action = stages.pop(0)[0]
+                for entry in running: self._escalate(entry, action)
+            time.sleep(POLL_INTERVAL_SEC)
+        results = []
+        for entry in self.entries:
+            for thread in entry["reader_threads"]: thread.join(timeout=1.0) # Процесс вышел - в stderr EOF
+            returncode = entry["process"].poll()
+            if returncode is None: self.logger(f"[ProcessSupervisor] {entry['name']} не завершился за {self.timeout_sec} с (после kill).")
+            results.append({"name": entry["name"], "returncode": returncode, "action": entry["action"],
+                            "exit_sec": round(entry["exit_sec"], 3) if entry["exit_sec"] is not None else None})
+        self.logger("[ProcessSupervisor] Остановка процессов: " + ", ".join(
+            f"{result['name']} код {result['returncode']} за {result['exit_sec']} с ({result['action']})" for result in results))
+        return results
+
+    def stop_all(self):
+        self.request_stop()
+        return self.wait()
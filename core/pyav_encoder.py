@@ -0,0 +1,140 @@
+import fractions
+import io
+import os
+import threading
+
+import numpy as np
+
+from config import PIPE_PIXEL_FORMAT_BGR0, PIPE_PIXEL_FORMAT_BGRA, PIPE_PIXEL_FORMAT_BGR24, DEFAULT_CONVERT_THREADS, DEFAULT_VIDEO_PRESET
+from codec_profiles import get_codec_profile
+
+try:
+    import av # PyAV 14+ (reformat с threads, from_numpy_buffer)
+except ImportError: # Без PyAV доступен только бэкенд subprocess
+    av = None
+# SVT-AV1 внутри процесса пишет [info] прямо в stderr приложения; в видео-ffmpeg его заглушает -loglevel error
+os.environ.setdefault("SVT_LOG", "1")
+
+PTS_TIME_BASE = fractions.Fraction(1, 1000) # Метки кадров в мс, как -enc_time_base 1:1000 видео-ffmpeg
+# Формат кадра в памяти -> формат libav; bgr0 импортируется как bgra (альфу swscale при переводе в YUV не читает)
+_FRAME_FORMATS = {PIPE_PIXEL_FORMAT_BGRA: "bgra", PIPE_PIXEL_FORMAT_BGR0: "bgra", PIPE_PIXEL_FORMAT_BGR24: "bgr24"}
+
+_probe_cache = {}
+_probe_lock = threading.Lock()
+
+
+def is_pyav_available():
+    return av is not None
+
+
+def describe_pyav():
+    if av is None: return "PyAV не установлен"
+    libavcodec = ".".join(str(part) for part in av.library_versions.get("libavcodec", ()))
+    return f"PyAV {av.__version__} (libavcodec {libavcodec})"
+
+
+def probe_pyav_codec_profile(name):
+    """
+    Проверяет профиль на сборке libav из PyAV (у нее свой набор кодировщиков, не тот, что у ffmpeg.exe):
+    3 кадра с потолком VBV в mp4 в памяти. Возвращает (True, None) или (False, причина); результат кэшируется.
+    """
+    if av is None: return False, "PyAV не установлен (pip install av)"
+    with _probe_lock:
+        if name in _probe_cache: return _probe_cache[name]
+    profile = get_codec_profile(name)
+    if profile.encoder not in av.codecs_available:
+        result = (False, f"кодировщика {profile.encoder} нет в сборке PyAV")
+    else:
+        try:
+            encoder = PyAVVideoEncoder(io.BytesIO(), 160, 96, profile, 10, maxrate_bps=500000, bufsize_bits=1000000)
+            frame = np.zeros((96, 160, 4), dtype=np.uint8)
+            for index in range(3): encoder.write_frame(frame, index / 10.0)
+            encoder.close()
+            result = (True, None)
+        except Exception as e_probe: result = (False, str(e_probe))
+    with _probe_lock: _probe_cache[name] = result
+    return result
+
+
+class PyAVVideoEncoder:
+    """
+    Кодирование внутри процесса (libav через PyAV) вместо пары видео-ffmpeg + канал кадров.
+    write_frame(frame, timestamp) берет кадр слота (BGRA/BGR24 ndarray, в том числе срез обрезки) без копии:
+    from_numpy_buffer оборачивает память numpy, один проход swscale (reformat) пишет YUV кодировщика,
+    уменьшая до width x height, если кадр больше. PTS - метка захвата в мс от первого кадра (use_timestamps)
+    или номер кадра / framerate. Вызывается из одного потока; close() дописывает задержанные кодировщиком кадры и moov.
+    """
+    def __init__(self, output, width, height, codec_profile, framerate, preset=None, threads=None, crf=None, maxrate_bps=None,
+                 bufsize_bits=None, input_pixel_format=PIPE_PIXEL_FORMAT_BGRA, use_timestamps=True,
+                 convert_threads=DEFAULT_CONVERT_THREADS, container_format='mp4', container_options=None, keyframe_interval_sec=None,
+                 max_b_frames=None):
+        if av is None: raise RuntimeError("PyAV не установлен (pip install av)")
+        self.width = width
+        self.height = height
+        self.codec_profile = codec_profile
+        self.framerate = framerate
+        self.use_timestamps = use_timestamps
+        self.convert_threads = convert_threads
+        self.frame_format = _FRAME_FORMATS.get(input_pixel_format, "bgra")
+        self.frames_encoded = 0
+        self.bytes_written = 0 # Байты закодированных пакетов (для контроллера бюджета вместо -progress total_size)
+        self._start_timestamp = None
+        self._last_pts = -1
+        # Принудительный ключевой кадр на каждой границе сегмента (как -force_key_frames видео-ffmpeg)
+        self.keyframe_interval_ms = int(keyframe_interval_sec * 1000) if keyframe_interval_sec else None
+        self._next_keyframe_pts = 0
+        options = codec_profile.encoder_options(preset or DEFAULT_VIDEO_PRESET, threads, crf, maxrate_bps, bufsize_bits)
+        if max_b_frames is not None: options = dict(options, bf=str(max_b_frames)) # Сегменты Matroska: без B-кадров (см. recording_session)
+        # mp4 с шкалой 1 мс, как -video_track_timescale 1000 видео-ffmpeg; для сегментной записи - format='segment'
+        if container_options is None: container_options = {'video_track_timescale': '1000'} if container_format == 'mp4' else {}
+        self.container = av.open(output, 'w', format=container_format, options=container_options)
+        try:
+            self.stream = self.container.add_stream(codec_profile.encoder, options=options)
+            self.stream.width = width; self.stream.height = height
+            self.stream.pix_fmt = codec_profile.pix_fmt
+            self.stream.time_base = PTS_TIME_BASE; self.stream.codec_context.time_base = PTS_TIME_BASE
+            if codec_profile.mp4_tag: self.stream.codec_context.codec_tag = codec_profile.mp4_tag
+        except Exception:
+            self.container.close(); self.container = None; raise
+
+    @property
+    def closed(self):
+        return self.container is None
+
+    def write_frame(self, frame, timestamp=None):
+        """timestamp - секунды time.perf_counter() момента захвата. Возвращает метку кадра в мс."""
+        if self.use_timestamps:
+            if self._start_timestamp is None: self._start_timestamp = timestamp
+            pts = int(round((timestamp - self._start_timestamp) * 1000.0))
+        else:
+            pts = int(round(self.frames_encoded * 1000.0 / self.framerate))
+        pts = max(pts, self._last_pts + 1) # Два кадра в одну мс: метки должны расти
+        self._last_pts = pts
+        source_frame = av.VideoFrame.from_numpy_buffer(frame, format=self.frame_format)
+        scaled = (source_frame.width, source_frame.height) != (self.width, self.height)
+        yuv_frame = source_frame.reformat(self.width, self.height, self.codec_profile.pix_fmt,
+                                          interpolation="AREA" if scaled else None, threads=self.convert_threads)
+        yuv_frame.pts = pts; yuv_frame.time_base = PTS_TIME_BASE
+        if self.keyframe_interval_ms and pts >= self._next_keyframe_pts:
+            yuv_frame.pict_type = av.video.frame.PictureType.I
+            self._next_keyframe_pts = (pts // self.keyframe_interval_ms + 1) * self.keyframe_interval_ms
+        for packet in self.stream.encode(yuv_frame): self._mux(packet)
+        self.frames_encoded += 1
+        return pts
+
+    def _mux(self, packet):
+        self.bytes_written += packet.size
+        self.container.mux(packet)
+
+    def close(self):
+        """Сбрасывает задержанные кодировщиком кадры и закрывает файл; повторный вызов ничего не делает."""
+        if self.container is None: return
+        container = self.container; self.container = None
+        try:
+            for packet in self.stream.encode(None):
+                self.bytes_written += packet.size; container.mux(packet)
+        finally:
+            container.close()
+
+    def describe(self):
+        return f"{describe_pyav()}, {self.codec_profile.encoder} {self.width}x{self.height}"
@@ -0,0 +1,113 @@
+import math
+import re
+
+from config import DEFAULT_VIDEO_CRF, DEFAULT_SIZE_BUDGET_TOLERANCE, DEFAULT_RATE_CONTROL_INTERVAL_SEC, DEFAULT_RATE_CONTROL_MIN_SEGMENT_SEC
+
+MIN_CRF = 18
+MAX_CRF = 40
+MIN_VIDEO_BITRATE_BPS = 100000  # Потолок VBV не ниже (текст экрана перестает читаться); дальше бюджет держит только CRF
+CONTAINER_OVERHEAD = 0.01       # Доля размера на контейнер mp4 (moov, заголовки)
+RATE_DEADBAND = 0.25            # Отклонение битрейта сегмента от нужного (и потолка от нужного), при котором меняем настройки
+CRF_STEPS_PER_DOUBLING = 6      # x264: CRF +6 - битрейт примерно вдвое меньше
+MAX_CRF_STEP = 4                # Не больше за одну смену сегмента
+VBV_BUFFER_SECONDS = 2.0        # bufsize = maxrate * VBV_BUFFER_SECONDS: короткие всплески (смена слайда) допустимы
+
+
+def parse_bitrate(value):
+    """"128k" / "2M" / 128000 -> бит/с."""
+    if isinstance(value, (int, float)): return int(value)
+    match = re.fullmatch(r"\s*([\d.]+)\s*([kKmM]?)\s*", str(value))
+    if not match: raise ValueError(f"Некорректный битрейт: {value}")
+    multiplier = {"": 1, "k": 1000, "m": 1000000}[match.group(2).lower()]
+    return int(float(match.group(1)) * multiplier)
+
+
+class RateSettings:
+    """Настройки кодировщика одного сегмента: CRF (в единицах x264, см. CodecProfile.quality) с потолком VBV (capped CRF)."""
+    __slots__ = ("crf", "maxrate_bps", "bufsize_bits")
+
+    def __init__(self, crf, maxrate_bps, bufsize_bits):
+        self.crf = crf
+        self.maxrate_bps = maxrate_bps
+        self.bufsize_bits = bufsize_bits
+
+    def describe(self):
+        return f"CRF {self.crf}, maxrate {self.maxrate_bps // 1000} кбит/с"
+
+
+class SizeBudgetController:
+    """
+    Держит итоговый размер записи в бюджете: target_bytes на expected_duration_sec (например, 1.5 ГБ на 3 часа).
+    Бюджет видео = цель * (1 - tolerance / 2) минус звук и контейнер; стартовый потолок VBV - средний битрейт
+    этого бюджета, CRF работает под потолком (статичный экран стоит меньше потолка).
+    update() раз в interval_sec считает нужный битрейт (остаток бюджета / оставшееся время) по реально записанным байтам;
+    если битрейт текущего сегмента ушел от нужного больше чем на RATE_DEADBAND, сдвигает CRF (в обе стороны:
+    неизрасходованный бюджет идет в качество), потолок VBV всегда равен нужному битрейту. Новые настройки
+    применяются к следующему сегменту (не чаще min_segment_sec). Каждое решение пишется в лог и в decisions.
+    """
+    def __init__(self, target_bytes, expected_duration_sec, audio_bitrate_bps=0, tolerance=DEFAULT_SIZE_BUDGET_TOLERANCE,
+                 base_crf=None, interval_sec=DEFAULT_RATE_CONTROL_INTERVAL_SEC, min_segment_sec=DEFAULT_RATE_CONTROL_MIN_SEGMENT_SEC,
+                 logger_func=print):
+        self.target_bytes = int(target_bytes)
+        self.expected_duration_sec = float(expected_duration_sec)
+        self.tolerance = tolerance
+        self.interval_sec = interval_sec
+        self.min_segment_sec = min_segment_sec
+        self.logger = logger_func
+        self.base_crf = int(base_crf if base_crf is not None else DEFAULT_VIDEO_CRF)
+        audio_bytes = audio_bitrate_bps * self.expected_duration_sec / 8.0
+        self.video_budget_bytes = max(0, int(self.target_bytes * (1.0 - tolerance / 2.0) * (1.0 - CONTAINER_OVERHEAD) - audio_bytes))
+        self.audio_bitrate_bps = audio_bitrate_bps
+        self.decisions = []
+        self._overrun_logged = False
+        self._segment_start_bytes = 0
+        self.current = self._settings_for_bitrate(self.base_crf, self.video_budget_bytes * 8.0 / self.expected_duration_sec)
+
+    def _settings_for_bitrate(self, crf, bitrate_bps):
+        maxrate_bps = int(max(MIN_VIDEO_BITRATE_BPS, bitrate_bps))
+        return RateSettings(max(MIN_CRF, min(MAX_CRF, crf)), maxrate_bps, int(maxrate_bps * VBV_BUFFER_SECONDS))
+
+    def describe_budget(self):
+        return (f"цель {self.target_bytes / 1e6:.1f} МБ на {self.expected_duration_sec / 60.0:.1f} мин (±{self.tolerance * 100:.0f}%), "
+                f"видео {self.video_budget_bytes / 1e6:.1f} МБ, звук {self.audio_bitrate_bps // 1000} кбит/с; старт: {self.current.describe()}")
+
+    def update(self, elapsed_sec, video_bytes_written, segment_age_sec):
+        """Новые RateSettings для следующего сегмента или None (оставить текущие)."""
+        if elapsed_sec <= 0: return None
+        remaining_sec = self.expected_duration_sec - elapsed_sec
+        if remaining_sec < self.min_segment_sec:
+            # Запись длиннее ожидаемой (или почти закончилась): держим бюджет на ближайший интервал, не уходя в ноль
+            if remaining_sec <= 0 and not self._overrun_logged:
+                self._overrun_logged = True
+                self.logger(f"[RateControl] Запись длиннее ожидаемых {self.expected_duration_sec / 60.0:.1f} мин: бюджет может быть превышен.")
+            remaining_sec = max(self.min_segment_sec, self.interval_sec)
+        if segment_age_sec < self.min_segment_sec or video_bytes_written <= self._segment_start_bytes: return None # Нет данных сегмента
+        # CRF считается от нужного битрейта как есть (бюджет уже исчерпан - максимальный шаг вверх), потолок - не ниже минимума
+        needed_bps = max(1000.0, (self.video_budget_bytes - video_bytes_written) * 8.0 / remaining_sec)
+        # Битрейт при текущих настройках - по байтам текущего сегмента (общий средний запаздывает за сменой контента)
+        segment_bps = max(1.0, (video_bytes_written - self._segment_start_bytes) * 8.0 / segment_age_sec)
+        projected_bytes = video_bytes_written + segment_bps * max(0.0, self.expected_duration_sec - elapsed_sec) / 8.0
+
+        current = self.current
+        crf = current.crf
+        if segment_bps > needed_bps * (1.0 + RATE_DEADBAND) or segment_bps < needed_bps * (1.0 - RATE_DEADBAND):
+            # x264: +6 CRF примерно вдвое меньше битрейта; шаг ограничен, следующий сегмент уточнит
+            crf_step = int(round(CRF_STEPS_PER_DOUBLING * math.log2(segment_bps / needed_bps)))
+            crf = current.crf + max(-MAX_CRF_STEP, min(MAX_CRF_STEP, crf_step))
+        new_settings = self._settings_for_bitrate(crf, needed_bps)
+        cap_changed = abs(new_settings.maxrate_bps - current.maxrate_bps) > current.maxrate_bps * RATE_DEADBAND
+        # Поднимать потолок, в который сегмент не упирается, бессмысленно (CRF уже на минимуме): лишний сегмент
+        if new_settings.maxrate_bps > current.maxrate_bps and segment_bps < current.maxrate_bps * (1.0 - RATE_DEADBAND): cap_changed = False
+        if new_settings.crf == current.crf and not cap_changed: return None
+        reason = "перерасход" if segment_bps > needed_bps else "запас"
+
+        decision = {"elapsed_sec": round(elapsed_sec, 1), "written_mb": round(video_bytes_written / 1e6, 2),
+                    "projected_mb": round(projected_bytes / 1e6, 2), "segment_kbps": int(segment_bps // 1000),
+                    "needed_kbps": int(needed_bps // 1000), "reason": reason, "crf": new_settings.crf,
+                    "maxrate_kbps": new_settings.maxrate_bps // 1000}
+        self.decisions.append(decision)
+        self.logger(f"[RateControl] {elapsed_sec:.0f}с: записано {decision['written_mb']:.2f} МБ видео, прогноз {decision['projected_mb']:.2f} "
+                    f"из {self.video_budget_bytes / 1e6:.2f} МБ, сегмент {decision['segment_kbps']} / нужно {decision['needed_kbps']} кбит/с "
+                    f"({reason}): {current.describe()} -> {new_settings.describe()}")
+        self.current = new_settings; self._segment_start_bytes = video_bytes_written
+        return new_settings
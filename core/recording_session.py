@@ -0,0 +1,239 @@
+import csv
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+from config import DEFAULT_SEGMENT_DURATION_SEC
+
+SESSION_DIR_PREFIX = "_rec_session_"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+SESSION_STATE_RECORDING = "recording"
+SESSION_STATE_DONE = "done"         # Итоговый mp4 собран
+SESSION_STATE_RECOVERED = "recovered"
+SESSION_STATE_FAILED = "failed"     # Восстановление не удалось: повторно не пробуем, сегменты остаются на диске
+SEGMENT_NUMBER_FORMAT = "%05d"      # Номер сегмента в шаблоне сегментного muxer
+# Видео сегментов без B-кадров: Matroska не хранит DTS, и при переносе в mp4 ffmpeg угадывает их; кроме того, задержка
+# B-кадров при переменной частоте (кадры раз в секунду) дает отрицательный DTS первого кадра в секунды, и muxer сдвигает
+# на него все метки сегмента. Без B-кадров DTS = PTS, метки сегментов совпадают со временем захвата.
+SEGMENT_MAX_B_FRAMES = 0
+
+
+def segment_list_path(pattern):
+    """CSV сегментного muxer для шаблона ..._%05d.mkv: ....csv."""
+    return pattern.replace("_" + SEGMENT_NUMBER_FORMAT + ".mkv", ".csv")
+
+
+def segment_files(pattern):
+    """Файлы сегментов, уже созданные по шаблону, в порядке номеров."""
+    prefix, suffix = pattern.split(SEGMENT_NUMBER_FORMAT, 1)
+    return sorted(glob.glob(glob.escape(prefix) + "[0-9]" * 5 + glob.escape(suffix)))
+
+
+def _read_segment_list(list_path):
+    # CSV сегментного muxer: "файл,начало,конец" в секундах; строка дописывается, когда сегмент закрыт
+    entries = {}
+    try:
+        with open(list_path, newline="", encoding="utf-8") as list_file:
+            for row in csv.reader(list_file):
+                try: entries[os.path.basename(row[0])] = (float(row[1]), float(row[2]))
+                except (IndexError, ValueError): continue
+    except OSError: pass
+    return entries
+
+
+def _get_creation_flags():
+    # Как в FFmpegRecorder: без консольного окна в собранном exe
+    return 0x08000000 if os.name == 'nt' and getattr(sys, 'frozen', False) else 0
+
+
+def probe_start_time(path, ffmpeg_path="ffmpeg"):
+    """Начало файла в секундах из "Duration: ..., start: 9.000000" (ffmpeg -i); None, если не читается."""
+    try:
+        result = subprocess.run([ffmpeg_path, '-hide_banner', '-i', path], capture_output=True, text=True, timeout=30,
+                                encoding='utf-8', errors='ignore', creationflags=_get_creation_flags())
+    except Exception: return None
+    match = re.search(r"start: (-?[\d.]+)", result.stderr)
+    return float(match.group(1)) if match else None
+
+
+class RecordingSession:
+    """
+    Папка одной записи: сегменты Matroska видео и звука (сегментный muxer ffmpeg) и manifest.json с итоговым файлом,
+    частями видео (своя часть у каждого ffmpeg бюджета размера, со смещением первого кадра) и дорожками звука.
+    Метки в сегментах сквозные (reset_timestamps 0), поэтому склейка - список ffconcat с duration из начал сегментов:
+    паузы VFR и границы частей сохраняются без перекодирования. Сегмент, который не успел попасть в CSV
+    (процесс упал), берется с началом из самого файла.
+    """
+    def __init__(self, session_dir, manifest):
+        self.session_dir = session_dir
+        self.manifest = manifest
+
+    @classmethod
+    def create(cls, final_output_file, audio_track_count=0, segment_duration_sec=DEFAULT_SEGMENT_DURATION_SEC, base_dir=None):
+        session_dir = tempfile.mkdtemp(prefix=SESSION_DIR_PREFIX, dir=base_dir)
+        manifest = {"version": MANIFEST_VERSION, "pid": os.getpid(), "created": time.time(), "state": SESSION_STATE_RECORDING,
+                    "final_output": final_output_file, "segment_duration_sec": segment_duration_sec, "video_tag": None,
+                    "video_parts": [], "audio_tracks": [f"audio_{index}" for index in range(audio_track_count)]}
+        session = cls(session_dir, manifest)
+        session._write_manifest()
+        return session
+
+    @classmethod
+    def load(cls, session_dir):
+        """Сессия из manifest.json; нет файла или он поврежден - OSError/ValueError."""
+        with open(os.path.join(session_dir, MANIFEST_NAME), "r", encoding="utf-8") as manifest_file: manifest = json.load(manifest_file)
+        if manifest.get("version") != MANIFEST_VERSION: raise ValueError(f"Неизвестная версия manifest: {manifest.get('version')}")
+        return cls(session_dir, manifest)
+
+    def _write_manifest(self):
+        # Через временный файл: manifest не должен оказаться обрезанным, если процесс упадет во время записи
+        manifest_path = os.path.join(self.session_dir, MANIFEST_NAME)
+        with open(manifest_path + ".tmp", "w", encoding="utf-8") as manifest_file: json.dump(self.manifest, manifest_file, ensure_ascii=False, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def update_manifest(self, **fields):
+        self.manifest.update(fields); self._write_manifest()
+
+    @property
+    def state(self):
+        return self.manifest.get("state")
+
+    def set_state(self, state):
+        self.update_manifest(state=state)
+
+    def _pattern(self, name):
+        return os.path.join(self.session_dir, f"{name}_{SEGMENT_NUMBER_FORMAT}.mkv")
+
+    def add_video_part(self, offset_sec=0.0):
+        """Новая часть видео (один процесс кодирования); смещение уточняется set_video_part_offset. Возвращает шаблон файлов."""
+        name = f"video_{len(self.manifest['video_parts']):02d}"
+        self.manifest["video_parts"].append({"name": name, "offset": offset_sec}); self._write_manifest()
+        return self._pattern(name)
+
+    def _find_video_part(self, pattern):
+        for part in self.manifest["video_parts"]:
+            if self._pattern(part["name"]) == pattern: return part
+        return None
+
+    def set_video_part_offset(self, pattern, offset_sec):
+        part = self._find_video_part(pattern)
+        if part is not None: part["offset"] = offset_sec; self._write_manifest()
+
+    def remove_video_part(self, pattern):
+        # Часть, не получившая ни одного кадра (остановка до подмены сегмента)
+        part = self._find_video_part(pattern)
+        if part is None: return
+        self.manifest["video_parts"].remove(part); self._write_manifest()
+        for path in segment_files(pattern) + [segment_list_path(pattern)]:
+            if os.path.exists(path): os.remove(path)
+
+    def audio_track_pattern(self, index):
+        return self._pattern(self.manifest["audio_tracks"][index])
+
+    def segment_muxer_args(self, pattern):
+        """Выходные опции ffmpeg: сегменты Matroska по шаблону с CSV-списком (последний аргумент - шаблон)."""
+        return ['-f', 'segment', '-segment_time', str(self.manifest["segment_duration_sec"]), '-segment_format', 'matroska',
+                '-reset_timestamps', '0', '-segment_list', segment_list_path(pattern), '-segment_list_type', 'csv', pattern]
+
+    def segment_muxer_options(self, pattern):
+        """Те же опции для av.open(pattern, format="segment") бэкенда pyav."""
+        return {'segment_time': str(self.manifest["segment_duration_sec"]), 'segment_format': 'matroska', 'reset_timestamps': '0',
+                'segment_list': segment_list_path(pattern), 'segment_list_type': 'csv'}
+
+    def output_size(self, pattern):
+        return sum(os.path.getsize(path) for path in segment_files(pattern) if os.path.exists(path))
+
+    def has_segments(self):
+        return any(segment_files(self._pattern(part["name"])) for part in self.manifest["video_parts"])
+
+    def _collect_part_segments(self, pattern, offset_sec, ffmpeg_path):
+        # -> [(путь, начало на общей шкале, закрыт, начало в метках файла или None)]: начало из CSV,
+        # для незакрытого сегмента - из файла (не читается - конец предыдущего, метка файла неизвестна)
+        listed = _read_segment_list(segment_list_path(pattern))
+        segments = []; previous_end = None
+        for path in segment_files(pattern):
+            if os.path.basename(path) in listed: start, previous_end = listed[os.path.basename(path)]; file_start = start
+            elif ffmpeg_path is None: continue
+            else:
+                if os.path.getsize(path) == 0: continue
+                start = file_start = probe_start_time(path, ffmpeg_path)
+                if start is None: start = previous_end if previous_end is not None else 0.0
+            segments.append((path, offset_sec + start, os.path.basename(path) in listed, file_start))
+        return segments
+
+    def collect_segments(self, name, ffmpeg_path="ffmpeg"):
+        """
+        Сегменты "video" (все части по порядку) или дорожки звука "audio_N":
+        [(путь, начало на общей шкале, закрыт, начало в метках файла или None)].
+        ffmpeg_path=None - только закрытые (уже в CSV): их можно читать, пока запись идет.
+        """
+        if name == "video": sources = [(self._pattern(part["name"]), part["offset"]) for part in self.manifest["video_parts"]]
+        else: sources = [(self._pattern(name), 0.0)]
+        segments = []
+        for pattern, offset_sec in sources:
+            part_segments = self._collect_part_segments(pattern, offset_sec, ffmpeg_path)
+            segments.extend(part_segments)
+            if ffmpeg_path is None and len(part_segments) < len(segment_files(pattern)): break # Дальше - незакрытый сегмент
+        return segments
+
+    def track_end(self, name):
+        """Конец "video" (последней части) или "audio_N" на общей шкале по CSV; None - последний сегмент не закрыт."""
+        if name == "video":
+            if not self.manifest["video_parts"]: return None
+            part = self.manifest["video_parts"][-1]; pattern, offset_sec = self._pattern(part["name"]), part["offset"]
+        else: pattern, offset_sec = self._pattern(name), 0.0
+        paths = segment_files(pattern)
+        listed = _read_segment_list(segment_list_path(pattern))
+        if not paths or os.path.basename(paths[-1]) not in listed: return None
+        return offset_sec + listed[os.path.basename(paths[-1])][1]
+
+    def write_concat_list(self, list_name, segments):
+        """
+        ffconcat из collect_segments; duration каждого файла - разница начал (шкала времени без перекодирования).
+        inpoint - начало в метках файла: concat вычитает его вместо start_time, а у сегмента из пары кадров
+        (статичный экран) ffmpeg start_time не определяет - без inpoint сегмент сдвинулся бы на свое начало.
+        """
+        list_path = os.path.join(self.session_dir, list_name)
+        with open(list_path, "w", encoding="utf-8") as list_file:
+            list_file.write("ffconcat version 1.0\n")
+            for index, segment in enumerate(segments):
+                list_file.write("file '" + segment[0].replace("\\", "/").replace("'", "'\\''") + "'\n")
+                if segment[3] is not None: list_file.write(f"inpoint {segment[3]:.6f}\n")
+                if index + 1 < len(segments) and segments[index + 1][1] > segment[1]:
+                    list_file.write(f"duration {segments[index + 1][1] - segment[1]:.3f}\n")
+        return list_path
+
+    def build_concat_list(self, name, ffmpeg_path="ffmpeg"):
+        """ffconcat всех сегментов "video" или "audio_N" для mux при остановке; None, если сегментов нет."""
+        segments = self.collect_segments(name, ffmpeg_path)
+        return self.write_concat_list(f"{name}.ffconcat", segments) if segments else None
+
+    def remove(self):
+        shutil.rmtree(self.session_dir, ignore_errors=True)
+
+
+def _is_writer_alive(manifest):
+    # PID мог достаться другому процессу (перезагрузка): он считается писателем, только если запущен до создания сессии
+    try: return psutil.Process(manifest.get("pid", 0)).create_time() <= manifest.get("created", 0) + 1.0
+    except (psutil.Error, ValueError): return False
+
+
+def find_unfinished_sessions(base_dir=None):
+    """Сессии, запись которых оборвалась (состояние recording, процесс записи уже не существует), от старых к новым."""
+    sessions = []
+    for session_dir in glob.glob(os.path.join(glob.escape(base_dir or tempfile.gettempdir()), SESSION_DIR_PREFIX + "*")):
+        try: session = RecordingSession.load(session_dir)
+        except (OSError, ValueError): continue
+        if session.state != SESSION_STATE_RECORDING: continue
+        if _is_writer_alive(session.manifest): continue
+        sessions.append(session)
+    return sorted(sessions, key=lambda session: session.manifest.get("created", 0))
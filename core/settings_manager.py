@@ -49,6 +49,24 @@ def save_settings(settings_dict, logger_func=print):
         json.dump(settings_dict, f, ensure_ascii=False, indent=4)
     logger_func(f"[SettingsManager] Настройки сохранены в: {settings_path}")
 
+WINDOW_CROPS_KEY = "window_crops"
+
+def get_window_crop(settings_dict, window_title):
+    """
+    Возвращает сохраненную обрезку для заголовка окна или None.
+    Обрезка - словарь x, y, width, height (относительно клиентской области)
+    и reference_width, reference_height (размер клиентской области, для которого она задана).
+    """
+    if not settings_dict or not window_title: return None
+    return settings_dict.get(WINDOW_CROPS_KEY, {}).get(window_title)
+
+def set_window_crop(settings_dict, window_title, crop_dict):
+    """Сохраняет обрезку для заголовка окна в словаре настроек (crop_dict None - удалить). Файл не записывает."""
+    if not window_title: return
+    window_crops = settings_dict.setdefault(WINDOW_CROPS_KEY, {})
+    if crop_dict: window_crops[window_title] = dict(crop_dict)
+    else: window_crops.pop(window_title, None)
+
 # Пример использования (можно раскомментировать для теста)
 if __name__ == '__main__':
     # Тестовая функция логирования
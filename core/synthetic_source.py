@@ -0,0 +1,114 @@
+import time
+
+import cv2
+import numpy as np
+
+from frame_buffers import BGRA_BYTES_PER_PIXEL
+from frame_source import FrameSource, CAPABILITY_SYNTHETIC
+from config import CAPTURE_METHOD_SYNTHETIC, DEFAULT_CAPTURE_RING_DEPTH
+
+SYNTHETIC_PROFILE_STATIC = "static"     # Один неподвижный слайд
+SYNTHETIC_PROFILE_SCROLL = "scroll"     # Прокрутка страницы текста
+SYNTHETIC_PROFILE_NOISE = "noise"       # Шум во весь кадр (худший случай для кодировщика)
+SYNTHETIC_PROFILE_PERIODIC = "periodic" # Слайды, сменяющиеся раз в period_sec
+SYNTHETIC_PROFILE_MEETING = "meeting"   # Слайд + плитка камеры с движением в углу
+SYNTHETIC_PROFILES = (SYNTHETIC_PROFILE_STATIC, SYNTHETIC_PROFILE_SCROLL, SYNTHETIC_PROFILE_NOISE,
+                      SYNTHETIC_PROFILE_PERIODIC, SYNTHETIC_PROFILE_MEETING)
+
+NOISE_POOL_SIZE = 8 # Различных кадров шума; больше, чем опорных кадров x264, поэтому повтор не помогает кодировщику
+
+
+def render_text_page(width, height, seed=1, background=245, ink=40):
+    """Страница текста (слайд или документ) BGRA: строки случайных "слов" шрифтом, масштабированным под высоту кадра."""
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, BGRA_BYTES_PER_PIXEL), background, dtype=np.uint8)
+    line_height = max(12, min(height, width) // 45)
+    font_scale = line_height / 30.0
+    for y in range(line_height * 2, height - line_height, line_height):
+        words = " ".join("".join(chr(c) for c in rng.integers(97, 123, rng.integers(2, 9))) for _ in range(12))
+        cv2.putText(page, words, (line_height, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (ink, ink, ink, 255), 1, cv2.LINE_AA)
+    return page
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+    Источник тестовых кадров без захвата ОС: подключается к FFmpegRecorder так же, как GDI граббер,
+    и делает пропускную способность кодировщика и конвейера измеримой на любой машине.
+    Все изображения рисуются один раз в open(); grab_into только копирует готовые массивы
+    срезами (np.copyto / np.add с out), без выделения памяти на кадр.
+    framerate задает скорость движения по реальному времени; framerate=None - шаг движения на каждый кадр
+    (воспроизводимо, для бенчмарков "как можно быстрее").
+    """
+    name = CAPTURE_METHOD_SYNTHETIC
+    capabilities = frozenset((CAPABILITY_SYNTHETIC,))
+
+    def __init__(self, width=1920, height=1080, framerate=None, profile=SYNTHETIC_PROFILE_SCROLL, period_sec=5.0,
+                 scroll_pixels_per_frame=4, seed=1, logger_func=print, zero_copy=True, ring_depth=DEFAULT_CAPTURE_RING_DEPTH):
+        super().__init__(logger_func, zero_copy, ring_depth)
+        if profile not in SYNTHETIC_PROFILES:
+            raise ValueError(f"Неизвестный профиль синтетики: {profile} (доступны: {', '.join(SYNTHETIC_PROFILES)})")
+        self.source_width = width // 2 * 2
+        self.source_height = height // 2 * 2
+        self.framerate = framerate
+        self.profile = profile
+        self.period_sec = period_sec
+        self.scroll_pixels_per_frame = scroll_pixels_per_frame
+        self.seed = seed
+        self.frames_generated = 0
+        self._images = []
+        self._tile_base = None
+        self._tile_rect = None
+        self._start_time = None
+
+    def open(self):
+        w, h = self.source_width, self.source_height
+        if self.profile == SYNTHETIC_PROFILE_SCROLL:
+            page = render_text_page(w, h, self.seed)
+            self._images = [np.concatenate((page, page))] # Страница дважды: окно прокрутки скользит по кругу без шва
+        elif self.profile == SYNTHETIC_PROFILE_NOISE:
+            rng = np.random.default_rng(self.seed)
+            self._images = [rng.integers(0, 256, (h, w, BGRA_BYTES_PER_PIXEL), dtype=np.uint8) for _ in range(NOISE_POOL_SIZE)]
+        elif self.profile == SYNTHETIC_PROFILE_PERIODIC:
+            self._images = [render_text_page(w, h, self.seed + index) for index in range(3)]
+        else:
+            self._images = [render_text_page(w, h, self.seed)]
+        if self.profile == SYNTHETIC_PROFILE_MEETING:
+            tile_h, tile_w = h // 4, w // 4
+            margin = max(12, min(h, w) // 45)
+            self._tile_rect = (h - tile_h - margin, w - tile_w - margin, tile_h, tile_w)
+            yy, xx = np.mgrid[0:tile_h, 0:tile_w]
+            # Два канала с разным направлением градиента; движение - сдвиг яркости с переполнением uint8
+            self._tile_base = np.stack(((xx + yy) % 256, (xx - yy) % 256), axis=-1).astype(np.uint8)
+        self.width, self.height = w, h
+        self.frames_generated = 0; self._start_time = time.perf_counter()
+        self.is_initialized = True
+        self.logger(f"[SyntheticSource] Профиль '{self.profile}' {w}x{h} готов.")
+        return True
+
+    def _frame_index(self):
+        if self.framerate: return int((time.perf_counter() - self._start_time) * self.framerate)
+        return self.frames_generated
+
+    def grab_into(self, out):
+        if out.shape[0] != self.height or out.shape[1] != self.width: return False
+        index = self._frame_index()
+        if self.profile == SYNTHETIC_PROFILE_SCROLL:
+            page = self._images[0]; h = self.height
+            offset = (index * self.scroll_pixels_per_frame) % h
+            np.copyto(out, page[offset:offset + h])
+        elif self.profile == SYNTHETIC_PROFILE_NOISE:
+            np.copyto(out, self._images[index % NOISE_POOL_SIZE])
+        elif self.profile == SYNTHETIC_PROFILE_PERIODIC:
+            frames_per_period = max(1, int(self.period_sec * (self.framerate or 25)))
+            np.copyto(out, self._images[(index // frames_per_period) % len(self._images)])
+        else:
+            np.copyto(out, self._images[0])
+        if self._tile_base is not None:
+            tile_y, tile_x, tile_h, tile_w = self._tile_rect
+            np.add(self._tile_base, np.uint8(index * 3 % 256), out=out[tile_y:tile_y + tile_h, tile_x:tile_x + tile_w, 1:3])
+        self.frames_generated += 1
+        return True
+
+    def close(self):
+        self._images = []; self._tile_base = None
+        super().close()
@@ -7,6 +7,10 @@ import numpy as np
 import cv2 
 import ctypes
 
+from frame_buffers import dib_frame_view, FrameBufferRing, FrameSlot
+from frame_source import FrameSource, CAPABILITY_WINDOW, CAPABILITY_ZERO_COPY, CAPABILITY_RESIZE
+from config import DEFAULT_CAPTURE_RING_DEPTH, CAPTURE_METHOD_GDI
+
 BI_RGB = 0
 DIB_RGB_COLORS = 0
 
@@ -77,21 +81,44 @@ def prevent_minimize_loop(hwnd_to_protect, stop_event, logger_func=print):
         time.sleep(0.05) # Проверяем чаще
     logger_func(f"[WindowsUtils] Защита от сворачивания для HWND {hwnd_to_protect} остановлена.")
 
-class WindowFrameGrabberGDI:
-    def __init__(self, hwnd, logger_func=print):
+class WindowFrameGrabberGDI(FrameSource):
+    name = CAPTURE_METHOD_GDI
+    capabilities = frozenset((CAPABILITY_WINDOW, CAPABILITY_ZERO_COPY, CAPABILITY_RESIZE))
+
+    def __init__(self, hwnd, logger_func=print, zero_copy=True, ring_depth=DEFAULT_CAPTURE_RING_DEPTH):
+        # zero_copy=True: кадр - BGRA-представление памяти DIBSection слота кольца (без копий),
+        # zero_copy=False: прежний путь с копией и cv2.cvtColor в BGR.
+        FrameSource.__init__(self, logger_func, zero_copy, ring_depth)
         self.hwnd = hwnd
-        self.logger = logger_func
-        self.width = 0      
-        self.height = 0     
         self.original_width_recorded = 0 # Для сравнения при проверке размера
         self.original_height_recorded = 0
         
-        self.saveDC_mem = None   
-        self.hBitmap_dib = None  
-        self.pBitmapBits = ctypes.c_void_p() # Инициализируем здесь, чтобы был всегда доступен
-        self.is_initialized = False
+        # Кольцо DIBSection: у каждого слота свой memory DC с выбранным в него битмапом,
+        # поэтому PrintWindow следующего кадра не ждет, пока предыдущий уйдет в ffmpeg.
+        self.frame_ring = FrameBufferRing(ring_depth, self._allocate_dib_slot, self._free_dib_slot, logger_func)
         self._initialize_resources_with_retry()
 
+    def open(self):
+        if not self.is_initialized: self._initialize_resources_with_retry()
+        return self.is_initialized and self.width > 0 and self.height > 0
+
+    def is_alive(self):
+        return bool(self.hwnd and win32gui.IsWindow(self.hwnd))
+
+    def bytes_copied_per_frame(self):
+        # PrintWindow рисует прямо в DIBSection слота, кадр - представление этой памяти
+        return 0
+
+    def grab_into(self, out):
+        # Захват с копией в буфер вызывающего; для записи используется acquire_frame без копии
+        slot = self.acquire_frame()
+        if slot is None: return False
+        try:
+            if slot.frame.shape != out.shape: return False
+            np.copyto(out, slot.frame); return True
+        finally:
+            self.frame_ring.release(slot)
+
     def _get_current_client_rect_robust(self, max_retries=3, delay=0.1):
         for attempt in range(max_retries):
             if not self.hwnd or not win32gui.IsWindow(self.hwnd):
@@ -117,72 +144,104 @@ class WindowFrameGrabberGDI:
         return None
 
 
-    def _initialize_resources_with_retry(self):
-        self.release_resources() 
-
-        client_rect = self._get_current_client_rect_robust()
-        if client_rect is None:
-            self.logger(f"[FrameGrabberGDI] Не удалось получить валидные размеры окна для инициализации HWND {self.hwnd}.")
-            self.is_initialized = False; return
-
-        original_width = client_rect[2] - client_rect[0]
-        original_height = client_rect[3] - client_rect[1]
-
-        self.width = (original_width // 2) * 2
-        self.height = (original_height // 2) * 2
-        self.original_width_recorded = original_width
-        self.original_height_recorded = original_height
-
-
-        if self.width <= 0 or self.height <= 0:
-            self.logger(f"[FrameGrabberGDI] Неверные размеры после округления для {self.hwnd}: {self.width}x{self.height} (исходные: {original_width}x{original_height})")
-            self.is_initialized = False; return
-        
+    def _allocate_dib_slot(self, index, width, height):
+        mem_dc = None
         try:
             hScreenDC_raw = win32gui.GetDC(0) 
             if not hScreenDC_raw:
-                 self.logger(f"[FrameGrabberGDI] GetDC(0) FAILED. Error: {win32api.GetLastError()}"); return
+                 self.logger(f"[FrameGrabberGDI] GetDC(0) FAILED. Error: {win32api.GetLastError()}"); return None
 
-            self.saveDC_mem = win32gui.CreateCompatibleDC(hScreenDC_raw)
+            mem_dc = win32gui.CreateCompatibleDC(hScreenDC_raw)
             win32gui.ReleaseDC(0, hScreenDC_raw) # Освобождаем DC экрана сразу
-            if not self.saveDC_mem:
-                self.logger(f"[FrameGrabberGDI] CreateCompatibleDC FAILED. Error: {win32api.GetLastError()}"); return
+            if not mem_dc:
+                self.logger(f"[FrameGrabberGDI] CreateCompatibleDC FAILED. Error: {win32api.GetLastError()}"); return None
             
             bmi = BITMAPINFO()
             bmi.bmiHeader.biSize = ctypes.sizeof(BITMAPINFOHEADER)
-            bmi.bmiHeader.biWidth = self.width 
-            bmi.bmiHeader.biHeight = -self.height  
+            bmi.bmiHeader.biWidth = width 
+            bmi.bmiHeader.biHeight = -height  
             bmi.bmiHeader.biPlanes = 1
             bmi.bmiHeader.biBitCount = 32 
             bmi.bmiHeader.biCompression = BI_RGB
             
-            # self.pBitmapBits уже инициализирован в __init__
+            bits_ptr = ctypes.c_void_p()
             win32api.SetLastError(0)
-            self.hBitmap_dib = ctypes.windll.gdi32.CreateDIBSection(
-                self.saveDC_mem, ctypes.byref(bmi), DIB_RGB_COLORS, 
-                ctypes.byref(self.pBitmapBits), None, 0
+            hbitmap = ctypes.windll.gdi32.CreateDIBSection(
+                mem_dc, ctypes.byref(bmi), DIB_RGB_COLORS, 
+                ctypes.byref(bits_ptr), None, 0
             )
             err_dib = win32api.GetLastError()
 
-            if not self.hBitmap_dib:
-                self.logger(f"[FrameGrabberGDI] CreateDIBSection ({self.width}x{self.height}, 32bpp) FAILED. Error: {err_dib}")
-                win32gui.DeleteDC(self.saveDC_mem); self.saveDC_mem = None; return
+            if not hbitmap:
+                self.logger(f"[FrameGrabberGDI] CreateDIBSection слота {index} ({width}x{height}, 32bpp) FAILED. Error: {err_dib}")
+                win32gui.DeleteDC(mem_dc); return None
             
-            hOldBitmap = win32gui.SelectObject(self.saveDC_mem, self.hBitmap_dib)
+            hOldBitmap = win32gui.SelectObject(mem_dc, hbitmap)
             if hOldBitmap == 0 or hOldBitmap is None : # Проверка на None тоже
-                self.logger(f"[FrameGrabberGDI] SelectObject(hBitmap_dib) FAILED. Error: {win32api.GetLastError()}")
-                ctypes.windll.gdi32.DeleteObject(self.hBitmap_dib); self.hBitmap_dib = None
-                win32gui.DeleteDC(self.saveDC_mem); self.saveDC_mem = None; return
-            
-            self.is_initialized = True
-            self.logger(f"[FrameGrabberGDI] Ресурсы DIBSection инициализированы для {self.hwnd} ({self.width}x{self.height}, исходные: {original_width}x{original_height}).")
+                self.logger(f"[FrameGrabberGDI] SelectObject(hbitmap) слота {index} FAILED. Error: {win32api.GetLastError()}")
+                ctypes.windll.gdi32.DeleteObject(hbitmap)
+                win32gui.DeleteDC(mem_dc); return None
+
+            frame_view = dib_frame_view(bits_ptr.value, width, height)
+            if frame_view is None:
+                self.logger(f"[FrameGrabberGDI] CreateDIBSection слота {index} вернул NULL указатель на биты.")
+                win32gui.DeleteDC(mem_dc); ctypes.windll.gdi32.DeleteObject(hbitmap); return None
+            return FrameSlot(index, frame_view, handle=(mem_dc, hbitmap))
 
         except Exception as e:
-            self.logger(f"[FrameGrabberGDI] Исключение при инициализации DIBSection: {e}")
+            self.logger(f"[FrameGrabberGDI] Исключение при создании DIBSection слота {index}: {e}")
             import traceback; self.logger(traceback.format_exc())
-            self.release_resources() # Убедимся, что все очищено при ошибке
+            if mem_dc:
+                try: win32gui.DeleteDC(mem_dc)
+                except: pass
+            return None
 
-    def grab_frame(self):
+    def _free_dib_slot(self, slot):
+        mem_dc, hbitmap = slot.handle
+        slot.frame = None # Представление станет невалидным после DeleteObject
+        # Сначала удаляем DC: битмап, выбранный в DC, DeleteObject не освобождает
+        if mem_dc:
+            try: win32gui.DeleteDC(mem_dc)
+            except: pass
+        if hbitmap:
+            try: ctypes.windll.gdi32.DeleteObject(hbitmap)
+            except: pass
+
+    def _initialize_resources_with_retry(self):
+        # Кольцо не освобождаем заранее: слоты "в полете" еще может читать потребитель, allocate() дождется их возврата
+        self.is_initialized = False
+
+        client_rect = self._get_current_client_rect_robust()
+        if client_rect is None:
+            self.logger(f"[FrameGrabberGDI] Не удалось получить валидные размеры окна для инициализации HWND {self.hwnd}.")
+            self.is_initialized = False; return
+
+        original_width = client_rect[2] - client_rect[0]
+        original_height = client_rect[3] - client_rect[1]
+
+        self.width = (original_width // 2) * 2
+        self.height = (original_height // 2) * 2
+        self.original_width_recorded = original_width
+        self.original_height_recorded = original_height
+
+
+        if self.width <= 0 or self.height <= 0:
+            self.logger(f"[FrameGrabberGDI] Неверные размеры после округления для {self.hwnd}: {self.width}x{self.height} (исходные: {original_width}x{original_height})")
+            self.is_initialized = False; return
+        
+        # Все кольцо переразмещается разом; слоты "в полете" сначала возвращаются потребителем
+        if not self.frame_ring.allocate(self.width, self.height):
+            self.logger(f"[FrameGrabberGDI] Не удалось разместить кольцо DIBSection ({self.frame_ring.depth} шт.) для {self.hwnd}.")
+            self.is_initialized = False; return
+
+        self.is_initialized = True
+        self.logger(f"[FrameGrabberGDI] Ресурсы DIBSection инициализированы для {self.hwnd} ({self.width}x{self.height}, исходные: {original_width}x{original_height}, кольцо: {self.frame_ring.depth}).")
+
+    def acquire_frame(self, timeout=1.0):
+        """
+        Захватывает кадр в свободный слот кольца и возвращает слот (slot.frame - BGRA (h, w, 4)).
+        Слот принадлежит вызывающему до release_frame(slot); остальные слоты тем временем доступны для захвата.
+        """
         if not self.is_initialized or not self.hwnd or not win32gui.IsWindow(self.hwnd):
             self.logger(f"[FrameGrabberGDI HWND:{self.hwnd}] Захват невозможен: не инициализирован или окно/HWND невалидны. Попытка переинициализации...")
             self._initialize_resources_with_retry()
@@ -194,7 +253,7 @@ class WindowFrameGrabberGDI:
         # Проверка изменения размера клиентской области
         current_client_rect_check = self._get_current_client_rect_robust(max_retries=1, delay=0.01) # Быстрая проверка
         if current_client_rect_check is None:
-            self.logger(f"[FrameGrabberGDI HWND:{self.hwnd}] grab_frame: Не удалось получить текущие размеры окна. Граббер деинициализирован.")
+            self.logger(f"[FrameGrabberGDI HWND:{self.hwnd}] acquire_frame: Не удалось получить текущие размеры окна. Граббер деинициализирован.")
             self.is_initialized = False; return None
 
         original_w_current = current_client_rect_check[2] - current_client_rect_check[0]
@@ -208,54 +267,46 @@ class WindowFrameGrabberGDI:
                 self.logger(f"[FrameGrabberGDI HWND:{self.hwnd}] Переинициализация из-за размера не удалась.")
                 return None 
         
-        # Дополнительная проверка на случай, если инициализация не удалась, а мы все еще здесь
-        if not self.is_initialized or self.width <= 0 or self.height <= 0 or not self.saveDC_mem or not self.hBitmap_dib:
-             self.logger(f"[FrameGrabberGDI HWND:{self.hwnd}] grab_frame: Состояние граббера невалидно перед PrintWindow.")
-             self.is_initialized = False; return None
-
+        slot = self.frame_ring.acquire(timeout=timeout)
+        if slot is None:
+            # Все слоты "в полете" (потребитель не успевает) - пропускаем тик, это не ошибка граббера
+            return None
 
         flags = 1 # PW_CLIENTONLY
         user32 = ctypes.windll.user32
         win32api.SetLastError(0)
         
-        result = user32.PrintWindow(self.hwnd, self.saveDC_mem, flags)
+        result = user32.PrintWindow(self.hwnd, slot.handle[0], flags)
         err_printwindow = win32api.GetLastError()
 
         if result == 0: 
+            self.frame_ring.release(slot)
             self.logger(f"[FrameGrabberGDI] PrintWindow FAILED для HWND {self.hwnd}. Result: {result}, LastError: {err_printwindow}. Граббер деинициализирован.")
             self.is_initialized = False # Считаем это ошибкой, требующей переинициализации
             return None
+        slot.timestamp = time.perf_counter() # Монотонное время захвата, идет с кадром до ffmpeg
+        return slot
+
+    def release_frame(self, slot):
+        self.frame_ring.release(slot)
 
+    def grab_frame(self):
+        # Совместимый интерфейс: один кадр без удержания слота.
+        slot = self.acquire_frame()
+        if slot is None: return None
         try:
-            if not self.pBitmapBits or self.pBitmapBits.value is None:
-                self.logger("[FrameGrabberGDI] pBitmapBits NULL после PrintWindow (неожиданно).")
-                self.is_initialized = False; return None
-
-            buffer_size = self.width * self.height * 4 
-            image_bytes = ctypes.string_at(self.pBitmapBits.value, buffer_size)
-            img_bgra = np.frombuffer(image_bytes, dtype=np.uint8).reshape((self.height, self.width, 4))
-            return cv2.cvtColor(img_bgra, cv2.COLOR_BGRA2BGR)
-            
+            if self.zero_copy:
+                # Слот сразу возвращается в кольцо; представление валидно, пока слот не будет захвачен повторно
+                return slot.frame
+            return cv2.cvtColor(slot.frame, cv2.COLOR_BGRA2BGR)
         except Exception as e: 
             self.logger(f"[FrameGrabberGDI] Ошибка при доступе к данным DIBSection: {e}")
             self.is_initialized = False; return None
+        finally:
+            self.frame_ring.release(slot)
 
     def release_resources(self):
-        if self.hBitmap_dib:
-            try: ctypes.windll.gdi32.DeleteObject(self.hBitmap_dib)
-            except: pass 
-            self.hBitmap_dib = None
-        
-        # pBitmapBits сам не освобождается, он указывает на память, управляемую hBitmap_dib
-        # Когда hBitmap_dib удален, эта память становится невалидной.
-        # Просто сбрасываем указатель.
-        if hasattr(self, 'pBitmapBits'): self.pBitmapBits.value = None 
-
-        if self.saveDC_mem:
-            try: win32gui.DeleteDC(self.saveDC_mem)
-            except: pass
-            self.saveDC_mem = None
-        
+        if hasattr(self, 'frame_ring'): self.frame_ring.free_all()
         self.is_initialized = False
         self.width = 0; self.height = 0
         self.original_width_recorded = 0; self.original_height_recorded = 0